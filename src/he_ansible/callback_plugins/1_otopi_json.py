@@ -25,17 +25,51 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import atexit
 import io
-import json
 import os
 import sys
+import threading
 
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))  # noqa: E402
-from constants import AnsibleCallback
-from constants import Const as ansiblecons
+_HE_ANSIBLE_DIR = os.path.dirname(os.path.dirname(__file__))
+if _HE_ANSIBLE_DIR not in sys.path:
+    sys.path.append(_HE_ANSIBLE_DIR)
+import framing  # noqa: E402
+from constants import AnsibleCallback  # noqa: E402
+from constants import Const as ansiblecons  # noqa: E402
 
-from ansible import constants as C
-from ansible.plugins.callback import CallbackBase
+from ansible import constants as C  # noqa: E402
+from ansible.plugins.callback import CallbackBase  # noqa: E402
+
+
+# Write the buffered messages once they are this big
+_BUFFER_SIZE = 64 * 1024
+
+# Never kept in the buffer
+_URGENT_TYPES = (
+    AnsibleCallback.ERROR,
+    AnsibleCallback.RESULT,
+)
+
+
+class _Flusher(threading.Thread):
+    """Flush the buffer of a CallbackModule every interval seconds."""
+
+    def __init__(self, callback, interval):
+        super(_Flusher, self).__init__(
+            name='otopi-json-flusher',
+            daemon=True,
+        )
+        self._callback = callback
+        self._interval = interval
+        self._stop = threading.Event()
+
+    def run(self):
+        while not self._stop.wait(self._interval):
+            self._callback.flush()
+
+    def stop(self):
+        self._stop.set()
 
 
 class CallbackModule(CallbackBase):
@@ -59,7 +93,65 @@ class CallbackModule(CallbackBase):
             )
             self._fd = None
         else:
-            self._fd = io.open(OTOPI_CALLBACK_OF, mode='w', encoding='utf8',)
+            self._fd = io.open(OTOPI_CALLBACK_OF, mode='wb')
+        self._buffer = []
+        self._buffered = 0
+        self._lock = threading.Lock()
+        self._flusher = None
+        try:
+            interval = float(
+                os.environ.get(
+                    AnsibleCallback.OTOPI_CALLBACK_FLUSH_INTERVAL,
+                    0
+                )
+            )
+        except ValueError:
+            interval = 0
+        self._spill_dir = os.environ.get(AnsibleCallback.SPILL_DIR)
+        try:
+            self._spill_size = int(
+                os.environ.get(AnsibleCallback.SPILL_SIZE, 0)
+            )
+        except ValueError:
+            self._spill_size = 0
+        if self._fd and interval > 0:
+            self._flusher = _Flusher(self, interval)
+            self._flusher.start()
+            atexit.register(self._close)
+
+    def _close(self):
+        self._flusher.stop()
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._buffer:
+                try:
+                    self._fd.write(b''.join(self._buffer))
+                    self._fd.flush()
+                except Exception as e:
+                    self._display.error(
+                        u'Error writing JSON data: {e}'.format(e=str(e))
+                    )
+                self._buffer = []
+                self._buffered = 0
+
+    def _spill(self, result):
+        """Return a reference to result if it is big, or result."""
+        # Only for failed and registered results
+        import spill
+        try:
+            reference = spill.spill(
+                result,
+                self._spill_dir,
+                self._spill_size,
+            )
+        except Exception as e:
+            self._display.warning(
+                u'Error spilling result: {e}'.format(e=str(e))
+            )
+            reference = None
+        return result if reference is None else reference
 
     def write_msg(self, data_type, body):
         payload = {
@@ -69,20 +161,22 @@ class CallbackModule(CallbackBase):
 
         if self._fd:
             try:
-                self._fd.write(
-                    u'{j}'.format(
-                        j=json.dumps(
-                            payload,
-                            ensure_ascii=False
-                        ),
-                    )
-                )
-                self._fd.write(u'\n')
-                self._fd.flush()
+                frame = framing.encode(payload)
             except Exception as e:
                 self._display.error(
                     u'Error serializing JSON data: {e}'.format(e=str(e))
                 )
+                return
+            with self._lock:
+                self._buffer.append(frame)
+                self._buffered += len(frame)
+                urgent = (
+                    self._flusher is None or
+                    data_type in _URGENT_TYPES or
+                    self._buffered >= _BUFFER_SIZE
+                )
+            if urgent:
+                self.flush()
         else:
             self._display.display(str(body))
 
@@ -97,7 +191,7 @@ class CallbackModule(CallbackBase):
             '_ansible_delegated_vars',
             None
         )
-        self.write_msg(AnsibleCallback.DEBUG, result._result)
+        self.write_msg(AnsibleCallback.DEBUG, self._spill(result._result))
         if 'exception' in result._result:
             error = result._result['exception'].strip().split('\n')[-1]
             self.write_msg(msg_type, error)
@@ -318,7 +412,13 @@ class CallbackModule(CallbackBase):
     def v2_playbook_on_stats(self, stats):
         hosts = sorted(stats.processed.keys())
         if self.cb_results:
-            self.write_msg(AnsibleCallback.RESULT, self.cb_results)
+            self.write_msg(
+                AnsibleCallback.RESULT,
+                dict(
+                    (register, self._spill(result))
+                    for register, result in self.cb_results.items()
+                ),
+            )
         for h in hosts:
             t = stats.summarize(h)
 
@@ -331,3 +431,4 @@ class CallbackModule(CallbackBase):
                 f="failed: {n}".format(n=t['failures']),
             )
             self.write_msg(AnsibleCallback.DEBUG, msg)
+        self.flush()
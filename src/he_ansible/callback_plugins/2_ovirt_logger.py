@@ -23,12 +23,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import atexit
 import io
 import json
 import logging
 import os
-import pprint
-import re
+import reprlib
+import sys
+import time
 
 
 from collections import defaultdict
@@ -37,6 +39,12 @@ from datetime import datetime
 
 from ansible.plugins.callback import CallbackBase
 
+# The helpers in he_ansible are imported where first needed, ansible loads
+# the plugin for every playbook run, also when it does not log.
+_HE_ANSIBLE_DIR = os.path.dirname(os.path.dirname(__file__))
+if _HE_ANSIBLE_DIR not in sys.path:
+    sys.path.append(_HE_ANSIBLE_DIR)
+
 __metaclass__ = type
 
 
@@ -79,9 +87,81 @@ DOCUMENTATION = '''
         env:
           - name: HE_ANSIBLE_LOG_FILTERED_TOKENS_VARS_VAR
         default: he_filtered_tokens_vars
+      log format:
+        description: >
+          text, or jsonl for one JSON record per line, with the fields
+          ts, level, playbook, play, task, host, status, duration and msg.
+          Read them with hosted-engine --ansible-log.
+        env:
+          - name: HE_ANSIBLE_LOG_FORMAT
+        default: text
+      log compression:
+        description: >
+          Compression of the jsonl log, gzip, zstd (if the zstandard module
+          is available, gzip otherwise) or none.
+        env:
+          - name: HE_ANSIBLE_LOG_COMPRESSION
+        default: gzip
+      async log:
+        description: >
+          Write the log in a background thread, in batches. Records are
+          formatted, and so filtered, before being queued.
+        env:
+          - name: HE_ANSIBLE_LOG_ASYNC
+        default: False
+      spill dir:
+        description: >
+          Directory to write failed results to, instead of logging them,
+          when they are at least spill size bytes as JSON. They are
+          filtered as the log is.
+        env:
+          - name: HE_ANSIBLE_LOG_SPILL_DIR
+        default: None
+      spill size:
+        description: Size of the results to write to spill dir.
+        env:
+          - name: HE_ANSIBLE_SPILL_SIZE
+        default: 0
+      timeline file:
+        description: >
+          File to append the spans of plays and tasks to, one Chrome trace
+          event (JSON) per line, timestamps in wall clock microseconds.
+        env:
+          - name: HE_ANSIBLE_TIMELINE_PATH
+        default: None
 '''
 
 
+# Vars that change on every fact gathering, and that hold the others
+_NOT_TRACKED_VARS = frozenset((
+    'vars',
+    'hostvars',
+    'ansible_facts',
+))
+
+_SCALAR_TYPES = (str, bytes, int, float)
+
+# Keys of the results that ansible applies to the vars before the callbacks
+_VARS_CHANGING_KEYS = (
+    'ansible_facts',
+    'add_host',
+    'add_group',
+)
+
+# Write at least this many characters at once, unless nothing else is queued
+_LOG_BATCH_SIZE = 64 * 1024
+
+# Bounds of dump_obj: nesting and items shown of every value, size of every
+# value, number of attributes, and size of the whole dump.
+_DUMP_MAX_DEPTH = 3
+_DUMP_MAX_ITEMS = 64
+_DUMP_MAX_VALUE_SIZE = 4096
+_DUMP_MAX_ATTRS = 64
+_DUMP_MAX_SIZE = 64 * 1024
+# Stop dumping attributes when less than this is left of the size
+_DUMP_MIN_LINE_SIZE = 64
+
+
 def _shorten_string(s, max):
     """
     Return a shortened version of s if it's too long: some prefix, then ...,
@@ -91,33 +171,63 @@ def _shorten_string(s, max):
     return (
         s if len(s) <= max
         else '{pref}...{suff}'.format(
-            pref=s[:max-6],
+            pref=s[:max-6] if max > 6 else '',
             suff=s[-3:],
         )
     )
 
 
-# Used to provide an alternative to dateutil.tz.tzlocal
-def _get_tz_from_os():
-    import subprocess
+def _make_dump_repr():
+    r = reprlib.Repr()
+    r.maxlevel = _DUMP_MAX_DEPTH
+    for attr in (
+        'maxdict',
+        'maxlist',
+        'maxtuple',
+        'maxset',
+        'maxfrozenset',
+        'maxdeque',
+        'maxarray',
+    ):
+        setattr(r, attr, _DUMP_MAX_ITEMS)
+    r.maxstring = r.maxother = r.maxlong = _DUMP_MAX_VALUE_SIZE
+    return r
 
-    p = subprocess.Popen(
-        args=(
-            '/bin/date',
-            '+%z',
-        ),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-        close_fds=True,
-    )
-    stdout, stderr = p.communicate()
-    stdout = stdout.decode('utf-8', 'replace').splitlines()
-    stderr = stderr.decode('utf-8', 'replace').splitlines()
-    if p.returncode != 0:
-        tz = 'UnknownTZ'
-    else:
-        tz = stdout[0].rstrip('\n')
-    return tz
+
+_dump_repr = _make_dump_repr()
+
+
+class _BatchWriter(logging.Handler):
+    """
+    Write the records formatted by a QueueHandler, batching those that are
+    queued together.
+    """
+
+    def __init__(self, stream, log_queue):
+        logging.Handler.__init__(self)
+        self._stream = stream
+        self._queue = log_queue
+        self._batch = []
+        self._size = 0
+
+    def emit(self, record):
+        # QueueHandler.prepare already formatted the record into msg
+        self._batch.append(record.msg)
+        self._batch.append('\n')
+        self._size += len(record.msg) + 1
+        if self._size >= _LOG_BATCH_SIZE or self._queue.empty():
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self._batch:
+                self._stream.write(''.join(self._batch))
+                self._stream.flush()
+                self._batch = []
+                self._size = 0
+        finally:
+            self.release()
 
 
 class CallbackModule(CallbackBase):
@@ -125,6 +235,12 @@ class CallbackModule(CallbackBase):
     ansible ovirt_logger callback plugin
     This plugin makes use of the following environment variables:
         HE_ANSIBLE_LOG_PATH   (mandatory): defaults to None
+        HE_ANSIBLE_LOG_FORMAT (optional): defaults to text
+        HE_ANSIBLE_LOG_COMPRESSION (optional): defaults to gzip
+        HE_ANSIBLE_LOG_ASYNC (optional): defaults to False
+        HE_ANSIBLE_LOG_SPILL_DIR (optional): defaults to None
+        HE_ANSIBLE_SPILL_SIZE (optional): defaults to 0
+        HE_ANSIBLE_TIMELINE_PATH (optional): defaults to None
     """
 
     CALLBACK_VERSION = 2.0
@@ -137,73 +253,6 @@ class CallbackModule(CallbackBase):
     class _MyFormatter(logging.Formatter):
         """Filter strings from log entries."""
 
-        def _get_re_objects(self, regexps):
-            for exp in regexps:
-                if exp not in self._re_objects:
-                    obj = re.compile(exp)
-                    if 'filter' in obj.groupindex:
-                        self._re_objects[exp] = obj
-                    else:
-                        # TODO consider log that we ignored an RE because
-                        # it has no group 'filter', but not sure this is
-                        # a good idea (log from inside a formatter).
-                        pass
-            return list(self._re_objects.values())
-
-        def _filter(self, content, tokens, regexps):
-            """
-            Filter overlapping tokens within content.
-            regexps is a list of regular expressions, each having a group named
-            'filter'. The content of this group will be filtered.
-
-            Examples:
-            content=abcabca, tokens=('abca')
-            content=aaabbbccc, tokens=('bbb', 'abbba')
-            content=aaaababbbb, tokens=('aaab', 'aaa', 'bbb')
-            content=a BS some secret ES b, regexps=('BS (?P<filter>.*) ES')
-            """
-
-            def _insertFilter(content, begin, end):
-                return content[:begin] + '**FILTERED**' + content[end:]
-
-            tofilter = []
-
-            for token in tokens:
-                if token not in (None, ''):
-                    index = -1
-                    while True:
-                        index = content.find(token, index+1)
-                        if index == -1:
-                            break
-                        tofilter.append((index, index + len(token)))
-
-            for reobj in self._get_re_objects(regexps):
-                if reobj is not None:
-                    index = -1
-                    while True:
-                        matchobj = reobj.search(content, index)
-                        if matchobj is None:
-                            break
-                        index = matchobj.start('filter')
-                        tofilter.append((index, matchobj.end('filter')))
-
-            tofilter = sorted(tofilter, key=lambda e: e[1], reverse=True)
-            begin = None
-            end = None
-            for entry in tofilter:
-                if begin is None or entry[1] < begin:
-                    if begin is not None:
-                        content = _insertFilter(content, begin, end)
-                    begin = entry[0]
-                    end = entry[1]
-                elif entry[0] < begin:
-                    begin = entry[0]
-            else:
-                if begin is not None:
-                    content = _insertFilter(content, begin, end)
-
-            return content
-
         def __init__(
             self,
             fmt=None,
@@ -213,23 +262,22 @@ class CallbackModule(CallbackBase):
             filtered_tokens_re_var=None,
             filtered_vars_var=None,
         ):
+            import token_filter
             logging.Formatter.__init__(self, fmt=fmt, datefmt=datefmt)
             self._vars_cache = vars_cache
             self._filtered_tokens_var = filtered_tokens_var
             self._filtered_tokens_re_var = filtered_tokens_re_var
             self._filtered_vars_var = filtered_vars_var
-            self._re_objects = {}
+            self._token_filter = token_filter.TokenFilter()
 
         def converter(self, timestamp):
-            return datetime.fromtimestamp(
-                timestamp,
-                self._tzlocal
-            )
+            # In the local timezone, with the offset of the time, not of now
+            return datetime.fromtimestamp(timestamp).astimezone()
 
-        def _formatTime_dateutil(self, record, datefmt=None):
+        def formatTime(self, record, datefmt=None):
             ct = self.converter(record.created)
             if datefmt:
-                s = ct.strftime(datefmt, ct)
+                s = ct.strftime(datefmt)
             else:
                 s = "%s,%03d%s" % (
                     ct.strftime('%Y-%m-%d %H:%M:%S'),
@@ -238,24 +286,6 @@ class CallbackModule(CallbackBase):
                 )
             return s
 
-        def _formatTimeOS(self, record, datefmt=None):
-            # Ignore datefmt if we do not have dateutil
-            ct = datetime.fromtimestamp(record.created)
-            return "%s,%03d%s" % (
-                ct.strftime('%Y-%m-%d %H:%M:%S'),
-                record.msecs,
-                self._os_tz
-            )
-
-        try:
-            # If we have dateutil, use that.
-            from dateutil import tz
-            _tzlocal = tz.tzlocal()
-            formatTime = _formatTime_dateutil
-        except ImportError:
-            _os_tz = _get_tz_from_os()
-            formatTime = _formatTimeOS
-
         def _get_filtered_tokens(self):
             res = []
             for host, hostvars in self._vars_cache.items():
@@ -275,23 +305,123 @@ class CallbackModule(CallbackBase):
                 )
             return res
 
-        def format(self, record):
-            return self._filter(
-                content=logging.Formatter.format(self, record),
+        def update_filter(self):
+            """Take the changes of the vars cache."""
+            self._token_filter.update(
                 tokens=self._get_filtered_tokens(),
-                regexps=self._get_filtered_regexps()
+                regexps=self._get_filtered_regexps(),
+            )
+
+        def format(self, record):
+            return self._token_filter.filter(
+                logging.Formatter.format(self, record)
+            )
+
+        def filter_data(self, data):
+            """Filter the strings of data, also in containers."""
+            if isinstance(data, str):
+                return self._token_filter.filter(data)
+            if isinstance(data, dict):
+                return dict(
+                    (self.filter_data(k), self.filter_data(v))
+                    for k, v in data.items()
+                )
+            if isinstance(data, (list, tuple)):
+                return [self.filter_data(v) for v in data]
+            return data
+
+    class _JSONFormatter(_MyFormatter):
+        """Filter the fields of records, then format them as JSON."""
+
+        def format(self, record):
+            entry = {
+                'ts': round(record.created, 3),
+                'level': record.levelname,
+            }
+            entry.update(
+                (k, v) for k, v in getattr(record, 'ansible', {}).items()
+                if v is not None
             )
+            msg = record.getMessage()
+            if record.exc_info:
+                msg = u'{m}\n{e}'.format(
+                    m=msg,
+                    e=self.formatException(record.exc_info),
+                )
+            entry['msg'] = msg
+            for k, v in entry.items():
+                if isinstance(v, str):
+                    entry[k] = self._token_filter.filter(v)
+            return json.dumps(entry, ensure_ascii=False, default=str)
 
     _logger = None
     _handler = None
+    _listener = None
+    _stream = None
+    _timeline = None
+
+    def _open_log(self, logFileName):
+        import jsonlog
+        # The batch writer flushes by itself
+        buffering = -1 if self._log_async else 1
+        if self._log_format == jsonlog.JSONL:
+            try:
+                stream = jsonlog.Writer(logFileName, self._log_compression)
+            except IOError:
+                stream = io.open(os.devnull, mode='a', encoding='utf8')
+            else:
+                atexit.register(stream.close)
+            return stream
+        try:
+            return io.open(
+                logFileName,
+                mode='a',
+                buffering=buffering,
+                encoding='utf8',
+            )
+        except IOError:
+            return io.open(
+                os.devnull,
+                mode='a',
+                buffering=buffering,
+                encoding='utf8',
+            )
 
-    def _setup_logging(self):
+    def _setup_logging(self, logFileName):
+        import jsonlog
+        if self._log_format is None:
+            self._log_format = jsonlog.TEXT
+        if self._log_compression is None:
+            self._log_compression = jsonlog.GZIP
         if CallbackModule._logger is None:
             # ansible instantiates callbacks twice in load_callbacks.
             # Setup logging only once, or we get too much logging...
-            CallbackModule._handler = logging.StreamHandler(self.handle)
+            # and two compressed streams appended to the same file.
+            CallbackModule._stream = self._open_log(logFileName)
+            if self._log_async:
+                import queue
+                from logging.handlers import QueueHandler
+                from logging.handlers import QueueListener
+                log_queue = queue.Queue()
+                # The formatter, and so the filter, runs in prepare(), in
+                # our thread, with the vars cache of the time of the record.
+                CallbackModule._handler = QueueHandler(log_queue)
+                CallbackModule._listener = QueueListener(
+                    log_queue,
+                    _BatchWriter(CallbackModule._stream, log_queue),
+                )
+                CallbackModule._listener.start()
+                atexit.register(CallbackModule._stop_logging)
+            else:
+                CallbackModule._handler = logging.StreamHandler(
+                    CallbackModule._stream
+                )
             CallbackModule._handler.setLevel(logging.DEBUG)
-            CallbackModule._handler.setFormatter(self._MyFormatter(
+            formatter = (
+                self._JSONFormatter if self._log_format == jsonlog.JSONL
+                else self._MyFormatter
+            )
+            CallbackModule._handler.setFormatter(formatter(
                 fmt=u'%(asctime)s %(levelname)s %(message)s',
                 vars_cache=self._vars_cache,
                 filtered_tokens_var=self._filtered_tokens_var,
@@ -304,6 +434,123 @@ class CallbackModule(CallbackBase):
             CallbackModule._logger.addHandler(CallbackModule._handler)
             CallbackModule._logger.setLevel(logging.DEBUG)
         self.logger = CallbackModule._logger
+        self.handle = CallbackModule._stream
+
+    @staticmethod
+    def _stop_logging():
+        CallbackModule._listener.stop()
+        # What was queued with the stop sentinel is not written yet
+        for handler in CallbackModule._listener.handlers:
+            handler.flush()
+
+    def _flush_logging(self):
+        if CallbackModule._listener is not None:
+            # The listener marks records done only after writing them
+            CallbackModule._listener.queue.join()
+        import jsonlog
+        if isinstance(CallbackModule._stream, jsonlog.Writer):
+            CallbackModule._stream.sync()
+
+    def _setup_timeline(self, timelineFileName):
+        if CallbackModule._timeline is None:
+            try:
+                CallbackModule._timeline = io.open(
+                    timelineFileName,
+                    mode='a',
+                    buffering=1,
+                    encoding='utf8',
+                )
+            except IOError:
+                self._display.warning(
+                    u"Cannot open timeline file {f}".format(
+                        f=timelineFileName,
+                    )
+                )
+
+    def _timeline_event(self, name, category, start, **args):
+        if CallbackModule._timeline is None or start is None:
+            return
+        ts = int(round(start * 1000000))
+        CallbackModule._timeline.write(
+            u'{e}\n'.format(
+                e=json.dumps(
+                    {
+                        'name': name,
+                        'cat': category,
+                        'ph': 'X',
+                        'ts': ts,
+                        'dur': int(round(time.time() * 1000000)) - ts,
+                        'args': args,
+                    },
+                    default=str,
+                )
+            )
+        )
+
+    def _timeline_task(self, result, status):
+        self._timeline_event(
+            result._task.get_name(),
+            'task',
+            self._task_start_time,
+            host=result._host.name,
+            status=status,
+            action=result._task.action,
+            role=(
+                result._task._role.get_name()
+                if result._task._role else None
+            ),
+            play=self.play.get_name() if self.play else None,
+        )
+
+    def _record_task(self, result, data):
+        task = result._task
+        self._task_records.append({
+            'name': task.get_name(),
+            'host': result._host.name,
+            'status': data['status'],
+            'role': task._role.get_name() if task._role else None,
+            'tags': list(task.tags or ()),
+            'duration': data['task_duration'],
+            'attempts': (
+                result._result.get('attempts')
+                if isinstance(result._result, dict) else None
+            ),
+        })
+
+    def _write_task_stats(self, summary):
+        if not self._log_file_name:
+            return
+        import jsonlog
+        path = '{base}-summary.json'.format(
+            base=jsonlog.base_name(self._log_file_name),
+        )
+        try:
+            with io.open(path, mode='w', encoding='utf8') as f:
+                f.write(
+                    json.dumps(
+                        {
+                            'playbook': self.playbook._file_name,
+                            'status': (
+                                'SUCCESS' if self.errors == 0 else 'FAILED'
+                            ),
+                            'tasks': summary,
+                        },
+                        sort_keys=True,
+                        default=str,
+                    )
+                )
+        except IOError as e:
+            self.logger.warning(
+                u'Cannot write the task summary {p}: {e}'.format(p=path, e=e)
+            )
+
+    def _timeline_play_end(self):
+        if self.play:
+            self._timeline_event(
+                self.play.get_name(),
+                'play',
+                self._play_start_time,
+            )
 
     def _pretty_logging(self, obj):
         try:
@@ -311,84 +558,176 @@ class CallbackModule(CallbackBase):
         except Exception:
             return obj
 
+    @staticmethod
+    def _var_signature(v):
+        # Scalars are compared as they are, anything else by the hash of its
+        # str, so that the cache does not have to str the old value again.
+        if v is None or isinstance(v, _SCALAR_TYPES):
+            return (type(v), v)
+        return (type(v), hash(str(v)))
+
     def _collect_vars_changes(self, hostname, newvars):
         res = []
-        do_not_append_vars = [
-            'vars',
-            'hostvars',
-            'ansible_facts',
-        ]
+        cache = self._vars_cache[hostname]
+        signatures = self._vars_signatures[hostname]
         for k, v in newvars.items():
-            if (
-                hostname not in self._vars_cache or
-                k not in self._vars_cache[hostname] or
-                str(v) != str(self._vars_cache[hostname][k]) or
-                not isinstance(v, type(self._vars_cache[hostname][k]))
-            ):
-                if k not in do_not_append_vars:
-                    res.append(
-                        u'var changed: host "{h}" var "{k}" type "{t}" '
-                        u'value: "{v}"'.format(
-                            h=hostname,
-                            k=k,
-                            t=type(v),
-                            v=self._pretty_logging(v),
-                        )
+            if k in _NOT_TRACKED_VARS:
+                cache[k] = v
+                continue
+            self._vars_stats['checked'] += 1
+            if k in cache and cache[k] is v:
+                continue
+            signature = self._var_signature(v)
+            cache[k] = v
+            if signatures.get(k) != signature:
+                signatures[k] = signature
+                self._vars_stats['changed'] += 1
+                res.append(
+                    u'var changed: host "{h}" var "{k}" type "{t}" '
+                    u'value: "{v}"'.format(
+                        h=hostname,
+                        k=k,
+                        t=type(v),
+                        v=self._pretty_logging(v),
                     )
+                )
         return res
 
-    def _update_vars_cache(self):
+    @staticmethod
+    def _changes_vars(result):
+        """Whether ansible changed vars with result before the callbacks."""
+        if getattr(result._task, 'register', None):
+            return True
+        items = [result._result]
+        if isinstance(result._result, dict):
+            items.extend(result._result.get('results') or ())
+        return any(
+            k in item
+            for item in items if isinstance(item, dict)
+            for k in _VARS_CHANGING_KEYS
+        )
+
+    def _update_vars_cache(self, result=None, task_start=False):
+        """
+        Take the changes of the vars of all the hosts, only if they can have
+        changed: since the start of a play, or of an import of vars, and
+        after results changing them, at them and at the next task start.
+        """
+        if result is not None and self._changes_vars(result):
+            self._vars_dirty = True
+        if not self._vars_dirty:
+            self._vars_stats['skipped'] += 1
+            return
+        if task_start:
+            self._vars_dirty = False
         vars_changes = []
         if self.varmgr:
+            start = time.time()
             for host in self.varmgr._inventory.get_hosts():
+                # The vars of the play include those of the host
+                if self.play:
+                    newvars = self.varmgr.get_vars(play=self.play, host=host)
+                else:
+                    newvars = self.varmgr.get_vars(host=host)
                 vars_changes.extend(
-                    self._collect_vars_changes(
-                        str(host),
-                        self.varmgr.get_vars(host=host)
-                    )
-                )
-                self._vars_cache[str(host)].update(
-                    self.varmgr.get_vars(host=host)
+                    self._collect_vars_changes(str(host), newvars)
                 )
-                if self.play:
-                    vars_changes.extend(
-                        self._collect_vars_changes(
-                            str(host),
-                            self.varmgr.get_vars(play=self.play, host=host)
-                        )
-                    )
-                    self._vars_cache[str(host)].update(
-                        self.varmgr.get_vars(play=self.play, host=host)
-                    )
             # Log changes after applying them, so that our filter handles
             # changes before we log them.
+            if vars_changes and CallbackModule._handler is not None:
+                CallbackModule._handler.formatter.update_filter()
             for line in vars_changes:
                 self.logger.debug(line)
+            self._vars_stats['updates'] += 1
+            self._vars_stats['time'] += time.time() - start
+
+    def _log_vars_stats(self):
+        stats = self._vars_stats
+        if stats['updates']:
+            self.logger.debug(
+                u'vars cache: {u} updates in {t:.3f}s ({a:.1f}ms each), '
+                u'{c} vars checked, {n} changed, {s} updates skipped'.format(
+                    u=stats['updates'],
+                    t=stats['time'],
+                    a=stats['time'] / stats['updates'] * 1000,
+                    c=stats['checked'],
+                    n=stats['changed'],
+                    s=stats['skipped'],
+                )
+            )
+
+    def _spill(self, result):
+        """Return a description of the spill file of result if it is big."""
+        if CallbackModule._handler is None:
+            # Spill files are filtered by the formatter of the log
+            return result
+        import spill
+        try:
+            reference = spill.spill(
+                result,
+                self._spill_dir,
+                self._spill_size,
+                CallbackModule._handler.formatter.filter_data,
+            )
+        except Exception as e:
+            self.logger.warning(u'Error spilling result: {e}'.format(e=e))
+            reference = None
+        return result if reference is None else spill.describe(reference)
 
     def dump_obj(self, obj):
-        no_debug_attr = [
-            '__doc__',
-            '__hash__',
-        ]
-        name = _shorten_string(repr(obj), 200)
-        return u'\n'.join([
+        """
+        Dump type, str and attributes of obj, within _DUMP_MAX_SIZE.
+        Containers are shown up to _DUMP_MAX_DEPTH levels and
+        _DUMP_MAX_ITEMS items each.
+        """
+        size = _DUMP_MAX_SIZE
+        name = _shorten_string(_dump_repr.repr(obj), 200)
+        if isinstance(obj, (dict, list, tuple, set, frozenset)):
+            text = _dump_repr.repr(obj)
+        else:
+            text = str(obj)
+        lines = [
             u'type: {v}'.format(v=type(obj)),
-            u'str: {v}'.format(v=_shorten_string(str(obj), 4096)),
-        ] + [
-            u'{n}.{a}: {o}'.format(
-                n=name,
-                a=attr,
-                o=pprint.pformat(getattr(obj, attr))
+            u'str: {v}'.format(
+                v=_shorten_string(text, _DUMP_MAX_VALUE_SIZE)
+            ),
+        ]
+        size -= sum(len(line) + 1 for line in lines)
+        attrs = [attr for attr in dir(obj) if not attr.startswith('__')]
+        dumped = 0
+        for i, attr in enumerate(attrs):
+            if dumped >= _DUMP_MAX_ATTRS or size < _DUMP_MIN_LINE_SIZE:
+                lines.append(
+                    u'{n}: {c} more attributes not dumped'.format(
+                        n=name,
+                        c=len(attrs) - i,
+                    )
+                )
+                break
+            try:
+                value = getattr(obj, attr)
+            except Exception as e:
+                value = e
+            if isinstance(value, Callable):
+                continue
+            line = _shorten_string(
+                u'{n}.{a}: {o}'.format(
+                    n=name,
+                    a=attr,
+                    o=_dump_repr.repr(value),
+                ),
+                size,
             )
-            for attr in dir(obj)
-            if not isinstance(
-                getattr(obj, attr), Callable) and attr not in no_debug_attr
-        ])
+            lines.append(line)
+            size -= len(line) + 1
+            dumped += 1
+        return u'\n'.join(lines)
 
     def __init__(self):
         super(CallbackModule, self).__init__()
 
         logFileName = os.getenv('HE_ANSIBLE_LOG_PATH', None)
+        self._log_file_name = logFileName
         self._filtered_tokens_var = os.getenv(
             'HE_ANSIBLE_LOG_FILTERED_TOKENS_VAR',
             'he_filtered_tokens'
@@ -405,6 +744,32 @@ class CallbackModule(CallbackBase):
         self.play = None
         self.varmgr = None
         self._vars_cache = defaultdict(dict)
+        self._vars_signatures = defaultdict(dict)
+        self._vars_stats = {
+            'updates': 0,
+            'time': 0.0,
+            'checked': 0,
+            'changed': 0,
+            'skipped': 0,
+        }
+        self._vars_dirty = True
+
+        self._spill_dir = os.getenv('HE_ANSIBLE_LOG_SPILL_DIR', None)
+        try:
+            self._spill_size = int(os.getenv('HE_ANSIBLE_SPILL_SIZE', 0))
+        except ValueError:
+            self._spill_size = 0
+        self._log_async = os.getenv(
+            'HE_ANSIBLE_LOG_ASYNC',
+            'False'
+        ).lower() in ('true', 'yes', '1')
+        # Defaults of jsonlog, see _setup_logging
+        self._log_format = os.getenv('HE_ANSIBLE_LOG_FORMAT', None)
+        self._log_compression = os.getenv('HE_ANSIBLE_LOG_COMPRESSION', None)
+
+        timelineFileName = os.getenv('HE_ANSIBLE_TIMELINE_PATH', None)
+        if timelineFileName:
+            self._setup_timeline(timelineFileName)
 
         if not logFileName:
             self.disabled = True
@@ -412,31 +777,31 @@ class CallbackModule(CallbackBase):
                 "No log file specified with HE_ANSIBLE_LOG_PATH"
             )
         else:
-            try:
-                self.handle = io.open(
-                    logFileName,
-                    mode='a',
-                    buffering=1,
-                    encoding='utf8',
-                )
-            except IOError:
-                self.handle = io.open(
-                    os.devnull,
-                    mode='a',
-                    buffering=1,
-                    encoding='utf8',
-                )
-            self._setup_logging()
+            self._setup_logging(logFileName)
 
         self.start_time = datetime.utcnow()
         self._finised_tasks = []
+        self._task_records = []
         self._task_duration = None
         self._task_start_time = None
+        self._play_start_time = None
         self.errors = 0
 
+    def _fields(self, data):
+        """The extra of the records of data, for the jsonl log."""
+        return {
+            'ansible': {
+                'playbook': data.get('ansible_playbook'),
+                'play': self.play.get_name() if self.play else None,
+                'task': data.get('ansible_task'),
+                'host': data.get('ansible_host'),
+                'status': data.get('status'),
+                'duration': data.get('task_duration'),
+            },
+        }
+
     def _get_task_duration(self):
-        runtime = datetime.utcnow() - self._task_start_time
-        return runtime.seconds
+        return round(time.time() - self._task_start_time, 3)
 
     def v2_playbook_on_start(self, playbook):
         self.playbook = playbook
@@ -448,18 +813,24 @@ class CallbackModule(CallbackBase):
         self.logger.info(
             u"ansible start playbook {v}".format(v=self.playbook._file_name)
         )
-        self.logger.debug(u"ansible start {v}".format(v=data))
+        self.logger.debug(
+            u"ansible start {v}".format(v=data),
+            extra=self._fields(data),
+        )
 
     def v2_playbook_on_task_start(self, task, is_conditional):
-        self._task_start_time = datetime.utcnow()
-        self._update_vars_cache()
+        self._task_start_time = time.time()
+        self._update_vars_cache(task_start=True)
         data = {
             'status': "OK",
             'ansible_type': "task",
             'ansible_playbook': self.playbook._file_name,
             'ansible_task': task.get_name(),
         }
-        self.logger.info(u"ansible task start {v}".format(v=data))
+        self.logger.info(
+            u"ansible task start {v}".format(v=data),
+            extra=self._fields(data),
+        )
 
     def _get_tasks_list(self):
         task_list = []
@@ -483,6 +854,8 @@ class CallbackModule(CallbackBase):
         return task_list
 
     def v2_playbook_on_stats(self, stats):
+        self._timeline_play_end()
+        self._log_vars_stats()
         end_time = datetime.utcnow()
         runtime = end_time - self.start_time
 
@@ -514,13 +887,21 @@ class CallbackModule(CallbackBase):
             'ansible_result': self.dump_obj(summarize_stat),
         }
 
-        self.logger.info(u"ansible stats {v}".format(
-            v=self._pretty_logging(data)
-        ))
+        self.logger.info(
+            u"ansible stats {v}".format(v=self._pretty_logging(data)),
+            extra=self._fields(data),
+        )
         self.logger.info(summary)
+        import task_stats
+        stats_summary = task_stats.summarize(self._task_records)
+        self.logger.info(
+            u'\n'.join(task_stats.format_summary(stats_summary))
+        )
+        self._write_task_stats(stats_summary)
+        self._flush_logging()
 
     def v2_runner_on_ok(self, result, **kwargs):
-        self._update_vars_cache()
+        self._update_vars_cache(result)
         data = {
             'status': "OK",
             'ansible_type': "task",
@@ -529,11 +910,16 @@ class CallbackModule(CallbackBase):
             'ansible_task': result._task.name,
             'task_duration': self._get_task_duration(),
         }
-        self.logger.info(u"ansible ok {v}".format(v=data))
+        self.logger.info(
+            u"ansible ok {v}".format(v=data),
+            extra=self._fields(data),
+        )
         self._finised_tasks.append(data)
+        self._record_task(result, data)
+        self._timeline_task(result, data['status'])
 
     def v2_runner_on_skipped(self, result, **kwargs):
-        self._update_vars_cache()
+        self._update_vars_cache(result)
         data = {
             'status': "SKIPPED",
             'ansible_type': "task",
@@ -541,9 +927,14 @@ class CallbackModule(CallbackBase):
             'ansible_task': result._task.name,
             'ansible_host': result._host.name
         }
-        self.logger.info(u"ansible skipped {v}".format(v=data))
+        self.logger.info(
+            u"ansible skipped {v}".format(v=data),
+            extra=self._fields(data),
+        )
+        self._timeline_task(result, data['status'])
 
     def v2_playbook_on_import_for_host(self, result, imported_file):
+        self._vars_dirty = True
         self._update_vars_cache()
         data = {
             'status': "IMPORTED",
@@ -552,9 +943,13 @@ class CallbackModule(CallbackBase):
             'ansible_host': result._host.name,
             'imported_file': imported_file
         }
-        self.logger.info(u"ansible import {v}".format(v=data))
+        self.logger.info(
+            u"ansible import {v}".format(v=data),
+            extra=self._fields(data),
+        )
 
     def v2_playbook_on_not_import_for_host(self, result, missing_file):
+        self._vars_dirty = True
         self._update_vars_cache()
         data = {
             'status': "NOT IMPORTED",
@@ -563,27 +958,33 @@ class CallbackModule(CallbackBase):
             'ansible_host': result._host.name,
             'missing_file': missing_file
         }
-        self.logger.info(u"ansible import {v}".format(v=data))
+        self.logger.info(
+            u"ansible import {v}".format(v=data),
+            extra=self._fields(data),
+        )
 
     def v2_runner_on_failed(self, result, **kwargs):
-        self._update_vars_cache()
+        self._update_vars_cache(result)
         data = {
             'status': "FAILED",
             'ansible_type': "task",
             'ansible_playbook': self.playbook._file_name,
             'ansible_host': result._host.name,
             'ansible_task': result._task.name,
-            'ansible_result': result._result,
+            'ansible_result': self._spill(result._result),
             'task_duration': self._get_task_duration(),
         }
         self.errors += 1
         self.logger.error(
-            u"ansible failed {v}".format(v=self._pretty_logging(data))
+            u"ansible failed {v}".format(v=self._pretty_logging(data)),
+            extra=self._fields(data),
         )
         self._finised_tasks.append(data)
+        self._record_task(result, data)
+        self._timeline_task(result, data['status'])
 
     def v2_runner_on_unreachable(self, result, **kwargs):
-        self._update_vars_cache()
+        self._update_vars_cache(result)
         data = {
             'status': "UNREACHABLE",
             'ansible_type': "task",
@@ -593,11 +994,16 @@ class CallbackModule(CallbackBase):
             'ansible_result': self.dump_obj(result._result),
             'task_duration': self._get_task_duration(),
         }
-        self.logger.error(u"ansible unreachable {v}".format(v=data))
+        self.logger.error(
+            u"ansible unreachable {v}".format(v=data),
+            extra=self._fields(data),
+        )
         self._finised_tasks.append(data)
+        self._record_task(result, data)
+        self._timeline_task(result, data['status'])
 
     def v2_runner_on_async_failed(self, result, **kwargs):
-        self._update_vars_cache()
+        self._update_vars_cache(result)
         data = {
             'status': "FAILED",
             'ansible_type': "task",
@@ -608,18 +1014,29 @@ class CallbackModule(CallbackBase):
             'task_duration': self._get_task_duration(),
         }
         self.errors += 1
-        self.logger.error(u"ansible async {v}".format(v=data))
+        self.logger.error(
+            u"ansible async {v}".format(v=data),
+            extra=self._fields(data),
+        )
         self._finised_tasks.append(data)
+        self._record_task(result, data)
+        self._timeline_task(result, data['status'])
 
     def v2_playbook_on_play_start(self, play):
+        self._timeline_play_end()
+        self._play_start_time = time.time()
         self.play = play
         self.varmgr = self.play.get_variable_manager()
+        self._vars_dirty = True
         data = {
             'status': "OK",
             'ansible_type': "play start",
             'ansible_play': self.play.name,
         }
-        self.logger.info(u"ansible play start {v}".format(v=data))
+        self.logger.info(
+            u"ansible play start {v}".format(v=data),
+            extra=self._fields(data),
+        )
 
     def v2_on_any(self, *args, **kwargs):
         msg = u"ansible on_any args "
@@ -0,0 +1,209 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+PLUGINS_DIR = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    'callback_plugins',
+)
+
+# Seconds to load a callback plugin, once ansible itself is imported.
+# ansible loads them for every playbook run.
+IMPORT_BUDGET = 0.25
+
+# Loads a plugin twice, as ansible might, in a fresh interpreter
+LOADER = '''
+import importlib.util
+import os
+import subprocess
+import sys
+import time
+
+import ansible.plugins.callback
+
+
+def forbidden(*args, **kwargs):
+    raise AssertionError('process started loading the plugin')
+
+
+subprocess.Popen = os.fork = os.posix_spawn = forbidden
+path = sys.argv[1]
+start = time.monotonic()
+for i in range(2):
+    spec = importlib.util.spec_from_file_location('plugin', path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+elapsed = time.monotonic() - start
+print(elapsed)
+print(sys.path.count(os.path.dirname(os.path.dirname(path))))
+'''
+
+
+@pytest.mark.parametrize('plugin', ['1_otopi_json.py', '2_ovirt_logger.py'])
+def testImportTime(plugin):
+    pytest.importorskip('ansible.plugins.callback')
+    out = subprocess.check_output(
+        [sys.executable, '-c', LOADER, os.path.join(PLUGINS_DIR, plugin)],
+    ).decode('utf-8').splitlines()
+    elapsed, path_entries = float(out[0]), int(out[1])
+    assert elapsed < IMPORT_BUDGET
+    assert path_entries == 1
+
+
+# Drives ovirt_logger through a playbook with a secret, a big failed result
+# and a secret set as a fact, with ansible if it is installed, else with a
+# stub of ansible.plugins.callback.
+DRIVER = '''
+import importlib.util
+import sys
+import types
+
+try:
+    import ansible.plugins.callback  # noqa: F401
+except ImportError:
+    class CallbackBase(object):
+        def __init__(self):
+            self._display = types.SimpleNamespace(
+                warning=print,
+                error=print,
+                display=print,
+            )
+
+    for name in ('ansible', 'ansible.plugins', 'ansible.plugins.callback'):
+        sys.modules[name] = types.ModuleType(name)
+    sys.modules['ansible.plugins.callback'].CallbackBase = CallbackBase
+
+SECRET = 'secret_data_1'
+FACT_SECRET = 'secret_data_2'
+NS = types.SimpleNamespace
+VARS = {
+    'he_filtered_tokens_vars': ['he_admin_password'],
+    'he_admin_password': SECRET,
+}
+GET_VARS = []
+
+
+def get_vars(play, host):
+    # ansible builds them again on every call
+    GET_VARS.append(host)
+    return dict(VARS)
+
+
+class Task(object):
+    name = 'task1'
+    action = 'command'
+    tags = []
+    register = None
+    _role = None
+
+    def get_name(self):
+        return self.name
+
+
+class Play(object):
+    name = 'play1'
+
+    def get_name(self):
+        return self.name
+
+    def get_variable_manager(self):
+        return NS(
+            _inventory=NS(get_hosts=lambda: ['localhost']),
+            get_vars=get_vars,
+        )
+
+
+spec = importlib.util.spec_from_file_location('plugin', sys.argv[1])
+module = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(module)
+# Imported only once needed
+assert not (
+    set(['jsonlog', 'spill', 'task_stats', 'token_filter']) &
+    set(sys.modules)
+)
+callback = module.CallbackModule()
+callback.v2_playbook_on_start(NS(_file_name='playbook.yml'))
+callback.v2_playbook_on_play_start(Play())
+task = Task()
+callback.v2_playbook_on_task_start(task, False)
+host = NS(name='localhost')
+callback.v2_runner_on_ok(
+    NS(_host=host, _task=task, _result={'msg': SECRET}),
+)
+callback.v2_runner_on_failed(
+    NS(_host=host, _task=task, _result={'msg': SECRET, 'out': 'x' * 4096}),
+)
+# The vars are fetched again only once a result changed them
+assert len(GET_VARS) == 1
+VARS['he_filtered_tokens'] = [FACT_SECRET]
+callback.v2_runner_on_ok(
+    NS(
+        _host=host,
+        _task=task,
+        _result={'ansible_facts': {'he_filtered_tokens': [FACT_SECRET]}},
+    ),
+)
+callback.v2_playbook_on_task_start(task, False)
+callback.v2_runner_on_ok(
+    NS(_host=host, _task=task, _result={'msg': FACT_SECRET}),
+)
+assert len(GET_VARS) == 3
+callback.v2_playbook_on_stats(NS(processed={}, summarize=lambda h: {}))
+'''
+
+
+@pytest.mark.parametrize('log_async', ['False', 'True'])
+def testLogger(tmpdir, log_async):
+    log = tmpdir.join('ansible.log')
+    spill_dir = tmpdir.join('results')
+    env = dict(os.environ)
+    env.update({
+        'HE_ANSIBLE_LOG_PATH': str(log),
+        'HE_ANSIBLE_LOG_ASYNC': log_async,
+        'HE_ANSIBLE_LOG_SPILL_DIR': str(spill_dir),
+        'HE_ANSIBLE_SPILL_SIZE': '1024',
+    })
+    subprocess.check_call(
+        [
+            sys.executable,
+            '-c',
+            DRIVER,
+            os.path.join(PLUGINS_DIR, '2_ovirt_logger.py'),
+        ],
+        env=env,
+    )
+    content = log.read()
+    assert 'ansible task start' in content
+    assert 'ansible ok' in content
+    assert 'ansible failed' in content
+    assert 'secret_data_1' not in content
+    assert 'secret_data_2' not in content
+    assert '**FILTERED**' in content
+    assert 'spilled to {d}'.format(d=spill_dir) in content
+    spilled, = spill_dir.listdir()
+    assert 'secret_data_1' not in spilled.read()
+    assert '**FILTERED**' in spilled.read()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -38,6 +38,20 @@ class AnsibleCallback(object):
     TYPE = 'OVEHOSTED_AC/type'
     BODY = 'OVEHOSTED_AC/body'
     OTOPI_CALLBACK_OF = 'OTOPI_CALLBACK_OF'
+    # Seconds a message can wait to be written with others, 0 to write
+    # every message as it comes.
+    OTOPI_CALLBACK_FLUSH_INTERVAL = 'OTOPI_CALLBACK_FLUSH_INTERVAL'
+    # Results encoding to this many bytes or more are written to a spill
+    # file in the spill dir, and only a reference to it is sent. They are
+    # not filtered, the spill dir must be private to the deployment.
+    SPILL_DIR = 'HE_ANSIBLE_SPILL_DIR'
+    SPILL_SIZE = 'HE_ANSIBLE_SPILL_SIZE'
+    # Where ovirt_logger writes big failed results, filtered, instead of
+    # logging them.
+    LOG_SPILL_DIR = 'HE_ANSIBLE_LOG_SPILL_DIR'
+    # Log as text, or as compressed JSON lines, see jsonlog.py
+    LOG_FORMAT = 'HE_ANSIBLE_LOG_FORMAT'
+    LOG_COMPRESSION = 'HE_ANSIBLE_LOG_COMPRESSION'
     CALLBACK_NAME = '1_otopi_json'
     LOGGER_CALLBACK_NAME = '2_ovirt_logger'
 
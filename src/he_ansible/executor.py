@@ -0,0 +1,212 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Persistent ansible-playbook executor.
+
+Started by ovirt_hosted_engine_setup.ansible_utils with the interpreter of
+ansible-playbook, so it must only depend on the standard library and ansible.
+
+It imports ansible once, then listens on a UNIX socket. Every request is a
+single JSON line with the ansible-playbook command line, its environment and
+the target numbers of the file descriptors passed along with it (SCM_RIGHTS).
+A child is forked for every request and runs the playbook with everything
+already imported. The replies are a JSON line with the pid of the child and,
+once it exited, a JSON line with its return code.
+"""
+
+
+import array
+import atexit
+import fcntl
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+
+import framing
+
+
+_MAX_FDS = 16
+_FD_BASE = 256
+_RECV_SIZE = 65536
+
+# Imported once, every child finds them in sys.modules
+_PRELOAD = (
+    'ansible.cli.playbook',
+    'ansible.executor.playbook_executor',
+    'ansible.executor.task_queue_manager',
+    'ansible.inventory.manager',
+    'ansible.vars.manager',
+    'ansible.template',
+    'ansible.plugins.loader',
+    'ansible.plugins.callback',
+    'ansible.plugins.callback.default',
+    'ansible.plugins.strategy.linear',
+    'ansible.plugins.connection.local',
+    'ansible.plugins.connection.ssh',
+)
+
+
+def _preload():
+    for name in _PRELOAD:
+        try:
+            __import__(name)
+        except ImportError as e:
+            sys.stderr.write('Cannot preload {n}: {e}\n'.format(n=name, e=e))
+
+
+def _ansible_env(env):
+    return dict((k, v) for k, v in env.items() if k.startswith('ANSIBLE_'))
+
+
+def _receive_request(conn):
+    fds = array.array('i')
+    data, ancdata, flags, addr = conn.recvmsg(
+        _RECV_SIZE,
+        socket.CMSG_SPACE(_MAX_FDS * fds.itemsize),
+    )
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(
+                cdata[:len(cdata) - (len(cdata) % fds.itemsize)]
+            )
+    while not data.endswith(framing.DELIMITER):
+        chunk = conn.recv(_RECV_SIZE)
+        if not chunk:
+            break
+        data += chunk
+    return framing.decode(data), list(fds)
+
+
+def _send(conn, **kwargs):
+    conn.sendall(framing.encode(kwargs))
+
+
+def _map_fds(fds, targets):
+    # Move everything out of the way first, a received descriptor can have
+    # the number of one of the targets.
+    moved = [fcntl.fcntl(fd, fcntl.F_DUPFD, _FD_BASE) for fd in fds]
+    for fd in fds:
+        os.close(fd)
+    for fd, target in zip(moved, targets):
+        os.dup2(fd, target)
+        os.set_inheritable(target, True)
+    for fd in moved:
+        os.close(fd)
+
+
+def _exit_code(code):
+    """The exit status of SystemExit(code), as the interpreter does it."""
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('{c}\n'.format(c=code))
+    return 1
+
+
+def _exit(rc):
+    """
+    Exit the child as ansible-playbook would, running the exit handlers of
+    the callback plugins, that flush and close their logs and channel.
+    """
+    try:
+        atexit._run_exitfuncs()
+        logging.shutdown()
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(rc)
+
+
+def _child(request, fds, warm_env):
+    signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+    os.setsid()
+    _map_fds(fds, request['fds'])
+    os.chdir(request['cwd'])
+    argv = request['argv']
+    env = request['env']
+    if _ansible_env(env) != warm_env:
+        # ansible reads its configuration once, at import time. If it
+        # changed since we preloaded it, run the real thing.
+        os.execve(argv[0], argv, env)
+    os.environ.clear()
+    os.environ.update(env)
+    sys.argv = argv
+    rc = 0
+    try:
+        from ansible.cli.playbook import PlaybookCLI
+        PlaybookCLI.cli_executor(argv)
+    except SystemExit as e:
+        rc = _exit_code(e.code)
+    except BaseException as e:
+        sys.stderr.write('ansible executor: {e}\n'.format(e=e))
+        rc = 250
+    _exit(rc)
+
+
+def _serve(server, conn, warm_env):
+    request, fds = _receive_request(conn)
+    start = time.monotonic()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            server.close()
+            conn.close()
+            _child(request, fds, warm_env)
+        finally:
+            os._exit(127)
+    for fd in fds:
+        os.close(fd)
+    _send(conn, pid=pid)
+    pid, status = os.waitpid(pid, 0)
+    if os.WIFSIGNALED(status):
+        rc = -os.WTERMSIG(status)
+    else:
+        rc = os.WEXITSTATUS(status)
+    _send(conn, rc=rc, elapsed=time.monotonic() - start)
+
+
+def main(socket_path):
+    warm_env = _ansible_env(os.environ)
+    _preload()
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(socket_path + '.tmp')
+    server.listen(1)
+    # Appear only once ready, the client waits for the socket to exist
+    os.rename(socket_path + '.tmp', socket_path)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    while True:
+        conn, addr = server.accept()
+        try:
+            _serve(server, conn, warm_env)
+        except Exception as e:
+            sys.stderr.write('ansible executor: {e}\n'.format(e=e))
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1])
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,96 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import executor
+import framing
+
+# A playbook run that only writes its output at exit, as the callback
+# plugins do with their logs.
+PLAYBOOK_CLI = '''
+import atexit
+import sys
+
+
+class PlaybookCLI(object):
+
+    @staticmethod
+    def cli_executor(argv):
+        out = open(argv[1], 'w')
+        out.write('flushed at exit')
+        atexit.register(out.close)
+        sys.exit(int(argv[2]))
+'''
+
+
+def testExitCode(capsys):
+    # As the interpreter exits on SystemExit
+    assert executor._exit_code(None) == 0
+    assert executor._exit_code(0) == 0
+    assert executor._exit_code(4) == 4
+    assert executor._exit_code('ERROR! bad playbook') == 1
+    assert capsys.readouterr().err == 'ERROR! bad playbook\n'
+
+
+def testWarmExit(tmpdir):
+    # ansible, as far as the executor is concerned
+    tmpdir.join('ansible', '__init__.py').write('', ensure=True)
+    tmpdir.join('ansible', 'cli', '__init__.py').write('', ensure=True)
+    tmpdir.join('ansible', 'cli', 'playbook.py').write(PLAYBOOK_CLI)
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([
+        str(tmpdir),
+        os.path.dirname(os.path.abspath(executor.__file__)),
+    ])
+    socket_path = str(tmpdir.join('executor.sock'))
+    proc = subprocess.Popen(
+        [sys.executable, executor.__file__, socket_path],
+        env=env,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        deadline = time.monotonic() + 30
+        while not os.path.exists(socket_path):
+            assert proc.poll() is None and time.monotonic() < deadline
+            time.sleep(0.05)
+        out = tmpdir.join('out')
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(socket_path)
+        sock.sendall(framing.encode({
+            'argv': ['ansible-playbook', str(out), '3'],
+            'env': env,
+            'cwd': str(tmpdir),
+            'fds': [],
+        }))
+        replies = sock.makefile('rb')
+        assert 'pid' in framing.decode(replies.readline())
+        assert framing.decode(replies.readline())['rc'] == 3
+        sock.close()
+        assert out.read() == 'flushed at exit'
+    finally:
+        proc.terminate()
+        proc.wait()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
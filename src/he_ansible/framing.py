@@ -0,0 +1,108 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Framing of the otopi callback stream."""
+
+
+# This module is used by both the otopi json callback plugin, which writes
+# the stream, and ovirt-hosted-engine-setup, which reads it.
+# Every frame is a JSON document followed by a newline. JSON never contains
+# a raw newline, so no escaping is needed.
+# orjson is used if available, in the interpreter of each side. It does not
+# handle all that json does, e.g. integers beyond 64 bits, so json remains
+# the fallback for every frame.
+
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DELIMITER = b'\n'
+
+
+def _json_encode(payload):
+    return json.dumps(
+        payload,
+        ensure_ascii=False,
+    ).encode('utf-8') + DELIMITER
+
+
+if orjson is not None:
+    def encode(payload):
+        try:
+            return orjson.dumps(
+                payload,
+                option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE,
+            )
+        except TypeError:
+            return _json_encode(payload)
+
+    def decode(frame):
+        try:
+            return orjson.loads(frame)
+        except ValueError:
+            # e.g. NaN, written by json
+            return json.loads(frame)
+else:
+    encode = _json_encode
+    decode = json.loads
+
+
+class FrameReader(object):
+    """
+    Split a byte stream in frames.
+    Data is appended to a single bytearray and every byte is scanned for
+    the delimiter only once, so a frame arriving in many small chunks is
+    handled in linear time.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        # Length of the beginning of _buffer known not to hold a DELIMITER
+        self._scanned = 0
+
+    def feed(self, data):
+        """Append data, return the list of the frames it completed."""
+        self._buffer += data
+        frames = []
+        start = 0
+        end = self._buffer.find(DELIMITER, self._scanned)
+        while end != -1:
+            frames.append(bytes(self._buffer[start:end]))
+            start = end + len(DELIMITER)
+            end = self._buffer.find(DELIMITER, start)
+        if start:
+            del self._buffer[:start]
+        self._scanned = len(self._buffer)
+        return frames
+
+    def pending(self):
+        """Return and forget the data not terminated by a delimiter."""
+        frame = bytes(self._buffer)
+        del self._buffer[:]
+        self._scanned = 0
+        return frame
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
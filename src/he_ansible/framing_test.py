@@ -0,0 +1,160 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import json
+import os
+import time
+
+import pytest
+
+import framing
+
+READ_SIZE = 65536
+
+
+def _result_message(size):
+    # Roughly what a big otopi_iscsi_devices result looks like
+    luns = []
+    while len(luns) * 250 < size:
+        n = len(luns)
+        luns.append({
+            'id': '36001405{n:024x}'.format(n=n),
+            'size': str(n * 1024 ** 3),
+            'vendor_id': 'LIO-ORG',
+            'product_id': 'lun{n}'.format(n=n),
+            'serial': 'SLIO-ORG_lun{n}_è'.format(n=n),
+            'paths': n % 4 + 1,
+            'status': 'free',
+        })
+    return {
+        'type': 'result',
+        'body': {
+            'otopi_iscsi_devices': {
+                'changed': False,
+                'ovirt_host_storages': luns,
+            },
+        },
+    }
+
+
+def _feed(reader, stream):
+    frames = []
+    for i in range(0, len(stream), READ_SIZE):
+        frames.extend(reader.feed(stream[i:i + READ_SIZE]))
+    return frames
+
+
+def testRoundTrip():
+    payloads = [
+        {'type': 'info', 'body': 'TASK [one]'},
+        {'type': 'debug', 'body': 'multi\nline è 中'},
+        {'type': 'result', 'body': {}},
+    ]
+    stream = b''.join(framing.encode(p) for p in payloads)
+    # Split everywhere, also inside multibyte characters
+    for step in (1, 2, 3, 7, len(stream)):
+        reader = framing.FrameReader()
+        frames = []
+        for i in range(0, len(stream), step):
+            frames.extend(reader.feed(stream[i:i + step]))
+        assert [framing.decode(f) for f in frames] == payloads
+        assert reader.pending() == b''
+
+
+def testPending():
+    reader = framing.FrameReader()
+    assert reader.feed(b'{"a": 1}\n{"b"') == [b'{"a": 1}']
+    assert reader.feed(b': 2}') == []
+    assert reader.pending() == b'{"b": 2}'
+    assert reader.pending() == b''
+
+
+def testLargeResult():
+    payload = _result_message(4 * 1024 ** 2)
+    stream = framing.encode({'type': 'info', 'body': 'ok'})
+    stream += framing.encode(payload)
+    frames = _feed(framing.FrameReader(), stream)
+    assert len(frames) == 2
+    assert framing.decode(frames[1]) == payload
+
+
+def testFallback():
+    # orjson cannot do these, json can
+    payload = {'type': 'result', 'body': {1: 2 ** 70, 'è': [1.5, None]}}
+    frame = framing.encode(payload)
+    assert frame.endswith(framing.DELIMITER)
+    assert framing.decode(frame[:-1]) == {
+        'type': 'result',
+        'body': {'1': 2 ** 70, 'è': [1.5, None]},
+    }
+    # Frames written by json
+    frame = json.dumps({'a': float('inf')}).encode('utf-8')
+    assert framing.decode(frame) == {'a': float('inf')}
+
+
+def benchmark(sizes=(1, 4, 16, 64)):
+    """
+    Time reading result messages of sizes MiB in READ_SIZE chunks, return
+    [(size, framing seconds, framing and decoding seconds)].
+    """
+    timings = []
+    for size in sizes:
+        stream = framing.encode(_result_message(size * 1024 ** 2))
+        start = time.monotonic()
+        reader = framing.FrameReader()
+        frames = _feed(reader, stream)
+        framed = time.monotonic() - start
+        assert frames == [stream[:-len(framing.DELIMITER)]]
+        framing.decode(frames[0])
+        decoded = time.monotonic() - start
+        timings.append((size, framed, decoded))
+    return timings
+
+
+def testBenchmarkFrames():
+    # What is timed is read as a single frame
+    benchmark(sizes=(1,))
+
+
+# Timing ratios are not reliable on a loaded machine
+@pytest.mark.skipif(
+    not os.environ.get('HE_ANSIBLE_BENCHMARK'),
+    reason='set HE_ANSIBLE_BENCHMARK to compare timings',
+)
+def testBenchmark():
+    (small, small_framed, _), (big, big_framed, _) = benchmark(sizes=(2, 16))
+    # Linear: 8 times the size takes about 8 times as long, quadratic 64
+    assert big_framed / big < 3 * small_framed / small + 0.01
+
+
+if __name__ == '__main__':
+    for size, framed, decoded in benchmark():
+        print(
+            '{s:3d} MiB: framing {f:.3f}s, framing and decoding {d:.3f}s '
+            '({r:.1f} MiB/s, {j})'.format(
+                s=size,
+                j='orjson' if framing.orjson is not None else 'json',
+                f=framed,
+                d=decoded,
+                r=size / decoded,
+            )
+        )
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,304 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""JSON lines logs of the playbook runs, optionally compressed."""
+
+
+# The ovirt_logger callback plugin writes them when HE_ANSIBLE_LOG_FORMAT is
+# jsonl, one record per line, with the keys in FIELDS that have a value.
+# The plugin filters the values before serializing them.
+# To read them:
+#   hosted-engine --ansible-log [--host=H] [--task=T] ... LOG...
+# he_ansible is not in the path of the system python, out of the setup this
+# runs the installed jsonlog.py as a script.
+
+
+import gzip
+import io
+import json
+import sys
+import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+TEXT = 'text'
+JSONL = 'jsonl'
+
+FORMATS = (TEXT, JSONL)
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+NONE = 'none'
+COMPRESSIONS = (GZIP, ZSTD, NONE)
+
+_SUFFIXES = {
+    TEXT: '.log',
+    JSONL: '.jsonl',
+    GZIP: '.gz',
+    ZSTD: '.zst',
+    NONE: '',
+}
+
+FIELDS = (
+    'ts',
+    'level',
+    'playbook',
+    'play',
+    'task',
+    'host',
+    'status',
+    'duration',
+    'msg',
+)
+
+# Seconds compressed records can wait in the compressor before being written.
+# Flushing a compressor for every record would ruin the compression.
+FLUSH_INTERVAL = 1.0
+
+_LEVELS = {
+    'DEBUG': 10,
+    'INFO': 20,
+    'WARNING': 30,
+    'ERROR': 40,
+    'CRITICAL': 50,
+}
+
+_GZIP_MAGIC = b'\x1f\x8b'
+_ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+
+
+def available_compression(compression):
+    """Return compression, gzip instead of zstd if zstandard is missing."""
+    if compression == ZSTD and zstandard is None:
+        return GZIP
+    return compression
+
+
+def file_name(base, log_format, compression):
+    """Name of the log of base, for log_format and compression."""
+    if log_format != JSONL:
+        return base + _SUFFIXES[TEXT]
+    return base + _SUFFIXES[JSONL] + _SUFFIXES[compression]
+
+
+def base_name(path):
+    """Reverse of file_name."""
+    for suffixes in (
+        (_SUFFIXES[GZIP], _SUFFIXES[ZSTD]),
+        (_SUFFIXES[JSONL], _SUFFIXES[TEXT]),
+    ):
+        for suffix in suffixes:
+            if path.endswith(suffix):
+                path = path[:-len(suffix)]
+                break
+    return path
+
+
+class Writer(object):
+    """
+    Text stream appending to a compressed file.
+    flush() writes what was compressed only every flush_interval seconds,
+    sync() and close() always do.
+    """
+
+    def __init__(
+        self,
+        path,
+        compression=GZIP,
+        flush_interval=FLUSH_INTERVAL,
+    ):
+        compression = available_compression(compression)
+        self._file = io.open(path, mode='ab')
+        if compression == GZIP:
+            # Every Writer appends a gzip member, readers join them
+            self._compressor = gzip.GzipFile(fileobj=self._file, mode='ab')
+        elif compression == ZSTD:
+            self._compressor = zstandard.ZstdCompressor().stream_writer(
+                self._file,
+            )
+        else:
+            self._compressor = None
+        self._compression = compression
+        self._flush_interval = flush_interval
+        self._flushed = time.monotonic()
+
+    def write(self, text):
+        data = text.encode('utf-8')
+        if self._compressor is None:
+            self._file.write(data)
+        else:
+            self._compressor.write(data)
+        return len(text)
+
+    def flush(self):
+        if time.monotonic() - self._flushed >= self._flush_interval:
+            self.sync()
+
+    def sync(self):
+        """Write everything written so far, keeping the stream open."""
+        if self._compression == GZIP:
+            self._compressor.flush()
+        elif self._compression == ZSTD:
+            self._compressor.flush(zstandard.FLUSH_BLOCK)
+        self._file.flush()
+        self._flushed = time.monotonic()
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._compression == GZIP:
+            # Does not close the file it was given
+            self._compressor.close()
+        elif self._compression == ZSTD:
+            self._compressor.flush(zstandard.FLUSH_FRAME)
+        self._file.close()
+
+
+def open_log(path):
+    """Text stream of a log, whatever its compression."""
+    with io.open(path, mode='rb') as f:
+        magic = f.read(len(_ZSTD_MAGIC))
+    if magic.startswith(_GZIP_MAGIC):
+        return gzip.open(path, mode='rt', encoding='utf-8')
+    if magic == _ZSTD_MAGIC:
+        if zstandard is None:
+            raise RuntimeError(
+                '{p} is compressed with zstd, which needs the python '
+                'zstandard module'.format(p=path)
+            )
+        return io.TextIOWrapper(
+            zstandard.ZstdDecompressor().stream_reader(
+                io.open(path, mode='rb'),
+                read_across_frames=True,
+            ),
+            encoding='utf-8',
+        )
+    return io.open(path, mode='r', encoding='utf-8')
+
+
+def read(path):
+    """
+    Yield the records of a log.
+    The log of a run that was killed ends with a truncated stream, and maybe
+    a truncated record: they are skipped.
+    """
+    with open_log(path) as f:
+        try:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+        except EOFError:
+            return
+
+
+def matches(
+    record,
+    host=None,
+    task=None,
+    status=None,
+    level=None,
+    playbook=None,
+):
+    """
+    Whether record matches all the given criteria.
+    task and playbook are substrings, level is the lowest level name.
+    """
+    if host is not None and record.get('host') != host:
+        return False
+    if status is not None and record.get('status') != status.upper():
+        return False
+    if level is not None and _LEVELS.get(
+        record.get('level'),
+        0,
+    ) < _LEVELS.get(level.upper(), 0):
+        return False
+    for key, value in (('task', task), ('playbook', playbook)):
+        if value is not None and value not in (record.get(key) or ''):
+            return False
+    return True
+
+
+def format_record(record):
+    return '{ts} {level} {where}{msg}'.format(
+        ts=time.strftime(
+            '%Y-%m-%d %H:%M:%S',
+            time.localtime(record.get('ts', 0)),
+        ),
+        level=record.get('level'),
+        where=''.join(
+            '[{v}] '.format(v=record[k])
+            for k in ('host', 'task', 'status', 'duration')
+            if record.get(k) is not None
+        ),
+        msg=record.get('msg', ''),
+    )
+
+
+def main(argv=None):
+    # Not needed by the callback plugin
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Show the records of JSON lines ansible logs',
+    )
+    parser.add_argument('logs', metavar='LOG', nargs='+')
+    parser.add_argument('--host', help='only of this host')
+    parser.add_argument('--task', help='only of tasks including this')
+    parser.add_argument('--playbook', help='only of playbooks including this')
+    parser.add_argument('--status', help='only with this status, e.g. failed')
+    parser.add_argument('--level', help='only of this level or higher')
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='output JSON lines, as they are in the logs',
+    )
+    args = parser.parse_args(argv)
+    for path in args.logs:
+        for record in read(path):
+            if matches(
+                record,
+                host=args.host,
+                task=args.task,
+                status=args.status,
+                level=args.level,
+                playbook=args.playbook,
+            ):
+                sys.stdout.write(
+                    '{r}\n'.format(
+                        r=(
+                            json.dumps(record, ensure_ascii=False)
+                            if args.json
+                            else format_record(record)
+                        )
+                    )
+                )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
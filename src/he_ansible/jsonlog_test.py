@@ -0,0 +1,132 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import json
+import os
+
+import pytest
+
+import jsonlog
+
+
+def _records(n):
+    return [
+        {
+            'ts': 1700000000.0 + i,
+            'level': 'ERROR' if i % 10 == 9 else 'INFO',
+            'playbook': 'trigger_role.yml',
+            'task': 'Wait for the host to be up',
+            'host': 'localhost' if i % 2 else 'engine',
+            'status': 'FAILED' if i % 10 == 9 else 'OK',
+            'duration': 0.5,
+            'msg': 'ansible ok {i}'.format(i=i),
+        }
+        for i in range(n)
+    ]
+
+
+def _write(path, records, compression, close=True):
+    writer = jsonlog.Writer(path, compression)
+    for record in records:
+        writer.write(json.dumps(record) + '\n')
+        writer.flush()
+    if close:
+        writer.close()
+    else:
+        writer.sync()
+    return writer
+
+
+@pytest.mark.parametrize('compression', [
+    jsonlog.GZIP,
+    jsonlog.NONE,
+    jsonlog.ZSTD,
+])
+def testRoundTrip(tmpdir, compression):
+    if compression == jsonlog.ZSTD:
+        pytest.importorskip('zstandard')
+    path = jsonlog.file_name(
+        str(tmpdir.join('run')),
+        jsonlog.JSONL,
+        compression,
+    )
+    records = _records(1000)
+    _write(path, records[:500], compression)
+    # A second writer appends
+    _write(path, records[500:], compression)
+    assert list(jsonlog.read(path)) == records
+    if compression != jsonlog.NONE:
+        assert os.path.getsize(path) < len(
+            ''.join(json.dumps(r) + '\n' for r in records)
+        ) / 10
+
+
+def testKilled(tmpdir):
+    path = str(tmpdir.join('run.jsonl.gz'))
+    records = _records(100)
+    writer = _write(path, records, jsonlog.GZIP, close=False)
+    # Lost with the process, after the last sync
+    writer.write('{"ts": 1700000200.0, "level": "INFO", "ms')
+    writer.sync()
+    assert list(jsonlog.read(path)) == records
+
+
+def testFileName():
+    for log_format, compression, name in (
+        (jsonlog.TEXT, jsonlog.GZIP, 'run.log'),
+        (jsonlog.JSONL, jsonlog.GZIP, 'run.jsonl.gz'),
+        (jsonlog.JSONL, jsonlog.ZSTD, 'run.jsonl.zst'),
+        (jsonlog.JSONL, jsonlog.NONE, 'run.jsonl'),
+    ):
+        assert jsonlog.file_name('run', log_format, compression) == name
+        assert jsonlog.base_name(name) == 'run'
+
+
+def testMatches():
+    records = _records(20)
+    assert len([r for r in records if jsonlog.matches(r)]) == 20
+    assert len([
+        r for r in records if jsonlog.matches(r, level='warning')
+    ]) == 2
+    assert len([
+        r for r in records if jsonlog.matches(r, status='failed')
+    ]) == 2
+    assert len([
+        r for r in records
+        if jsonlog.matches(r, host='engine', task='host to be')
+    ]) == 10
+    assert not jsonlog.matches(records[0], playbook='other.yml')
+
+
+def testMain(tmpdir, capsys):
+    path = str(tmpdir.join('run.jsonl.gz'))
+    _write(path, _records(20), jsonlog.GZIP)
+    assert jsonlog.main(['--status', 'failed', '--json', path]) == 0
+    out = capsys.readouterr().out.splitlines()
+    assert [json.loads(line)['msg'] for line in out] == [
+        'ansible ok 9',
+        'ansible ok 19',
+    ]
+    jsonlog.main(['--host', 'engine', path])
+    out = capsys.readouterr().out.splitlines()
+    assert len(out) == 10
+    assert '[engine] [Wait for the host to be up] [OK] [0.5]' in out[0]
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
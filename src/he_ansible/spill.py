@@ -0,0 +1,147 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Spill files for big ansible results."""
+
+
+# This module is used by the callback plugins, which write spill files, and
+# by ovirt-hosted-engine-setup, which reads them.
+# A result bigger than a threshold is written once to a file named after
+# the sha256 of its content, and only a reference to it is sent and logged.
+# Those of the callback stream are not filtered, as they are read back: they
+# are in the per deployment dir, readable only by their owner, and removed at
+# the end of the deployment. Those of the log are filtered as the log is.
+
+
+import hashlib
+import os
+import tempfile
+
+try:
+    from he_ansible import framing
+except ImportError:
+    # In the callback plugins, he_ansible itself is in sys.path
+    import framing
+
+
+# Key of the references, a result is never a dict with only this key
+REFERENCE = 'OVEHOSTED_AC/spilled'
+
+# Result keys included in the summary of a reference
+_SUMMARY_KEYS = (
+    'changed',
+    'failed',
+    'msg',
+    'rc',
+)
+# Result keys included in the summary by their tail, e.g. where the error is
+_SUMMARY_TAIL_KEYS = (
+    'stderr',
+    'stdout',
+)
+_SUMMARY_MSG_SIZE = 512
+
+
+def _summary(data):
+    summary = {}
+    if isinstance(data, dict):
+        summary['keys'] = sorted(str(k) for k in data)
+        for k in _SUMMARY_KEYS:
+            if k in data:
+                v = data[k]
+                if isinstance(v, str) and len(v) > _SUMMARY_MSG_SIZE:
+                    v = v[:_SUMMARY_MSG_SIZE] + '...'
+                summary[k] = v
+        for k in _SUMMARY_TAIL_KEYS:
+            v = data.get(k)
+            if isinstance(v, str) and v:
+                if len(v) > _SUMMARY_MSG_SIZE:
+                    v = '...' + v[-_SUMMARY_MSG_SIZE:]
+                summary[k] = v
+    elif isinstance(data, list):
+        summary['items'] = len(data)
+    return summary
+
+
+def spill(data, directory, threshold, transform=None):
+    """
+    Return a reference to data if it encodes to threshold bytes or more,
+    after writing it to directory, or None.
+    transform, if any, is applied to big data, before writing it and
+    building the summary of the reference.
+    """
+    if not directory or not threshold or threshold <= 0:
+        return None
+    encoded = framing.encode(data)
+    if len(encoded) < threshold:
+        return None
+    if transform is not None:
+        data = transform(data)
+        encoded = framing.encode(data)
+    digest = hashlib.sha256(encoded).hexdigest()
+    path = os.path.join(directory, '{d}.json'.format(d=digest))
+    if not os.path.exists(path):
+        if not os.path.isdir(directory):
+            os.makedirs(directory, 0o700)
+        fd, tmp = tempfile.mkstemp(dir=directory, prefix='.spill-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(encoded)
+            os.rename(tmp, path)
+        except Exception:
+            os.unlink(tmp)
+            raise
+    return {
+        REFERENCE: {
+            'path': path,
+            'sha256': digest,
+            'size': len(encoded),
+            'summary': _summary(data),
+        },
+    }
+
+
+def is_reference(data):
+    return isinstance(data, dict) and len(data) == 1 and REFERENCE in data
+
+
+def describe(reference):
+    """A short text for logs, instead of the spilled data."""
+    ref = reference[REFERENCE]
+    return 'result of {s} bytes spilled to {p}, summary: {m}'.format(
+        s=ref['size'],
+        p=ref['path'],
+        m=ref['summary'],
+    )
+
+
+def load(reference):
+    """Read the data of a reference, checking it was not changed."""
+    ref = reference[REFERENCE]
+    with open(ref['path'], 'rb') as f:
+        encoded = f.read()
+    if hashlib.sha256(encoded).hexdigest() != ref['sha256']:
+        raise RuntimeError(
+            'Spilled result {p} was modified'.format(p=ref['path'])
+        )
+    return framing.decode(encoded)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
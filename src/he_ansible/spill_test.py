@@ -0,0 +1,87 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import os
+import stat
+
+import pytest
+
+import spill
+
+
+def _result(n):
+    return {
+        'changed': False,
+        'failed': True,
+        'msg': 'x' * 1000,
+        'stderr': 'x' * 1000 + 'the error',
+        'ovirt_host_storages': [{'id': i} for i in range(n)],
+    }
+
+
+def testSmall(tmpdir):
+    assert spill.spill(_result(1), str(tmpdir), 64 * 1024) is None
+    assert spill.spill(_result(10000), str(tmpdir), 0) is None
+    assert spill.spill(_result(10000), None, 1) is None
+    assert tmpdir.listdir() == []
+
+
+def testSpill(tmpdir):
+    directory = os.path.join(str(tmpdir), 'results')
+    result = _result(10000)
+    reference = spill.spill(result, directory, 64 * 1024)
+    assert spill.is_reference(reference)
+    assert not spill.is_reference(result)
+    ref = reference[spill.REFERENCE]
+    assert os.path.dirname(ref['path']) == directory
+    assert os.path.basename(ref['path']) == ref['sha256'] + '.json'
+    assert stat.S_IMODE(os.stat(ref['path']).st_mode) == 0o600
+    assert ref['summary']['failed']
+    assert ref['summary']['msg'].endswith('...')
+    assert ref['summary']['stderr'].startswith('...')
+    assert ref['summary']['stderr'].endswith('the error')
+    assert 'ovirt_host_storages' in ref['summary']['keys']
+    assert ref['path'] in spill.describe(reference)
+    assert spill.load(reference) == result
+    # Same content, same file
+    assert spill.spill(_result(10000), directory, 64 * 1024) == reference
+    assert os.listdir(directory) == [os.path.basename(ref['path'])]
+
+
+def testTransform(tmpdir):
+    def _filter(data):
+        return dict(
+            (k, 'filtered' if k == 'msg' else v) for k, v in data.items()
+        )
+
+    assert spill.spill(_result(1), str(tmpdir), 64 * 1024, _filter) is None
+    reference = spill.spill(_result(10000), str(tmpdir), 64 * 1024, _filter)
+    assert reference[spill.REFERENCE]['summary']['msg'] == 'filtered'
+    assert spill.load(reference) == _filter(_result(10000))
+
+
+def testModified(tmpdir):
+    reference = spill.spill(_result(10000), str(tmpdir), 1)
+    with open(reference[spill.REFERENCE]['path'], 'ab') as f:
+        f.write(b' ')
+    with pytest.raises(RuntimeError):
+        spill.load(reference)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,163 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Task duration statistics of a playbook run."""
+
+
+# Used by the ovirt_logger callback plugin, which records every task
+# result as a dict with these keys:
+#   name, host, status, role, tags, duration (seconds), attempts
+# attempts is set by ansible only for tasks with until.
+
+
+import math
+
+
+TOP_SLOWEST = 10
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a non empty list."""
+    ordered = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(ordered)))
+    return ordered[max(rank, 1) - 1]
+
+
+def _aggregate(groups):
+    return dict(
+        (
+            key,
+            {
+                'count': len(durations),
+                'duration': round(sum(durations), 3),
+            },
+        )
+        for key, durations in groups.items()
+    )
+
+
+def summarize(records, top=TOP_SLOWEST):
+    """Return the statistics of records, as a JSON serializable dict."""
+    roles = {}
+    tags = {}
+    names = {}
+    retried = []
+    for record in records:
+        duration = record['duration']
+        if record.get('role'):
+            roles.setdefault(record['role'], []).append(duration)
+        for tag in record.get('tags') or ():
+            tags.setdefault(tag, []).append(duration)
+        names.setdefault(record['name'], []).append(duration)
+        if (record.get('attempts') or 0) > 1:
+            retried.append(record)
+    repeated = {}
+    for name, durations in names.items():
+        if len(durations) > 1:
+            repeated[name] = {
+                'count': len(durations),
+                'duration': round(sum(durations), 3),
+                'p50': percentile(durations, 50),
+                'p95': percentile(durations, 95),
+                'max': max(durations),
+            }
+    return {
+        'tasks': len(records),
+        'duration': round(sum(r['duration'] for r in records), 3),
+        'slowest': sorted(
+            records,
+            key=lambda r: r['duration'],
+            reverse=True,
+        )[:top],
+        'roles': _aggregate(roles),
+        'tags': _aggregate(tags),
+        'repeated': repeated,
+        'retries': {
+            'tasks': retried,
+            'attempts': sum(r['attempts'] for r in retried),
+            'duration': round(sum(r['duration'] for r in retried), 3),
+        },
+    }
+
+
+def format_summary(summary):
+    """Return the lines of a human readable version of summary."""
+    lines = [
+        'SLOWEST TASKS:',
+    ] + [
+        '{d:10.3f}s\t{n} [{h}]'.format(
+            d=r['duration'],
+            n=r['name'],
+            h=r['host'],
+        )
+        for r in summary['slowest']
+    ]
+    for title, groups in (
+        ('ROLES', summary['roles']),
+        ('TAGS', summary['tags']),
+    ):
+        lines.append('{t}:'.format(t=title))
+        lines.extend(
+            '{d:10.3f}s\t{c:5d} tasks\t{n}'.format(
+                d=v['duration'],
+                c=v['count'],
+                n=k,
+            )
+            for k, v in sorted(
+                groups.items(),
+                key=lambda e: e[1]['duration'],
+                reverse=True,
+            )
+        )
+    lines.append('REPEATED TASKS (count, p50, p95, max):')
+    lines.extend(
+        '{c:5d}\t{p50:.3f}s\t{p95:.3f}s\t{m:.3f}s\t{n}'.format(
+            c=v['count'],
+            p50=v['p50'],
+            p95=v['p95'],
+            m=v['max'],
+            n=k,
+        )
+        for k, v in sorted(
+            summary['repeated'].items(),
+            key=lambda e: e[1]['duration'],
+            reverse=True,
+        )
+    )
+    retries = summary['retries']
+    lines.append(
+        'RETRY LOOPS: {d:.3f}s in {a} attempts'.format(
+            d=retries['duration'],
+            a=retries['attempts'],
+        )
+    )
+    lines.extend(
+        '{d:10.3f}s\t{a:5d} attempts\t{n} [{h}]'.format(
+            d=r['duration'],
+            a=r['attempts'],
+            n=r['name'],
+            h=r['host'],
+        )
+        for r in retries['tasks']
+    )
+    return lines
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
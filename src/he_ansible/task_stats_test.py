@@ -0,0 +1,88 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import json
+
+import task_stats
+
+
+def _record(name, duration, role=None, tags=(), attempts=None):
+    return {
+        'name': name,
+        'host': 'localhost',
+        'status': 'OK',
+        'role': role,
+        'tags': list(tags),
+        'duration': duration,
+        'attempts': attempts,
+    }
+
+
+def testPercentile():
+    values = list(range(1, 21))
+    assert task_stats.percentile(values, 50) == 10
+    assert task_stats.percentile(values, 95) == 19
+    assert task_stats.percentile([7], 95) == 7
+    assert task_stats.percentile([3, 1, 2], 0) == 1
+
+
+def testSummarize():
+    records = [
+        _record('Wait for the engine', 480.0, 'engine_setup', ['final'], 48),
+        _record('Check engine health', 2.0, 'engine_setup', ['final']),
+        _record('Check engine health', 4.0, 'engine_setup', ['final']),
+        _record('Check engine health', 30.0, 'engine_setup', ['final']),
+        _record('Gather facts', 1.5, tags=['always', 'final']),
+    ]
+    summary = task_stats.summarize(records, top=2)
+    assert summary['tasks'] == 5
+    assert summary['duration'] == 517.5
+    assert [r['name'] for r in summary['slowest']] == [
+        'Wait for the engine',
+        'Check engine health',
+    ]
+    assert summary['roles'] == {
+        'engine_setup': {'count': 4, 'duration': 516.0},
+    }
+    assert summary['tags']['final'] == {'count': 5, 'duration': 517.5}
+    assert summary['tags']['always'] == {'count': 1, 'duration': 1.5}
+    assert summary['repeated'] == {
+        'Check engine health': {
+            'count': 3,
+            'duration': 36.0,
+            'p50': 4.0,
+            'p95': 30.0,
+            'max': 30.0,
+        },
+    }
+    assert summary['retries']['attempts'] == 48
+    assert summary['retries']['duration'] == 480.0
+    assert json.loads(json.dumps(summary)) == summary
+    lines = task_stats.format_summary(summary)
+    assert 'RETRY LOOPS: 480.000s in 48 attempts' in lines
+
+
+def testEmpty():
+    summary = task_stats.summarize([])
+    assert summary['tasks'] == 0
+    assert summary['slowest'] == []
+    task_stats.format_summary(summary)
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,235 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Filtering of secrets out of the ovirt_logger log."""
+
+
+# Every record is scanned once by a single expression: the tokens, as a
+# trie of alternations, so that at every position only the characters
+# that can still lead to a token are tried, whatever the number of tokens,
+# then the regular expressions. Where it matches, the longest token matching
+# there and the regular expressions matching there are taken, then the scan
+# goes on from the next character, so that overlapping occurrences are
+# filtered too. See token_filter_test.benchmark for the timings, str.find
+# per token is only faster with a few tens of tokens.
+# Tokens are deduplicated, as hosts often share them, and the expression is
+# compiled again only when the tokens or the regular expressions change.
+# Regular expressions with backreferences, or which cannot be combined,
+# are still searched one at a time.
+
+
+import re
+
+
+FILTERED = '**FILTERED**'
+FILTER_GROUP = 'filter'
+
+_NAMED_GROUP_RE = re.compile(r'(?<!\\)\(\?P<\w+>')
+_BACKREF_RE = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def _trie_branches(node):
+    """
+    The branches of the expression matching the tokens of a trie node,
+    {char: node}, '' marking the end of a token. Greedy, so the longest
+    token matches.
+    """
+    branches = []
+    for char in sorted(k for k in node if k):
+        chars = [char]
+        child = node[char]
+        # Chains of characters are literals, not nested groups
+        while len(child) == 1 and '' not in child:
+            (char, child), = child.items()
+            chars.append(char)
+        pattern = re.escape(''.join(chars))
+        rest = _trie_branches(child)
+        if len(rest) == 1 and '' not in child:
+            pattern += rest[0]
+        elif rest:
+            pattern += '(?:{b}){o}'.format(
+                b='|'.join(rest),
+                o='?' if '' in child else '',
+            )
+        branches.append(pattern)
+    return branches
+
+
+def _token_branches(tokens):
+    trie = {}
+    for token in tokens:
+        node = trie
+        for char in token:
+            node = node.setdefault(char, {})
+        node[''] = {}
+    return _trie_branches(trie)
+
+
+class TokenFilter(object):
+    """
+    Filter overlapping tokens within content.
+    Regular expressions must each have a group named 'filter', the content
+    of this group is filtered. Expressions without it are ignored.
+
+    Examples, filtered parts in brackets:
+    content=[abcabca], tokens=('abca',)
+    content=aaa[bbb]ccc, tokens=('bbb', 'abbba')
+    content=[aaaab]a[bbbb], tokens=('aaab', 'aaa', 'bbb')
+    content=a BS [some secret] ES b, regexps=('BS (?P<filter>.*) ES',)
+    """
+
+    def __init__(self):
+        self._key = ((), ())
+        self._tokens = ()
+        self._token_set = frozenset()
+        self._regexps = []
+        self._scanner = None
+        # Matched where the scanner matches, searched on their own
+        self._combined = []
+        self._separate = []
+        # Regular expressions, once seen, are kept until the end
+        self._re_objects = {}
+        self._compiled = True
+
+    def update(self, tokens, regexps):
+        """
+        Set the tokens and regular expressions to filter. This is cheap if
+        they did not change, the matcher is compiled again by the next
+        filter() only if they did.
+        """
+        key = (tuple(tokens), tuple(regexps))
+        if key != self._key:
+            self._key = key
+            self._compiled = False
+
+    def _compile(self):
+        tokens, regexps = self._key
+        self._tokens = tuple(
+            sorted(
+                set(
+                    token if isinstance(token, str) else str(token)
+                    for token in tokens
+                    if token not in (None, '')
+                )
+            )
+        )
+        self._token_set = frozenset(self._tokens)
+        for exp in regexps:
+            if exp not in self._re_objects:
+                # Might raise, so that the record is not logged at all
+                # rather than logged unfiltered.
+                obj = re.compile(exp)
+                self._re_objects[exp] = (
+                    obj if FILTER_GROUP in obj.groupindex
+                    else None
+                )
+        self._regexps = [
+            obj for obj in self._re_objects.values()
+            if obj is not None
+        ]
+        self._combined = [
+            obj for obj in self._regexps
+            if not _BACKREF_RE.search(obj.pattern)
+        ]
+        self._separate = [
+            obj for obj in self._regexps
+            if obj not in self._combined
+        ]
+        # Not in a group, so that when every branch starts with a literal
+        # sre skips to the positions starting with one of them.
+        branches = _token_branches(self._tokens)
+        token_branches = len(branches)
+        # Only where they match matters here, their groups do not
+        branches.extend(
+            '(?:{e})'.format(e=_NAMED_GROUP_RE.sub('(?:', obj.pattern))
+            for obj in self._combined
+        )
+        try:
+            self._scanner = (
+                re.compile('|'.join(branches)) if branches else None
+            )
+        except re.error:
+            # Global flags in the middle, for example
+            self._separate = self._regexps
+            self._combined = []
+            self._scanner = (
+                re.compile('|'.join(branches[:token_branches]))
+                if self._tokens else None
+            )
+        self._compiled = True
+
+    def _spans(self, content):
+        spans = []
+        scanner = self._scanner
+        index = 0
+        while scanner is not None:
+            scanobj = scanner.search(content, index)
+            if scanobj is None:
+                break
+            index = scanobj.start()
+            # The tokens come first, the longest matching here is taken
+            if scanobj.group() in self._token_set:
+                spans.append(scanobj.span())
+            for reobj in self._combined:
+                matchobj = reobj.match(content, index)
+                if matchobj is not None:
+                    begin = matchobj.start(FILTER_GROUP)
+                    if begin != -1:
+                        spans.append((begin, matchobj.end(FILTER_GROUP)))
+            index += 1
+        for reobj in self._separate:
+            index = 0
+            while True:
+                matchobj = reobj.search(content, index)
+                if matchobj is None:
+                    break
+                begin = matchobj.start(FILTER_GROUP)
+                if begin != -1:
+                    spans.append((begin, matchobj.end(FILTER_GROUP)))
+                # Search again from the filtered group, but always move on
+                index = max(begin, matchobj.start() + 1)
+        return spans
+
+    def filter(self, content):
+        if not self._compiled:
+            self._compile()
+        spans = self._spans(content)
+        if not spans:
+            return content
+        # Merge overlapping and adjacent spans, from the end of content
+        spans.sort(key=lambda e: e[1], reverse=True)
+        parts = []
+        tail = len(content)
+        begin, end = spans[0]
+        for entry in spans[1:]:
+            if entry[1] < begin:
+                parts.append(content[end:tail])
+                parts.append(FILTERED)
+                tail = begin
+                begin, end = entry
+            elif entry[0] < begin:
+                begin = entry[0]
+        parts.append(content[end:tail])
+        parts.append(FILTERED)
+        parts.append(content[:begin])
+        return ''.join(reversed(parts))
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -1,4 +1,4 @@
-
+#
 # ovirt-hosted-engine-setup -- ovirt hosted engine setup
 # Copyright (C) 2017 Red Hat, Inc.
 #
@@ -21,20 +21,35 @@
 """Ansible Utils"""
 
 
+import array
+import collections
+import collections.abc
+import contextlib
 import gettext
 import json
 import os
 import random
+import re
+import select
+import shutil
+import signal
+import socket
 import string
 import subprocess
+import sys
 import tempfile
+import threading
 import time
 
+from he_ansible import framing
+from he_ansible import jsonlog
+from he_ansible import spill
 from he_ansible.constants import AnsibleCallback
 
 from otopi import base
 
 from ovirt_hosted_engine_setup import constants as ohostedcons
+from ovirt_hosted_engine_setup import timeline
 
 
 def _(m):
@@ -60,11 +75,633 @@ _FILTERED_REs = (
     'BEGIN PRIVATE KEY(?P<filter>.*)END PRIVATE KEY',
 )
 
+_ANSIBLE_PLAYBOOK = '/bin/ansible-playbook'
+_SSH = '/usr/bin/ssh'
+
 _EXTRA_VARS_FOR_FILTERING = {
     'he_filtered_tokens_vars': list(_FILTERED_VARS),
     'he_filtered_tokens_re': list(_FILTERED_REs),
 }
 
+# The callback channel is a pipe: we are woken up as soon as the callback
+# plugin writes something. The timeout only bounds how long it takes us to
+# notice that ansible-playbook exited.
+_CALLBACK_POLL_INTERVAL = 0.2
+_CALLBACK_READ_SIZE = 65536
+
+# stdout/stderr of ansible-playbook are logged while it runs, only the last
+# lines are kept in memory and very long lines are truncated.
+_OUTPUT_KEPT_LINES = 100
+_OUTPUT_MAX_LINE_LENGTH = 4096
+_OUTPUT_JOIN_TIMEOUT = 5
+
+_EXECUTOR_START_TIMEOUT = 120
+_EXECUTOR_START_POLL = 0.05
+_EXECUTOR_STOP_TIMEOUT = 10
+
+
+# Settings shared by all the playbook runs of a deployment, see
+# configure_deployment()
+_deployment = {
+    'local_vm_uuid': None,
+    'fact_cache': True,
+    'ssh_multiplexing': True,
+    # Seconds an idle master connection is kept, 0 to close it as soon as
+    # its last client is gone
+    'ssh_control_persist': 60,
+    # Playbook runs sharing the master connections before they are closed,
+    # 0 to keep them until the engine VM is replaced, see
+    # _SSH_MASTERS_CLOSING_TAGS
+    'ssh_persistent_runs': 0,
+    # Seconds, None for no limit: per tag, for any other run, per task
+    'timeouts': {},
+    'timeout': None,
+    'task_timeout': None,
+    # Seconds between two progress reports of a long task
+    'heartbeat_interval': 60,
+    # Of the ansible logs, see he_ansible/jsonlog.py
+    'log_format': jsonlog.TEXT,
+    'log_compression': jsonlog.GZIP,
+}
+
+# Sent by the otopi callback plugin when a task starts
+_TASK_START_RE = re.compile(r'^TASK \[(?P<task>.*)\]$')
+# Between SIGTERM and SIGKILL to the process group
+_KILL_GRACE = 10
+# Seconds the callback plugin can keep progress messages to send them at once
+_CALLBACK_FLUSH_INTERVAL = 0.2
+# Results encoding to more bytes are spilled to files, by the otopi
+# callback plugin to the deployment dir, unfiltered, as they are read back,
+# and by the logger callback plugin to the log dir, filtered
+_RESULT_SPILL_SIZE = 256 * 1024
+_LOG_SPILL_DIR = ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SPILL_DIR
+
+# Unix socket paths are limited to 107 bytes, the control path dir must
+# leave room for the names of the sockets, up to 40 chars for %C
+_SSH_CONTROL_DIR_UUID_LENGTH = 8
+_SSH_CONTROL_EXIT_TIMEOUT = 10
+
+# Tags of the runs changing what facts describe: the fact cache is dropped
+# before and after them. bootstrap_local_vm creates the management bridge
+# and answers the engine FQDN with the local VM, create_target_vm replaces
+# it with the target VM under the same name.
+_FACT_CACHE_INVALIDATING_TAGS = (
+    ohostedcons.Const.HE_TAG_INITIAL_CLEAN,
+    ohostedcons.Const.HE_TAG_BOOTSTRAP_LOCAL_VM,
+    ohostedcons.Const.HE_TAG_CREATE_VM,
+    ohostedcons.Const.HE_TAG_FINAL_CLEAN,
+)
+
+
+# The engine VM is replaced during the deployment under the same name: the
+# master connections must not outlive the runs creating or replacing it.
+_SSH_MASTERS_CLOSING_TAGS = _FACT_CACHE_INVALIDATING_TAGS
+
+
+def configure_deployment(**options):
+    """Set options shared by all the following playbook runs."""
+    _deployment.update(options)
+
+
+def parse_timeouts(value):
+    """Parse 'tag:seconds,tag:seconds' into a dict."""
+    timeouts = {}
+    for item in (value or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        tag, sep, seconds = item.rpartition(':')
+        if not sep or not tag.strip():
+            raise ValueError(
+                _('Invalid timeout "{i}", expected tag:seconds').format(
+                    i=item,
+                )
+            )
+        timeouts[tag.strip()] = float(seconds)
+    return timeouts
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    if hours:
+        return '{h}h{m:02}m{s:02}s'.format(h=hours, m=minutes, s=seconds)
+    return '{m}m{s:02}s'.format(m=minutes, s=seconds)
+
+
+class AnsibleTimeoutError(RuntimeError):
+    """A playbook run, or one of its tasks, exceeded its deadline."""
+
+    def __init__(self, tag, task, elapsed, task_elapsed, limit, scope):
+        self.tag = tag
+        self.task = task
+        self.elapsed = elapsed
+        self.task_elapsed = task_elapsed
+        self.limit = limit
+        self.scope = scope
+        super(AnsibleTimeoutError, self).__init__(
+            _(
+                'Timeout executing ansible-playbook {tag}: the {scope} '
+                'limit of {limit} was exceeded, last task "{task}" ran for '
+                '{task_elapsed}, the playbook for {elapsed}'
+            ).format(
+                tag=tag,
+                scope=scope,
+                limit=_format_duration(limit),
+                task=task,
+                task_elapsed=_format_duration(task_elapsed),
+                elapsed=_format_duration(elapsed),
+            )
+        )
+
+    def as_dict(self):
+        return {
+            'tag': self.tag,
+            'task': self.task,
+            'elapsed': self.elapsed,
+            'task_elapsed': self.task_elapsed,
+            'limit': self.limit,
+            'scope': self.scope,
+        }
+
+
+def _get_deployment_dir():
+    """Per deployment ansible state, keyed by the local VM UUID."""
+    if not _deployment['local_vm_uuid']:
+        return None
+    return os.path.join(
+        ohostedcons.FileLocations.LOCAL_VM_DIR_PATH,
+        '{p}{u}'.format(
+            p=ohostedcons.FileLocations.ANSIBLE_DEPLOYMENT_DIR_PREFIX,
+            u=_deployment['local_vm_uuid'],
+        ),
+    )
+
+
+def _get_fact_cache_dir():
+    deployment_dir = _get_deployment_dir()
+    if not _deployment['fact_cache'] or deployment_dir is None:
+        return None
+    return os.path.join(deployment_dir, 'facts')
+
+
+def _get_spill_dir():
+    """Where the otopi callback plugin writes big results, unfiltered."""
+    deployment_dir = _get_deployment_dir()
+    if deployment_dir is None:
+        return None
+    return os.path.join(deployment_dir, 'results')
+
+
+def _get_ssh_control_dir():
+    """Where the ssh master connections of the deployment listen."""
+    if (
+        not _deployment['ssh_multiplexing'] or
+        not _deployment['local_vm_uuid']
+    ):
+        return None
+    return os.path.join(
+        ohostedcons.FileLocations.LOCAL_VM_DIR_PATH,
+        '{p}{u}'.format(
+            p=ohostedcons.FileLocations.ANSIBLE_SSH_CONTROL_DIR_PREFIX,
+            u=_deployment['local_vm_uuid'][:_SSH_CONTROL_DIR_UUID_LENGTH],
+        ),
+    )
+
+
+def _get_ssh_env():
+    ssh_control_dir = _get_ssh_control_dir()
+    if ssh_control_dir is None:
+        return {}
+    env = {
+        'ANSIBLE_SSH_ARGS': (
+            '-C -o ControlMaster=auto -o ControlPersist={p}s '
+            '-o ServerAliveInterval=10 -o ServerAliveCountMax=3'
+        ).format(p=int(_deployment['ssh_control_persist'])),
+        'ANSIBLE_SSH_CONTROL_PATH_DIR': ssh_control_dir,
+        'ANSIBLE_PIPELINING': 'True',
+    }
+    # What the user explicitly configured wins
+    return dict(
+        (k, v) for k, v in env.items() if k not in os.environ
+    )
+
+
+def _get_ansible_env():
+    """Ansible configuration shared by all the playbook runs."""
+    env = {
+        'ANSIBLE_CALLBACKS_ENABLED': '{com},{log}'.format(
+            com=AnsibleCallback.CALLBACK_NAME,
+            log=AnsibleCallback.LOGGER_CALLBACK_NAME,
+        ),
+        'ANSIBLE_STDOUT_CALLBACK': AnsibleCallback.CALLBACK_NAME,
+    }
+    callback_defaults = {
+        # Errors and results are never delayed
+        AnsibleCallback.OTOPI_CALLBACK_FLUSH_INTERVAL: (
+            _CALLBACK_FLUSH_INTERVAL
+        ),
+        AnsibleCallback.LOG_SPILL_DIR: _LOG_SPILL_DIR,
+        AnsibleCallback.SPILL_SIZE: _RESULT_SPILL_SIZE,
+    }
+    spill_dir = _get_spill_dir()
+    if spill_dir is not None:
+        callback_defaults[AnsibleCallback.SPILL_DIR] = spill_dir
+    for k, v in callback_defaults.items():
+        # What the user explicitly configured wins
+        if k not in os.environ:
+            env[k] = str(v)
+    fact_cache_dir = _get_fact_cache_dir()
+    if fact_cache_dir is not None:
+        fact_cache_env = {
+            'ANSIBLE_GATHERING': 'smart',
+        }
+        if 'ANSIBLE_CACHE_PLUGIN' not in os.environ:
+            # A cache of the user comes with its own settings
+            fact_cache_env.update({
+                'ANSIBLE_CACHE_PLUGIN': 'jsonfile',
+                'ANSIBLE_CACHE_PLUGIN_CONNECTION': fact_cache_dir,
+                # Never expire, we invalidate it ourselves
+                'ANSIBLE_CACHE_PLUGIN_TIMEOUT': '0',
+            })
+        for k, v in fact_cache_env.items():
+            # What the user explicitly configured wins
+            if k not in os.environ:
+                env[k] = v
+    env.update(_get_ssh_env())
+    return env
+
+
+def _get_ansible_interpreter():
+    """Return the interpreter command line of ansible-playbook."""
+    with open(_ANSIBLE_PLAYBOOK, 'r') as f:
+        line = f.readline()
+    if line.startswith('#!'):
+        return line[2:].split()
+    return [sys.executable]
+
+
+class _OutputDrainer(threading.Thread):
+    """Log the lines of an output pipe of ansible-playbook as they arrive."""
+
+    def __init__(self, name, stream, log):
+        super(_OutputDrainer, self).__init__(
+            name='ansible-playbook-{n}'.format(n=name),
+            daemon=True,
+        )
+        self._stream_name = name
+        self._stream = stream
+        self._log = log
+        self.lines = 0
+        self.tail = collections.deque(maxlen=_OUTPUT_KEPT_LINES)
+
+    def run(self):
+        try:
+            for raw in iter(self._stream.readline, b''):
+                line = raw.decode('utf-8', 'replace').rstrip('\n')
+                if len(line) > _OUTPUT_MAX_LINE_LENGTH:
+                    line = line[:_OUTPUT_MAX_LINE_LENGTH] + '...'
+                self.lines += 1
+                self.tail.append(line)
+                self._log(
+                    'ansible-playbook {n}: {line}'.format(
+                        n=self._stream_name,
+                        line=line,
+                    )
+                )
+        finally:
+            self._stream.close()
+
+
+class _Transport(object):
+    """
+    The files shared with an ansible-playbook run, kept in memory.
+    Extra vars and timeline are in memfds, the callback messages go
+    through a pipe. ansible-playbook opens them as /proc/self/fd/N, the
+    descriptors keep their numbers in the child. Everything is closed on
+    exit, so nothing, secrets included, is left behind.
+    """
+
+    def __init__(self):
+        self._stack = contextlib.ExitStack()
+        self._fds = set()
+        self.pass_fds = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self._stack.close()
+        for fd in self._fds:
+            os.close(fd)
+        self._fds.clear()
+
+    @staticmethod
+    def path(fd):
+        return '/proc/self/fd/{fd}'.format(fd=fd)
+
+    def _keep(self, fd, child):
+        self._fds.add(fd)
+        if child:
+            self.pass_fds.append(fd)
+        return fd
+
+    def close(self, fd):
+        if fd in self._fds:
+            self._fds.remove(fd)
+            os.close(fd)
+
+    def memory_file(self, name, content=b''):
+        """A file in memory, readable and writable by the child."""
+        try:
+            fd = os.memfd_create(name, os.MFD_CLOEXEC)
+        except (AttributeError, OSError):
+            # Still never reaches the disk under its name, and is gone
+            # once closed
+            f = self._stack.enter_context(tempfile.TemporaryFile())
+            fd = os.dup(f.fileno())
+        self._keep(fd, child=True)
+        view = memoryview(content)
+        while view:
+            view = view[os.write(fd, view):]
+        return fd
+
+    def pipe(self):
+        """Return a non blocking read end, the write end is the child's."""
+        r, w = os.pipe()
+        os.set_blocking(r, False)
+        return self._keep(r, child=False), self._keep(w, child=True)
+
+    def close_child_ends(self, keep=()):
+        """Once the child started, so that its exit is seen as EOF."""
+        for fd in self.pass_fds:
+            if fd not in keep:
+                self.close(fd)
+
+
+class _ExecutorProcess(object):
+    """A playbook running in the ansible executor, like a subset of Popen."""
+
+    def __init__(self, sock, stdout, stderr):
+        self._sock = sock
+        self._reader = framing.FrameReader()
+        self._replies = collections.deque()
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = None
+        self.pid = self._read_reply()['pid']
+
+    def _read_reply(self, block=True):
+        while not self._replies:
+            self._sock.setblocking(block)
+            try:
+                data = self._sock.recv(4096)
+            except BlockingIOError:
+                return None
+            if not data:
+                raise RuntimeError(
+                    _('The ansible executor closed the connection')
+                )
+            self._replies.extend(self._reader.feed(data))
+        return framing.decode(self._replies.popleft())
+
+    def _set_returncode(self, reply):
+        if reply is not None:
+            self.returncode = reply['rc']
+            self._sock.close()
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def poll(self):
+        if self.returncode is None:
+            self._set_returncode(self._read_reply(block=False))
+        return self.returncode
+
+    def wait(self):
+        if self.returncode is None:
+            self._set_returncode(self._read_reply())
+        return self.returncode
+
+
+class AnsibleExecutor(base.Base):
+    """
+    Keep ansible loaded in a worker process, see he_ansible/executor.py.
+    Playbooks run there skip interpreter startup and ansible imports.
+    """
+
+    def __init__(self):
+        super(AnsibleExecutor, self).__init__()
+        self._dir = None
+        self._socket_path = None
+        self._proc = None
+        self._timings = []
+
+    def start(self):
+        self._dir = tempfile.mkdtemp(prefix='ovirt-he-ansible-executor-')
+        self._socket_path = os.path.join(self._dir, 'socket')
+        env = os.environ.copy()
+        env.update(_get_ansible_env())
+        cmd = _get_ansible_interpreter() + [
+            os.path.join(
+                ohostedcons.FileLocations.HOSTED_ENGINE_ANSIBLE_PATH,
+                ohostedcons.FileLocations.HE_AP_EXECUTOR,
+            ),
+            self._socket_path,
+        ]
+        self.logger.debug('ansible executor: cmd: %s' % cmd)
+        start = time.monotonic()
+        with open(os.path.join(self._dir, 'executor.log'), 'w') as log:
+            self._proc = subprocess.Popen(
+                cmd,
+                env=env,
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=log,
+                start_new_session=True,
+            )
+        while not os.path.exists(self._socket_path):
+            if (
+                self._proc.poll() is not None or
+                time.monotonic() - start > _EXECUTOR_START_TIMEOUT
+            ):
+                self.stop()
+                raise RuntimeError(_('Failed starting the ansible executor'))
+            time.sleep(_EXECUTOR_START_POLL)
+        self.logger.debug(
+            'ansible executor: ready in {t:.3f}s'.format(
+                t=time.monotonic() - start,
+            )
+        )
+
+    def spawn(self, cmd, env, pass_fds=()):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        out_r, out_w = os.pipe()
+        err_r, err_w = os.pipe()
+        try:
+            sock.connect(self._socket_path)
+            request = framing.encode({
+                'argv': cmd,
+                'env': env,
+                'cwd': os.getcwd(),
+                # Passed descriptors keep their numbers, as with Popen
+                'fds': [1, 2] + list(pass_fds),
+            })
+            sent = sock.sendmsg(
+                [request],
+                [(
+                    socket.SOL_SOCKET,
+                    socket.SCM_RIGHTS,
+                    array.array('i', [out_w, err_w] + list(pass_fds)),
+                )],
+            )
+            sock.sendall(request[sent:])
+            proc = _ExecutorProcess(
+                sock,
+                os.fdopen(out_r, 'rb'),
+                os.fdopen(err_r, 'rb'),
+            )
+        except Exception:
+            sock.close()
+            os.close(out_r)
+            os.close(err_r)
+            raise
+        finally:
+            os.close(out_w)
+            os.close(err_w)
+        return proc
+
+    def record(self, name, mode, startup, elapsed):
+        self._timings.append((name, mode, startup, elapsed))
+
+    def stop(self):
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(_EXECUTOR_STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                self._proc.kill()
+                self._proc.wait()
+        if self._timings:
+            self.logger.debug(
+                'ansible executor: startup/total time per playbook run:\n' +
+                '\n'.join(
+                    '{n:30} {m:4} {s:>9} {t:8.3f}s'.format(
+                        n=name,
+                        m=mode,
+                        s=(
+                            '{s:.3f}s'.format(s=startup)
+                            if startup is not None
+                            else '-'
+                        ),
+                        t=elapsed,
+                    )
+                    for name, mode, startup, elapsed in self._timings
+                )
+            )
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+        self._proc = None
+        self._dir = None
+
+
+_executor = None
+# Playbook runs since the ssh master connections were last closed
+_ssh_masters_runs = 0
+
+
+def start_executor():
+    """Run all the following playbooks in a persistent ansible executor."""
+    global _executor
+    if _executor is None:
+        executor = AnsibleExecutor()
+        executor.start()
+        _executor = executor
+
+
+def stop_executor():
+    global _executor
+    if _executor is not None:
+        _executor.stop()
+        _executor = None
+
+
+def _close_ssh_masters(logger):
+    global _ssh_masters_runs
+    _ssh_masters_runs = 0
+    ssh_control_dir = _get_ssh_control_dir()
+    if ssh_control_dir is None or not os.path.isdir(ssh_control_dir):
+        return
+    for name in os.listdir(ssh_control_dir):
+        path = os.path.join(ssh_control_dir, name)
+        try:
+            subprocess.run(
+                (
+                    _SSH,
+                    '-O', 'exit',
+                    '-o', 'ControlPath={p}'.format(p=path),
+                    'he-ssh-master',
+                ),
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                timeout=_SSH_CONTROL_EXIT_TIMEOUT,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            logger.debug(
+                'Cannot close ssh master {p}'.format(p=path),
+                exc_info=True,
+            )
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def cleanup_deployment(logger):
+    """
+    Drop all the ansible state of the deployment, including the unfiltered
+    results spilled by the callback plugin and the ssh master connections.
+    """
+    _close_ssh_masters(logger)
+    for directory in (_get_deployment_dir(), _get_ssh_control_dir()):
+        if directory is not None:
+            shutil.rmtree(directory, ignore_errors=True)
+
+
+class _CallbackResults(collections.abc.MutableMapping):
+    """
+    The results registered by the playbook. Those spilled to files by the
+    callback plugin are read only when first accessed.
+    """
+
+    def __init__(self, results):
+        self._results = dict(results)
+
+    def __getitem__(self, key):
+        value = self._results[key]
+        if spill.is_reference(value):
+            value = self._results[key] = spill.load(value)
+        return value
+
+    def __setitem__(self, key, value):
+        self._results[key] = value
+
+    def __delitem__(self, key):
+        del self._results[key]
+
+    def __iter__(self):
+        return iter(self._results)
+
+    def __len__(self):
+        return len(self._results)
+
+    def __repr__(self):
+        return repr(self._results)
+
+    def load(self):
+        """Read all the spilled results, before their files are removed."""
+        for key in self._results:
+            self[key]
+
 
 class AnsibleHelper(base.Base):
 
@@ -78,6 +715,7 @@ class AnsibleHelper(base.Base):
         raise_on_error=True,
         tags=None,
         skip_tags='always',
+        timeout=None,
     ):
         super(AnsibleHelper, self).__init__()
         self._playbook_name = playbook_name
@@ -93,38 +731,134 @@ class AnsibleHelper(base.Base):
         self._user_extra_vars = user_extra_vars
         self._cb_results = {}
         self._raise_on_error = raise_on_error
+        self._startup = None
         self._tags = tags
         self._skip_tags = skip_tags
+        self._timeout = timeout
+        self._name = None
+        self._log_path = None
+        self._task = None
+        self._task_start = None
+        self._heartbeat = None
+        self._timed_out = None
 
     def _process_output(self, d):
         try:
-            data = json.loads(d)
+            data = framing.decode(d)
             if (
                 AnsibleCallback.TYPE in data and
                 AnsibleCallback.BODY in data
             ):
                 t = data[AnsibleCallback.TYPE]
                 b = data[AnsibleCallback.BODY]
+                if t != AnsibleCallback.RESULT and spill.is_reference(b):
+                    # The spill file goes with the deployment dir, the
+                    # ansible log keeps the whole result, filtered
+                    b = _(
+                        '{d}, removed at the end of the deployment, '
+                        'see {log}'
+                    ).format(
+                        d=spill.describe(b),
+                        log=self._log_path,
+                    )
                 if t == AnsibleCallback.DEBUG:
                     self.logger.debug(b)
+                    self._track_task(b)
                 elif t == AnsibleCallback.WARNING:
                     self.logger.warning(b)
                 elif t == AnsibleCallback.ERROR:
                     self.logger.error(b)
                 elif t == AnsibleCallback.INFO:
                     self.logger.info(b)
+                    self._track_task(b)
                 elif t == AnsibleCallback.RESULT:
-                    self._cb_results = b
+                    self._cb_results = _CallbackResults(b)
                 else:
                     self.logger.error(_('Unknown data type: {t}').format(t=t))
         except Exception as e:
             self.logger.error(
                 _('Failed decoding json data: {e} - "{d}"').format(
                     e=str(e),
-                    d=d,
+                    d=d.decode('utf-8', 'replace'),
                 )
             )
 
+    def _track_task(self, body):
+        if not isinstance(body, str):
+            return
+        match = _TASK_START_RE.match(body)
+        if match:
+            self._task = match.group('task')
+            self._task_start = self._heartbeat = time.monotonic()
+
+    def _get_run_timeout(self):
+        if self._timeout is not None:
+            return self._timeout
+        return _deployment['timeouts'].get(
+            self._name,
+            _deployment['timeout'],
+        )
+
+    def _check_progress(self, proc, start, run_timeout):
+        """Report long tasks, kill the run once past its deadlines."""
+        now = time.monotonic()
+        task_elapsed = (
+            now - self._task_start if self._task_start is not None else 0
+        )
+        interval = _deployment['heartbeat_interval']
+        if (
+            interval and
+            self._task is not None and
+            now - self._heartbeat >= interval
+        ):
+            self._heartbeat = now
+            self.logger.info(
+                _(
+                    'Still running task "{task}" for {task_elapsed} '
+                    '({tag} running for {elapsed})'
+                ).format(
+                    task=self._task,
+                    task_elapsed=_format_duration(task_elapsed),
+                    tag=self._name,
+                    elapsed=_format_duration(now - start),
+                )
+            )
+        if self._timed_out is not None:
+            return
+        task_timeout = _deployment['task_timeout']
+        for scope, limit, elapsed in (
+            ('playbook', run_timeout, now - start),
+            ('task', task_timeout, task_elapsed),
+        ):
+            if limit and elapsed > limit:
+                self._timed_out = AnsibleTimeoutError(
+                    tag=self._name,
+                    task=self._task,
+                    elapsed=now - start,
+                    task_elapsed=task_elapsed,
+                    limit=limit,
+                    scope=scope,
+                )
+                self.logger.error(str(self._timed_out))
+                self._kill_process_group(proc)
+                return
+
+    def _kill_process_group(self, proc):
+        # ansible-playbook leads its own session, its workers, ssh and
+        # modules are all in its process group.
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            try:
+                os.killpg(proc.pid, sig)
+            except ProcessLookupError:
+                return
+            if sig == signal.SIGTERM:
+                deadline = time.monotonic() + _KILL_GRACE
+                while (
+                    proc.poll() is None and
+                    time.monotonic() < deadline
+                ):
+                    time.sleep(_CALLBACK_POLL_INTERVAL)
+
     def _format_tags_option(self, tags, tag_option):
         if tags and tag_option:
             if isinstance(tags, list) or isinstance(tags, tuple):
@@ -133,14 +867,137 @@ class AnsibleHelper(base.Base):
 
         return ''
 
+    def _read_callback_channel(self, fd, proc, start):
+        reader = framing.FrameReader()
+        messages = 0
+        received = 0
+        self._startup = None
+        # Also wake up as soon as the process exits, when we can
+        if isinstance(proc, _ExecutorProcess):
+            exit_fd = proc.fileno()
+            pidfd = None
+        else:
+            try:
+                pidfd = exit_fd = os.pidfd_open(proc.pid)
+            except (AttributeError, OSError):
+                pidfd = exit_fd = None
+        channel_open = True
+        run_timeout = self._get_run_timeout()
+        try:
+            while True:
+                self._check_progress(proc, start, run_timeout)
+                exited = proc.poll() is not None
+                if exited and not channel_open:
+                    break
+                readable, w, x = select.select(
+                    ([fd] if channel_open else []) + (
+                        [exit_fd]
+                        if exit_fd is not None and not exited
+                        else []
+                    ),
+                    [],
+                    [],
+                    0 if exited else _CALLBACK_POLL_INTERVAL,
+                )
+                if fd in readable:
+                    try:
+                        data = os.read(fd, _CALLBACK_READ_SIZE)
+                    except BlockingIOError:
+                        data = None
+                    if data == b'':
+                        # Every writer is gone
+                        channel_open = False
+                    elif data:
+                        if self._startup is None:
+                            self._startup = time.monotonic() - start
+                        received += len(data)
+                        for frame in reader.feed(data):
+                            messages += 1
+                            self._process_output(frame)
+                        continue
+                if exited:
+                    break
+        finally:
+            if pidfd is not None:
+                os.close(pidfd)
+        frame = reader.pending()
+        if frame:
+            messages += 1
+            self._process_output(frame)
+        elapsed = time.monotonic() - start
+        self.logger.debug(
+            (
+                'ansible-playbook: processed {m} callback messages '
+                '({b} bytes) in {t:.3f}s ({r:.1f} msg/s)'
+            ).format(
+                m=messages,
+                b=received,
+                t=elapsed,
+                r=messages / elapsed if elapsed > 0 else 0,
+            )
+        )
+
+    def _invalidate_fact_cache(self):
+        fact_cache_dir = _get_fact_cache_dir()
+        if fact_cache_dir is not None and os.path.exists(fact_cache_dir):
+            self.logger.debug(
+                'ansible-playbook: removing fact cache {d}'.format(
+                    d=fact_cache_dir,
+                )
+            )
+            shutil.rmtree(fact_cache_dir, ignore_errors=True)
+
+    def _release_ssh_masters(self, dname):
+        # Following runs reuse the master connections, up to the configured
+        # number of runs, unless this one created or replaced the engine VM
+        global _ssh_masters_runs
+        _ssh_masters_runs += 1
+        limit = _deployment['ssh_persistent_runs']
+        if (
+            dname in _SSH_MASTERS_CLOSING_TAGS or
+            (limit and _ssh_masters_runs >= limit)
+        ):
+            _close_ssh_masters(self.logger)
+
+    def _spawn(self, cmd, env, pass_fds):
+        if _executor is not None:
+            try:
+                return _executor.spawn(cmd, env, pass_fds), 'warm'
+            except (OSError, RuntimeError, ValueError) as e:
+                self.logger.debug(
+                    'ansible executor failed, running directly',
+                    exc_info=True,
+                )
+                self.logger.warning(
+                    _('Cannot use the ansible executor: {e}').format(e=e)
+                )
+                stop_executor()
+        return subprocess.Popen(
+            cmd,
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            pass_fds=pass_fds,
+            # So that all of it can be killed at once
+            start_new_session=True,
+        ), 'cold'
+
     def run(self):
-        out_fd, out_path = tempfile.mkstemp()
-        vars_fd, vars_path = tempfile.mkstemp()
+        with _Transport() as transport:
+            return self._run(transport)
+
+    def _run(self, transport):
+        vars_fd = transport.memory_file(
+            'ovirt-he-ansible-vars',
+            json.dumps(self._extra_vars).encode('utf-8'),
+        )
+        timeline_fd = transport.memory_file('ovirt-he-ansible-timeline')
+        out_fd, out_w = transport.pipe()
         ansible_playbook_cmd = [
-            '/bin/ansible-playbook',
+            _ANSIBLE_PLAYBOOK,
             '--module-path={mp}'.format(mp=self._module_path),
             '--inventory={i}'.format(i=self._inventory_source),
-            '--extra-vars=@{vf}'.format(vf=vars_path),
+            '--extra-vars=@{vf}'.format(vf=transport.path(vars_fd)),
         ]
         if self._user_extra_vars:
             ansible_playbook_cmd.append(
@@ -157,16 +1014,9 @@ class AnsibleHelper(base.Base):
         ansible_playbook_cmd.append(self._playbook_path)
 
         env = os.environ.copy()
-        env[AnsibleCallback.OTOPI_CALLBACK_OF] = out_path
-        env[
-            'ANSIBLE_CALLBACKS_ENABLED'
-        ] = '{com},{log}'.format(
-            com=AnsibleCallback.CALLBACK_NAME,
-            log=AnsibleCallback.LOGGER_CALLBACK_NAME,
-        )
-        env[
-            'ANSIBLE_STDOUT_CALLBACK'
-        ] = AnsibleCallback.CALLBACK_NAME
+        env.update(_get_ansible_env())
+        env[AnsibleCallback.OTOPI_CALLBACK_OF] = transport.path(out_w)
+        env['HE_ANSIBLE_TIMELINE_PATH'] = transport.path(timeline_fd)
 
         dname = os.path.splitext(self._playbook_name)[0]
         if self._tags:
@@ -175,71 +1025,126 @@ class AnsibleHelper(base.Base):
             else:
                 tag_name = self._tags
             dname = tag_name
+        self._name = dname
 
+        log_format = _deployment['log_format']
+        log_compression = jsonlog.available_compression(
+            _deployment['log_compression']
+        )
+        env[AnsibleCallback.LOG_FORMAT] = log_format
+        env[AnsibleCallback.LOG_COMPRESSION] = log_compression
         env[
             'HE_ANSIBLE_LOG_PATH'
-        ] = os.path.join(
-            ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP_LOGDIR,
-            "%s-ansible-%s-%s-%s.log" % (
-                ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP,
-                dname,
-                time.strftime("%Y%m%d%H%M%S"),
-                ''.join(
-                    [
-                        random.choice(
-                            string.ascii_lowercase +
-                            string.digits
-                        ) for i in range(6)
-                    ]
+        ] = jsonlog.file_name(
+            os.path.join(
+                ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP_LOGDIR,
+                "%s-ansible-%s-%s-%s" % (
+                    ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP,
+                    dname,
+                    time.strftime("%Y%m%d%H%M%S"),
+                    ''.join(
+                        [
+                            random.choice(
+                                string.ascii_lowercase +
+                                string.digits
+                            ) for i in range(6)
+                        ]
+                    )
                 )
-            )
+            ),
+            log_format,
+            log_compression,
         )
 
+        self._log_path = env['HE_ANSIBLE_LOG_PATH']
+
         self.logger.debug('ansible-playbook: cmd: %s' % ansible_playbook_cmd)
-        self.logger.debug('ansible-playbook: out_path: %s' % out_path)
-        self.logger.debug('ansible-playbook: vars_path: %s' % vars_path)
+        self.logger.debug(
+            'ansible-playbook: pass_fds: %s' % transport.pass_fds
+        )
         self.logger.debug('ansible-playbook: env: %s' % env)
 
+        if dname in _FACT_CACHE_INVALIDATING_TAGS:
+            self._invalidate_fact_cache()
+        deployment_dir = _get_deployment_dir()
+        for directory in (deployment_dir, _get_ssh_control_dir()):
+            if directory is not None:
+                os.makedirs(directory, mode=0o700, exist_ok=True)
+
         rc = None
-        with open(vars_path, 'w') as vars_fh:
-            json.dump(self._extra_vars, vars_fh)
-        with open(out_path, 'r') as out_fh:
-            buffer = ''
-            proc = subprocess.Popen(
+        mode = None
+        wall_start = timeline.now()
+        try:
+            start = time.monotonic()
+            proc, mode = self._spawn(
                 ansible_playbook_cmd,
-                env=env,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
+                env,
+                transport.pass_fds,
             )
-            while True:
-                output = out_fh.readline()
-                time.sleep(0.1)
-                if output == '' and proc.poll() is not None:
-                    break
-                if output:
-                    buffer += output
-                    if buffer[-1] == '\n':
-                        self._process_output(buffer)
-                        buffer = ''
-            rc = proc.poll()
+            # The timeline is read back once the run is over
+            transport.close_child_ends(keep=(timeline_fd,))
+            drainers = (
+                _OutputDrainer('stdout', proc.stdout, self.logger.debug),
+                _OutputDrainer('stderr', proc.stderr, self.logger.error),
+            )
+            for drainer in drainers:
+                drainer.start()
+            try:
+                self._read_callback_channel(out_fd, proc, start)
+                rc = proc.wait()
+            except BaseException:
+                # Interrupted, do not leave it running detached from us
+                self._kill_process_group(proc)
+                raise
+            elapsed = time.monotonic() - start
+            self.logger.debug(
+                (
+                    'ansible-playbook: {n} ran in {t:.3f}s, '
+                    'startup {s}, {m}'
+                ).format(
+                    n=dname,
+                    t=elapsed,
+                    s=(
+                        '{s:.3f}s'.format(s=self._startup)
+                        if self._startup is not None
+                        else 'unknown'
+                    ),
+                    m=mode,
+                )
+            )
+            if _executor is not None:
+                _executor.record(dname, mode, self._startup, elapsed)
+            for drainer in drainers:
+                # Do not hang if a leftover child keeps the pipe open
+                drainer.join(_OUTPUT_JOIN_TIMEOUT)
             self._cb_results['ansible-playbook_rc'] = rc
             self.logger.debug('ansible-playbook rc: {rc}'.format(rc=rc))
-            while True:
-                output = out_fh.readline()
-                if output == '':
-                    break
-                if output:
-                    self._process_output(output)
-            self.logger.debug('ansible-playbook stdout:')
-            for ln in proc.stdout:
-                self.logger.debug(ln)
-            self.logger.debug('ansible-playbook stderr:')
-            for ln in proc.stderr:
-                self.logger.error(ln)
-            if rc != 0 and self._raise_on_error:
-                raise RuntimeError(_('Failed executing ansible-playbook'))
-        os.unlink(out_path)
-        os.unlink(vars_path)
+        finally:
+            self._release_ssh_masters(dname)
+            if dname in _FACT_CACHE_INVALIDATING_TAGS:
+                self._invalidate_fact_cache()
+            timeline.load(transport.path(timeline_fd))
+            timeline.add(
+                dname,
+                timeline.CATEGORY_TAG,
+                wall_start,
+                timeline.now(),
+                playbook=self._playbook_name,
+                rc=rc,
+                mode=mode,
+                startup=self._startup,
+            )
+            if dname == ohostedcons.Const.HE_TAG_FINAL_CLEAN:
+                # The deployment is over, drop all of its ansible state
+                try:
+                    if isinstance(self._cb_results, _CallbackResults):
+                        self._cb_results.load()
+                finally:
+                    cleanup_deployment(self.logger)
+        if self._timed_out is not None:
+            raise self._timed_out
+        if rc != 0 and self._raise_on_error:
+            raise RuntimeError(_('Failed executing ansible-playbook'))
         return self._cb_results
 
 
@@ -0,0 +1,227 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Speculative appliance preparation.
+
+The appliance OVA is a gzipped tar, extracted by bootstrap_local_vm only at
+closeup. Decompressing it is most of the cost of that extraction, so it can
+be done in background while the user answers the customization questions.
+bootstrap_local_vm then gets the uncompressed tar, which ansible unarchive
+extracts as it is, but only if the OVA did not change in the meantime.
+"""
+
+
+import gettext
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import zlib
+
+from otopi import base
+
+
+_READ_SIZE = 1024 * 1024
+# Bound the output of every step, zeroes compress very well
+_WRITE_SIZE = 16 * 1024 * 1024
+_GZIP_WBITS = zlib.MAX_WBITS | 16
+# The uncompressed appliance is usually 2-3 times the OVA
+_SPACE_FACTOR = 4
+# Extracting the prepared appliance needs about its size, and some room
+_EXTRACT_SPACE_FACTOR = 1.1
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def _(m):
+    return gettext.dgettext(message=m, domain='ovirt-hosted-engine-setup')
+
+
+def _free_space(path):
+    vfs = os.statvfs(path)
+    return vfs.f_bavail * vfs.f_frsize
+
+
+def _fingerprint(path):
+    st = os.stat(path)
+    return (
+        os.path.realpath(path),
+        st.st_dev,
+        st.st_ino,
+        st.st_size,
+        st.st_mtime_ns,
+    )
+
+
+class AppliancePreparer(base.Base):
+    """Decompress an appliance OVA in a background thread."""
+
+    def __init__(self, ova_path, staging_parent):
+        super(AppliancePreparer, self).__init__()
+        self.ova_path = ova_path
+        self._staging_parent = staging_parent
+        self._staging_dir = None
+        self._fingerprint = None
+        self._prepared = None
+        self._error = None
+        self._cancel = threading.Event()
+        self._thread = None
+        self.sha256 = None
+
+    def start(self):
+        """Start preparing, return False if it is not worth trying."""
+        with open(self.ova_path, 'rb') as f:
+            if f.read(len(_GZIP_MAGIC)) != _GZIP_MAGIC:
+                self.logger.debug(
+                    '{p} is not compressed, nothing to prepare'.format(
+                        p=self.ova_path,
+                    )
+                )
+                return False
+        self._fingerprint = _fingerprint(self.ova_path)
+        if (
+            _free_space(self._staging_parent) <
+            self._fingerprint[3] * _SPACE_FACTOR
+        ):
+            self.logger.debug(
+                'Not enough space in {d} to prepare the appliance'.format(
+                    d=self._staging_parent,
+                )
+            )
+            return False
+        self._staging_dir = tempfile.mkdtemp(
+            prefix='ovirt-hosted-engine-setup-appliance-',
+            dir=self._staging_parent,
+        )
+        self._thread = threading.Thread(
+            target=self._run,
+            name='appliance-prep',
+            daemon=True,
+        )
+        self._thread.start()
+        return True
+
+    def _decompress(self, src, dst, h):
+        decompressor = zlib.decompressobj(_GZIP_WBITS)
+        while not self._cancel.is_set():
+            data = (
+                decompressor.unused_data if decompressor.eof
+                else decompressor.unconsumed_tail
+            )
+            if not data:
+                data = src.read(_READ_SIZE)
+                if not data:
+                    break
+                h.update(data)
+            if decompressor.eof:
+                # Concatenated gzip members
+                decompressor = zlib.decompressobj(_GZIP_WBITS)
+            dst.write(decompressor.decompress(data, _WRITE_SIZE))
+        if not decompressor.eof:
+            raise RuntimeError(_('Truncated appliance archive'))
+
+    def _run(self):
+        target = os.path.join(self._staging_dir, 'appliance.tar')
+        start = time.monotonic()
+        h = hashlib.sha256()
+        try:
+            fd = os.open(target, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with open(self.ova_path, 'rb') as src:
+                with os.fdopen(fd, 'wb') as dst:
+                    self._decompress(src, dst, h)
+            if self._cancel.is_set():
+                return
+            self.sha256 = h.hexdigest()
+            self._prepared = target
+            self.logger.debug(
+                (
+                    'Appliance {p} (sha256 {h}) prepared in {d} in {t:.1f}s'
+                ).format(
+                    p=self.ova_path,
+                    h=self.sha256,
+                    d=target,
+                    t=time.monotonic() - start,
+                )
+            )
+        except Exception as e:
+            self._error = e
+
+    def wait(self):
+        """
+        Wait for the preparation, return the path of the prepared appliance,
+        or None if it failed, if the OVA changed since it started, or if
+        there is no more room to extract it next to it. In the latter case
+        the prepared appliance is removed, to leave the room to extract the
+        OVA instead.
+        """
+        if self._thread is None:
+            return None
+        if self._thread.is_alive():
+            self.logger.info(_('Waiting for the appliance preparation'))
+        self._thread.join()
+        if self._error is not None:
+            self.logger.debug(
+                'Appliance preparation failed: {e}'.format(e=self._error)
+            )
+            return None
+        try:
+            changed = _fingerprint(self.ova_path) != self._fingerprint
+        except OSError:
+            changed = True
+        if changed:
+            self.logger.debug(
+                '{p} changed, not using the prepared appliance'.format(
+                    p=self.ova_path,
+                )
+            )
+            return None
+        # The space checked at start was not reserved, something else in
+        # the staging dir may have taken it since.
+        needed = os.path.getsize(self._prepared) * _EXTRACT_SPACE_FACTOR
+        free = _free_space(self._staging_parent)
+        if free < needed:
+            self.logger.debug(
+                (
+                    'Not enough space in {d} to extract the prepared '
+                    'appliance, {f} bytes free, {n} needed'
+                ).format(
+                    d=self._staging_parent,
+                    f=free,
+                    n=int(needed),
+                )
+            )
+            self.cleanup()
+            return None
+        return self._prepared
+
+    def cleanup(self):
+        """Stop preparing and remove anything prepared."""
+        self._cancel.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._staging_dir is not None:
+            shutil.rmtree(self._staging_dir, ignore_errors=True)
+            self._staging_dir = None
+        self._prepared = None
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -149,6 +149,12 @@ class FileLocations(object):
         'log',
         OVIRT_HOSTED_ENGINE_SETUP,
     )
+    # Big failed ansible results, filtered as the ansible log, see
+    # he_ansible/spill.py
+    OVIRT_HOSTED_ENGINE_SPILL_DIR = os.path.join(
+        OVIRT_HOSTED_ENGINE_SETUP_LOGDIR,
+        'ansible-results',
+    )
 
     OVIRT_HOSTED_ENGINE_SETUP_CONFIG_FILE = os.path.join(
         config.SYSCONFDIR,
@@ -317,6 +323,8 @@ class FileLocations(object):
 
     LOCAL_VM_DIR_PATH = '/var/tmp'
     LOCAL_VM_DIR_PREFIX = 'localvm'
+    ANSIBLE_DEPLOYMENT_DIR_PREFIX = 'ovirt-hosted-engine-setup-ansible-'
+    ANSIBLE_SSH_CONTROL_DIR_PREFIX = 'ovirt-he-ssh-'
 
     HOSTED_ENGINE_ANSIBLE_PATH = os.path.join(
         config.DATADIR,
@@ -325,6 +333,7 @@ class FileLocations(object):
     )
 
     HE_AP_TRIGGER_ROLE = 'trigger_role.yml'
+    HE_AP_EXECUTOR = 'executor.py'
 
 
 @util.export
@@ -435,6 +444,21 @@ class CoreEnv(object):
     NODE_SETUP = 'OVEHOSTED_CORE/nodeSetup'
     MISC_REACHED = 'OVEHOSTED_CORE/miscReached'
     ANSIBLE_USER_EXTRA_VARS = 'OVEHOSTED_CORE/ansibleUserExtraVars'
+    ANSIBLE_PERSISTENT_EXECUTOR = 'OVEHOSTED_CORE/ansiblePersistentExecutor'
+    ANSIBLE_FACT_CACHE = 'OVEHOSTED_CORE/ansibleFactCache'
+    ANSIBLE_SSH_MULTIPLEXING = 'OVEHOSTED_CORE/ansibleSshMultiplexing'
+    ANSIBLE_SSH_CONTROL_PERSIST = 'OVEHOSTED_CORE/ansibleSshControlPersist'
+    ANSIBLE_SSH_PERSISTENT_RUNS = 'OVEHOSTED_CORE/ansibleSshPersistentRuns'
+    ANSIBLE_TIMEOUTS = 'OVEHOSTED_CORE/ansibleTimeouts'
+    ANSIBLE_TIMEOUT = 'OVEHOSTED_CORE/ansibleTimeout'
+    ANSIBLE_TASK_TIMEOUT = 'OVEHOSTED_CORE/ansibleTaskTimeout'
+    ANSIBLE_HEARTBEAT_INTERVAL = 'OVEHOSTED_CORE/ansibleHeartbeatInterval'
+    ANSIBLE_LOG_FORMAT = 'OVEHOSTED_CORE/ansibleLogFormat'
+    ANSIBLE_LOG_COMPRESSION = 'OVEHOSTED_CORE/ansibleLogCompression'
+    LOG_RETENTION_DAYS = 'OVEHOSTED_CORE/logRetentionDays'
+    LOG_RETENTION_SIZE_MB = 'OVEHOSTED_CORE/logRetentionSizeMB'
+    LOG_RETENTION_UNCOMPRESSED = 'OVEHOSTED_CORE/logRetentionUncompressed'
+    TIMELINE_FILE = 'OVEHOSTED_CORE/timelineFile'
 
     @ohostedattrs(
         answerfile=True,
@@ -842,6 +866,8 @@ class VMEnv(object):
 
     APPLIANCEMEM = 'OVEHOSTED_VM/applianceMem'
 
+    APPLIANCE_SPECULATIVE_PREP = 'OVEHOSTED_VM/applianceSpeculativePrep'
+
     @ohostedattrs(
         answerfile=True,
         summary=True,
@@ -1140,6 +1166,7 @@ class Stages(object):
     EXISTING_CONF_VOLUME_DETECTED = 'ohosted.conf.existing_volume.detected'
     BROKER_CONF_AVAILABLE = 'ohosted.notifications.broker.conf.available'
     ANSWER_FILE_AVAILABLE = 'ohosted.notifications.answerfile.available'
+    ANSWER_FILE_ARCHIVED = 'ohosted.core.answerfile.archived'
     CONF_IMAGE_AVAILABLE = 'ohosted.notifications.confimage.available'
     UPGRADED_APPLIANCE_RUNNING = 'ohosted.vm.state.upgraded.appliance.running'
     CHECK_MAINTENANCE_MODE = 'ohosted.core.check.maintenance.mode'
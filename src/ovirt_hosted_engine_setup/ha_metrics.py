@@ -0,0 +1,268 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""OpenMetrics exposition of the HA state, see vm_status."""
+
+
+# All the metrics are gauges, so that the output is also valid in the
+# Prometheus text format read by the node_exporter textfile collector.
+
+
+import os
+import tempfile
+import threading
+import time
+
+from http import server
+
+
+CONTENT_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+_PREFIX = 'ovirt_hosted_engine_'
+
+# name, help, value of a HostStatus, None to skip
+_HOST_METRICS = (
+    (
+        'host_score',
+        'Score of the host.',
+        lambda h: h.score,
+    ),
+    (
+        'host_alive',
+        'Whether the host is alive.',
+        lambda h: h.alive,
+    ),
+    (
+        'host_live_data',
+        'Whether the status of the host is up to date.',
+        lambda h: h.live_data,
+    ),
+    (
+        'host_local_maintenance',
+        'Whether the host is in local maintenance.',
+        lambda h: h.maintenance,
+    ),
+    (
+        'host_engine_vm_up',
+        'Whether the engine VM is up on the host.',
+        lambda h: h.engine_vm_up,
+    ),
+    (
+        'host_engine_health_good',
+        'Whether the engine on the host is healthy.',
+        lambda h: h.engine_health_good,
+    ),
+    (
+        'host_timestamp_seconds',
+        'Timestamp of the metadata of the host, by the clock of the host.',
+        lambda h: h.host_ts,
+    ),
+)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace(
+        '"', '\\"'
+    )
+
+
+def _labels(**labels):
+    return '{{{l}}}'.format(
+        l=','.join(
+            '{k}="{v}"'.format(k=k, v=_escape(v))
+            for k, v in sorted(labels.items())
+        )
+    )
+
+
+def _value(value):
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    if isinstance(value, float):
+        return repr(value)
+    return str(int(value))
+
+
+class MetadataAges(object):
+    """
+    Seconds since the metadata of every host last changed, as seen by a
+    long running process. The timestamps of the hosts are by their own
+    clocks, so only their changes tell anything here.
+    """
+
+    def __init__(self):
+        self._seen = {}
+
+    def update(self, hosts, now=None):
+        """{host id: age} of {host id: HostStatus}."""
+        if now is None:
+            now = time.monotonic()
+        ages = {}
+        for host_id, host in hosts.items():
+            host_ts = host.host_ts
+            seen = self._seen.get(host_id)
+            if seen is None or seen[0] != host_ts:
+                # Until a first change, the age is a lower bound
+                seen = (host_ts, now)
+                self._seen[host_id] = seen
+            ages[host_id] = now - seen[1]
+        for host_id in set(self._seen) - set(hosts):
+            del self._seen[host_id]
+        return ages
+
+
+def format_metrics(hosts, global_maintenance=False, ages=None):
+    """
+    Return the metrics in the OpenMetrics text format.
+    hosts is {host id: HostStatus}, None if the stats could not be read.
+    ages is the result of MetadataAges.update, if any.
+    """
+    lines = []
+
+    def metric(name, help_text, samples):
+        lines.append(
+            '# HELP {p}{n} {h}'.format(p=_PREFIX, n=name, h=help_text)
+        )
+        lines.append('# TYPE {p}{n} gauge'.format(p=_PREFIX, n=name))
+        for labels, value in samples:
+            lines.append(
+                '{p}{n}{l} {v}'.format(
+                    p=_PREFIX,
+                    n=name,
+                    l=_labels(**labels) if labels else '',
+                    v=_value(value),
+                )
+            )
+
+    def labels(host):
+        return {'host_id': host.host_id, 'hostname': host.hostname or ''}
+
+    metric(
+        'broker_up',
+        'Whether the stats could be read from the HA broker.',
+        [({}, hosts is not None)],
+    )
+    if hosts is not None:
+        metric(
+            'global_maintenance',
+            'Whether the cluster is in global maintenance.',
+            [({}, bool(global_maintenance))],
+        )
+        metric(
+            'hosts',
+            'Number of hosts in the metadata.',
+            [({}, len(hosts))],
+        )
+        for name, help_text, get in _HOST_METRICS:
+            samples = []
+            for host in hosts.values():
+                value = get(host)
+                if value is not None:
+                    samples.append((labels(host), value))
+            metric(name, help_text, samples)
+        if ages is not None:
+            metric(
+                'host_metadata_age_seconds',
+                'Seconds since the metadata of the host last changed.',
+                [
+                    (labels(host), float(round(ages[host.host_id], 3)))
+                    for host in hosts.values()
+                    if host.host_id in ages
+                ],
+            )
+        running = [host for host in hosts.values() if host.engine_vm_running]
+        metric(
+            'engine_vm_up',
+            'Whether the engine VM is up on a host with up to date status.',
+            [({}, bool(running))],
+        )
+        metric(
+            'engine_vm_host_info',
+            'The host the engine VM is up on.',
+            [(labels(host), 1) for host in running],
+        )
+    lines.append('# EOF')
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, text):
+    """Replace path with text at once, for the node_exporter collector."""
+    fd, tmp = tempfile.mkstemp(
+        dir=os.path.dirname(os.path.abspath(path)),
+        prefix='.ha-metrics-',
+    )
+    try:
+        with os.fdopen(fd, 'w') as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)
+        os.rename(tmp, path)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+class _Handler(server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.metrics.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MetricsServer(object):
+    """
+    Serve the last metrics set over HTTP, from a thread, so that scrapes
+    never wait for the broker.
+    """
+
+    def __init__(self, address, port):
+        self._server = server.HTTPServer((address, port), _Handler)
+        self._server.metrics = format_metrics(None)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever,
+            name='ha-metrics',
+        )
+        self._thread.daemon = True
+
+    @property
+    def port(self):
+        return self._server.server_address[1]
+
+    def start(self):
+        self._thread.start()
+
+    def set_metrics(self, text):
+        self._server.metrics = text
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
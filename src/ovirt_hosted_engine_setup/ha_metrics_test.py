@@ -0,0 +1,126 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import json
+
+from urllib import request
+
+from . import ha_metrics
+from . import host_status
+
+
+def _hosts():
+    return host_status.decode({
+        1: {
+            'hostname': 'host1',
+            'host-id': 1,
+            'host-ts': 1000,
+            'alive': True,
+            'live-data': True,
+            'maintenance': False,
+            'score': 3400,
+            'engine-status': json.dumps({'vm': 'up', 'health': 'good'}),
+        },
+        2: {
+            'hostname': 'host"2',
+            'host-id': 2,
+            'host-ts': 2000,
+            'alive': True,
+            'live-data': False,
+            'maintenance': True,
+            'score': 0,
+            'engine-status': 'not json',
+        },
+    })
+
+
+def _samples(text):
+    return dict(
+        line.rsplit(' ', 1) for line in text.splitlines()
+        if not line.startswith('#')
+    )
+
+
+def testFormat():
+    text = ha_metrics.format_metrics(_hosts(), True, {1: 1.5, 2: 30})
+    assert text.endswith('\n# EOF\n')
+    samples = _samples(text)
+    host1 = '{host_id="1",hostname="host1"}'
+    host2 = '{host_id="2",hostname="host\\"2"}'
+    assert samples['ovirt_hosted_engine_broker_up'] == '1'
+    assert samples['ovirt_hosted_engine_global_maintenance'] == '1'
+    assert samples['ovirt_hosted_engine_hosts'] == '2'
+    assert samples['ovirt_hosted_engine_host_score' + host1] == '3400'
+    assert samples['ovirt_hosted_engine_host_live_data' + host2] == '0'
+    assert samples[
+        'ovirt_hosted_engine_host_local_maintenance' + host2
+    ] == '1'
+    assert samples['ovirt_hosted_engine_host_engine_vm_up' + host1] == '1'
+    assert samples['ovirt_hosted_engine_host_engine_vm_up' + host2] == '0'
+    assert samples[
+        'ovirt_hosted_engine_host_metadata_age_seconds' + host2
+    ] == '30.0'
+    assert samples['ovirt_hosted_engine_engine_vm_up'] == '1'
+    assert samples['ovirt_hosted_engine_engine_vm_host_info' + host1] == '1'
+    for line in text.splitlines():
+        if line.startswith('# TYPE'):
+            assert line.endswith(' gauge')
+
+
+def testBrokerDown():
+    assert ha_metrics.format_metrics(None) == (
+        '# HELP ovirt_hosted_engine_broker_up '
+        'Whether the stats could be read from the HA broker.\n'
+        '# TYPE ovirt_hosted_engine_broker_up gauge\n'
+        'ovirt_hosted_engine_broker_up 0\n'
+        '# EOF\n'
+    )
+
+
+def testMetadataAges():
+    ages = ha_metrics.MetadataAges()
+    hosts = _hosts()
+    assert ages.update(hosts, now=10) == {1: 0, 2: 0}
+    hosts[1].host_ts += 10
+    assert ages.update(hosts, now=25) == {1: 0, 2: 15}
+    del hosts[2]
+    assert ages.update(hosts, now=30) == {1: 5}
+
+
+def testServerAndTextfile(tmpdir):
+    text = ha_metrics.format_metrics(_hosts())
+    path = str(tmpdir.join('ha.prom'))
+    ha_metrics.write_textfile(path, text)
+    assert tmpdir.listdir() == [tmpdir.join('ha.prom')]
+    with open(path) as f:
+        assert f.read() == text
+    server = ha_metrics.MetricsServer('127.0.0.1', 0)
+    server.start()
+    try:
+        server.set_metrics(text)
+        response = request.urlopen(
+            'http://127.0.0.1:{p}/metrics'.format(p=server.port)
+        )
+        assert response.headers['Content-Type'] == ha_metrics.CONTENT_TYPE
+        assert response.read().decode('utf-8') == text
+    finally:
+        server.stop()
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,101 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Status of the hosts, decoded once from the stats of the HA broker."""
+
+
+import json
+
+
+class HostStatus(object):
+    """
+    Status of a host, from its stats as returned by the broker.
+    engine-status is decoded here, and only here: engine_status is the
+    decoded dict, None if it cannot be decoded.
+    """
+
+    __slots__ = (
+        'host_id',
+        'hostname',
+        'score',
+        'alive',
+        'live_data',
+        'maintenance',
+        'host_ts',
+        'engine_status',
+        'engine_vm_up',
+        'engine_health_good',
+        'stats',
+    )
+
+    def __init__(self, host_id, stats):
+        self.host_id = host_id
+        self.hostname = stats.get('hostname')
+        self.score = stats.get('score')
+        self.alive = stats.get('alive')
+        self.live_data = stats.get('live-data')
+        self.maintenance = stats.get('maintenance')
+        self.host_ts = stats.get('host-ts')
+        status = stats.get('engine-status')
+        if not isinstance(status, dict):
+            try:
+                status = json.loads(status)
+            except (TypeError, ValueError):
+                status = None
+        self.engine_status = status if isinstance(status, dict) else None
+        engine_status = self.engine_status or {}
+        self.engine_vm_up = engine_status.get('vm') == 'up'
+        self.engine_health_good = engine_status.get('health') == 'good'
+        # As returned by the broker, for what is not decoded above
+        self.stats = stats
+
+    @property
+    def engine_vm_running(self):
+        """Whether the engine VM is up here, by up to date stats."""
+        return bool(self.live_data) and self.engine_vm_up
+
+    def as_dict(self):
+        """The stats, with engine-status decoded if it can be."""
+        stats = dict(self.stats)
+        if self.engine_status is not None:
+            stats['engine-status'] = self.engine_status
+        return stats
+
+    def __repr__(self):
+        return '<HostStatus {i} {h}>'.format(i=self.host_id, h=self.hostname)
+
+
+def decode(all_host_stats):
+    """{host id: HostStatus} of the stats of all the hosts, by host id."""
+    return dict(
+        (host_id, HostStatus(host_id, stats))
+        for host_id, stats in sorted(all_host_stats.items())
+    )
+
+
+def engine_vm_host(hosts):
+    """The HostStatus of the host the engine VM is running on, or None."""
+    for host in hosts.values():
+        if host.engine_vm_running:
+            return host
+    return None
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,84 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import json
+
+import pytest
+
+from . import host_status
+
+
+def _stats(host_id, vm, live_data=True, **extra):
+    stats = {
+        'hostname': 'host{i}'.format(i=host_id),
+        'host-id': host_id,
+        'host-ts': 1000 + host_id,
+        'alive': True,
+        'live-data': live_data,
+        'maintenance': False,
+        'score': 3400,
+        'engine-status': json.dumps({
+            'vm': vm,
+            'health': 'good' if vm == 'up' else 'bad',
+            'detail': 'Up' if vm == 'up' else 'unknown',
+            'reason': '',
+        }),
+    }
+    stats.update(extra)
+    return stats
+
+
+def testDecode():
+    hosts = host_status.decode({
+        3: _stats(3, 'down'),
+        1: _stats(1, 'up'),
+        2: _stats(2, 'down', **{'engine-status': 'garbage'}),
+    })
+    assert list(hosts) == [1, 2, 3]
+    host = hosts[1]
+    assert host.hostname == 'host1'
+    assert host.score == 3400
+    assert host.live_data is True
+    assert host.host_ts == 1001
+    assert host.engine_status['detail'] == 'Up'
+    assert host.engine_vm_up and host.engine_health_good
+    assert host.as_dict()['engine-status']['vm'] == 'up'
+    # Left as is when it cannot be decoded
+    assert hosts[2].engine_status is None
+    assert not hosts[2].engine_vm_up
+    assert hosts[2].as_dict()['engine-status'] == 'garbage'
+    with pytest.raises(AttributeError):
+        host.other = 1
+
+
+def testEngineVmHost():
+    hosts = host_status.decode({
+        1: _stats(1, 'down'),
+        2: _stats(2, 'up'),
+    })
+    assert host_status.engine_vm_host(hosts) is hosts[2]
+    # Not running by stale stats
+    hosts = host_status.decode({
+        1: _stats(1, 'down'),
+        2: _stats(2, 'up', live_data=False),
+    })
+    assert host_status.engine_vm_host(hosts) is None
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,430 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Retention and index of the logs of the deployments.
+
+A run is a deployment attempt. It starts with its otopi log,
+<prefix>-<timestamp>-<random>.log, and owns every file of the log dir
+starting with <prefix>- and of the answers dir whose name has a later
+timestamp, up to the start of the next run: ansible logs and their
+summaries, the timeline, the archived answer file.
+
+The index, index.json in the log dir, maps every run id (the name of its
+otopi log, without suffix) to its files, and to the status, duration and
+failing task recorded at its end, so that finding a run does not need to
+walk and grep the logs.
+
+Archived answer files are passed back to --config-append to deploy again:
+they are never compressed, do not count in the size of the runs and are
+removed only once older than the age limit.
+"""
+
+
+import gzip
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+import time
+
+
+INDEX = 'index.json'
+INDEX_VERSION = 1
+
+STATUS_SUCCESS = 'success'
+STATUS_FAILED = 'failed'
+STATUS_UNKNOWN = 'unknown'
+
+# Defaults of the retention
+MAX_AGE_DAYS = 30
+MAX_SIZE_MB = 1024
+# The most recent runs are not compressed
+UNCOMPRESSED_RUNS = 3
+
+# Not compressed again
+_COMPRESSED_SUFFIXES = ('.gz', '.zst')
+_TIMESTAMP_FORMAT = '%Y%m%d%H%M%S'
+_TIMESTAMP_RE = re.compile(r'-(?P<ts>\d{14})(?:-|\.)')
+_ANSWERS_RE = re.compile(r'^answers-(?P<ts>\d{14})\.conf')
+
+
+def _strip_compression(name):
+    for suffix in _COMPRESSED_SUFFIXES:
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+def _timestamp(ts):
+    try:
+        return time.mktime(time.strptime(ts, _TIMESTAMP_FORMAT))
+    except ValueError:
+        return None
+
+
+def _answers_start(path):
+    """Timestamp of an archived answer file, None for any other file."""
+    match = _ANSWERS_RE.match(os.path.basename(path))
+    if match is None:
+        return None
+    return _timestamp(match.group('ts'))
+
+
+def _size(files):
+    """Size of the files of a run, but for the answer files."""
+    return sum(
+        os.path.getsize(path) for path in files
+        if _answers_start(path) is None and os.path.exists(path)
+    )
+
+
+def run_id(log):
+    """Id of the run of an otopi log."""
+    return os.path.splitext(_strip_compression(os.path.basename(log)))[0]
+
+
+def scan(logdir, answersdir, prefix):
+    """
+    Return {run id: {'start': time, 'files': [path...]}} for the runs found
+    in logdir, files of no run are ignored.
+    """
+    run_re = re.compile(
+        r'^{p}-(?P<ts>\d{{14}})-[a-z0-9]+\.log$'.format(p=re.escape(prefix))
+    )
+    starts = []
+    others = []
+    for directory, pattern in (
+        (logdir, _TIMESTAMP_RE),
+        (answersdir, _ANSWERS_RE),
+    ):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(directory, name)
+            plain = _strip_compression(name)
+            if directory == logdir:
+                if not name.startswith(prefix + '-'):
+                    continue
+                match = run_re.match(plain)
+                if match:
+                    ts = _timestamp(match.group('ts'))
+                    if ts is not None:
+                        starts.append((ts, path))
+                    continue
+                match = pattern.search(plain)
+            else:
+                match = pattern.match(plain)
+            if match and os.path.isfile(path):
+                ts = _timestamp(match.group('ts'))
+                if ts is not None:
+                    others.append((ts, path))
+    starts.sort()
+    runs = dict(
+        (run_id(path), {'start': start, 'files': [path]})
+        for start, path in starts
+    )
+    for ts, path in others:
+        owner = None
+        for start, log in starts:
+            if start > ts:
+                break
+            owner = log
+        if owner is not None:
+            runs[run_id(owner)]['files'].append(path)
+    for run in runs.values():
+        run['files'].sort()
+    return runs
+
+
+def load_index(logdir):
+    try:
+        with open(os.path.join(logdir, INDEX)) as f:
+            index = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if index.get('version') != INDEX_VERSION:
+        return {}
+    return index.get('runs', {})
+
+
+def save_index(logdir, runs):
+    fd, tmp = tempfile.mkstemp(dir=logdir, prefix='.index-')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(
+                {'version': INDEX_VERSION, 'runs': runs},
+                f,
+                indent=1,
+                sort_keys=True,
+            )
+        os.rename(tmp, os.path.join(logdir, INDEX))
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def update_index(logdir, answersdir, prefix, current=None):
+    """
+    Scan the dirs, keep what the index recorded about the runs still there,
+    and record current, a dict with at least 'log', the otopi log of the
+    running deployment, and its 'status', 'duration' (since the start of
+    the log if missing) and 'failed_task'.
+    Return the runs, without saving them.
+    """
+    recorded = load_index(logdir)
+    runs = scan(logdir, answersdir, prefix)
+    for rid, run in runs.items():
+        old = recorded.get(rid, {})
+        run['status'] = old.get('status', STATUS_UNKNOWN)
+        run['duration'] = old.get('duration')
+        run['failed_task'] = old.get('failed_task')
+        run['size'] = _size(run['files'])
+    if current is not None:
+        rid = run_id(current['log'])
+        if rid in runs:
+            run = runs[rid]
+            run['status'] = current.get('status', STATUS_UNKNOWN)
+            run['duration'] = current.get(
+                'duration',
+                round(time.time() - run['start']),
+            )
+            run['failed_task'] = current.get('failed_task')
+    return runs
+
+
+def failed_task(events):
+    """
+    The last failed task of the first ansible run that failed, from the
+    events of the deployment timeline.
+    """
+    for tag in events:
+        if tag.get('cat') != 'tag' or tag['args'].get('rc') in (0, None):
+            continue
+        failed = [
+            e for e in events
+            if e.get('cat') == 'task' and
+            e['args'].get('status') in ('FAILED', 'UNREACHABLE') and
+            tag['ts'] <= e['ts'] <= tag['ts'] + tag['dur']
+        ]
+        if failed:
+            return failed[-1]['name']
+    return None
+
+
+def _compress(path):
+    compressed = path + '.gz'
+    tmp = compressed + '.tmp'
+    with open(path, 'rb') as src, gzip.open(tmp, 'wb') as dst:
+        shutil.copyfileobj(src, dst)
+    shutil.copystat(path, tmp)
+    os.rename(tmp, compressed)
+    os.unlink(path)
+    return compressed
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except OSError:
+        pass
+
+
+def apply_retention(
+    runs,
+    current=None,
+    max_age_days=MAX_AGE_DAYS,
+    max_size_mb=MAX_SIZE_MB,
+    uncompressed_runs=UNCOMPRESSED_RUNS,
+    now=None,
+):
+    """
+    Compress the files of all but the last uncompressed_runs runs, then
+    remove the runs older than max_age_days, then the oldest runs while all
+    of them take more than max_size_mb. The current run and the last
+    successful one are never compressed or removed, answer files are never
+    compressed and are removed only once older than max_age_days.
+    Update runs in place, return the ids of the runs removed.
+    """
+    if now is None:
+        now = time.time()
+    ordered = sorted(runs, key=lambda rid: runs[rid]['start'])
+    protected = set()
+    if current is not None:
+        protected.add(current)
+    successful = [
+        rid for rid in ordered if runs[rid]['status'] == STATUS_SUCCESS
+    ]
+    if successful:
+        protected.add(successful[-1])
+
+    for rid in ordered[:max(len(ordered) - uncompressed_runs, 0)]:
+        if rid in protected:
+            continue
+        run = runs[rid]
+        files = []
+        for path in run['files']:
+            if (
+                os.path.exists(path) and
+                not path.endswith(_COMPRESSED_SUFFIXES) and
+                _answers_start(path) is None
+            ):
+                path = _compress(path)
+            files.append(path)
+        run['files'] = files
+        run['size'] = _size(files)
+
+    removed = []
+    total = sum(run['size'] for run in runs.values())
+    for rid in ordered:
+        if rid in protected:
+            continue
+        run = runs[rid]
+        if (
+            now - run['start'] <= max_age_days * 86400 and
+            total <= max_size_mb * 1024 * 1024
+        ):
+            continue
+        for path in run['files']:
+            answers_start = _answers_start(path)
+            if (
+                answers_start is None or
+                now - answers_start > max_age_days * 86400
+            ):
+                _remove(path)
+        total -= run['size']
+        removed.append(rid)
+        del runs[rid]
+    return removed
+
+
+def remove_old_files(directory, max_age_days=MAX_AGE_DAYS, now=None):
+    """Remove the files of directory older than max_age_days."""
+    if now is None:
+        now = time.time()
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return 0
+    removed = 0
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if (
+                os.path.isfile(path) and
+                now - os.path.getmtime(path) > max_age_days * 86400
+            ):
+                os.unlink(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
+
+
+def last_failed(runs):
+    """Id of the most recent failed run, or None."""
+    failed = [
+        rid for rid in runs if runs[rid]['status'] == STATUS_FAILED
+    ]
+    return max(failed, key=lambda rid: runs[rid]['start'], default=None)
+
+
+def format_run(rid, run):
+    return '{start}  {status:8}  {duration:>8}  {rid}{task}'.format(
+        start=time.strftime(
+            '%Y-%m-%d %H:%M:%S',
+            time.localtime(run['start']),
+        ),
+        status=run['status'],
+        duration=(
+            '{d:.0f}s'.format(d=run['duration'])
+            if run.get('duration') is not None else '-'
+        ),
+        rid=rid,
+        task=(
+            '\n    failed task: {t}'.format(t=run['failed_task'])
+            if run.get('failed_task') else ''
+        ),
+    )
+
+
+def main(argv=None):
+    import argparse
+
+    # Needs otopi, the functions above do not
+    from ovirt_hosted_engine_setup import constants as ohostedcons
+
+    parser = argparse.ArgumentParser(
+        prog='hosted-engine --logs',
+        description='Find the logs of the hosted-engine deployments',
+    )
+    parser.add_argument(
+        '--failed',
+        action='store_true',
+        help='show the files of the last failed deployment',
+    )
+    parser.add_argument(
+        '--json',
+        action='store_true',
+        help='output the index as JSON',
+    )
+    parser.add_argument(
+        '--cleanup',
+        action='store_true',
+        help=(
+            'compress and remove old logs, as done at the end of every '
+            'deployment'
+        ),
+    )
+    args = parser.parse_args(argv)
+    logdir = ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP_LOGDIR
+    runs = update_index(
+        logdir,
+        ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_ANSWERS_ARCHIVE_DIR,
+        ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SETUP,
+    )
+    if args.cleanup:
+        apply_retention(runs)
+        save_index(logdir, runs)
+    if args.failed:
+        rid = last_failed(runs)
+        if rid is None:
+            sys.stderr.write('No failed deployment found\n')
+            return 1
+        runs = {rid: runs[rid]}
+    if args.json:
+        sys.stdout.write(json.dumps(runs, indent=4, sort_keys=True) + '\n')
+        return 0
+    for rid in sorted(runs, key=lambda rid: runs[rid]['start']):
+        sys.stdout.write(format_run(rid, runs[rid]) + '\n')
+        if args.failed:
+            for path in runs[rid]['files']:
+                sys.stdout.write('    {p}\n'.format(p=path))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,190 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+import gzip
+import os
+import time
+
+from . import log_retention
+
+PREFIX = 'ovirt-hosted-engine-setup'
+DAY = 86400
+
+
+def _ts(t):
+    return time.strftime('%Y%m%d%H%M%S', time.localtime(t))
+
+
+def _write(directory, name, size=1000):
+    path = os.path.join(str(directory), name)
+    with open(path, 'w') as f:
+        f.write('x' * size)
+    return path
+
+
+def _deployment(logdir, answersdir, start, rand):
+    """Write the files of a deployment started at start."""
+    log = _write(logdir, '{p}-{t}-{r}.log'.format(
+        p=PREFIX,
+        t=_ts(start),
+        r=rand,
+    ))
+    _write(logdir, '{p}-{t}-{r}-timeline.json'.format(
+        p=PREFIX,
+        t=_ts(start),
+        r=rand,
+    ))
+    for i, tag in enumerate(('initial_clean', 'bootstrap_local_vm')):
+        _write(logdir, '{p}-ansible-{g}-{t}-abc{i}.log'.format(
+            p=PREFIX,
+            g=tag,
+            t=_ts(start + 10 + i),
+            i=i,
+        ))
+    _write(answersdir, _answers(start))
+    return log
+
+
+def _answers(start):
+    return 'answers-{t}.conf'.format(t=_ts(start + 100))
+
+
+def _dirs(tmpdir):
+    logdir = tmpdir.mkdir('log')
+    answersdir = tmpdir.mkdir('answers')
+    return str(logdir), str(answersdir)
+
+
+def testScan(tmpdir):
+    logdir, answersdir = _dirs(tmpdir)
+    now = int(time.time())
+    first = _deployment(logdir, answersdir, now - 2 * DAY, 'aaaaaa')
+    second = _deployment(logdir, answersdir, now - DAY, 'bbbbbb')
+    _write(logdir, 'unrelated.log')
+    runs = log_retention.scan(logdir, answersdir, PREFIX)
+    assert sorted(runs) == [
+        log_retention.run_id(first),
+        log_retention.run_id(second),
+    ]
+    for run in runs.values():
+        assert len(run['files']) == 5
+    assert first in runs[log_retention.run_id(first)]['files']
+
+
+def testIndex(tmpdir):
+    logdir, answersdir = _dirs(tmpdir)
+    now = int(time.time())
+    first = _deployment(logdir, answersdir, now - DAY, 'aaaaaa')
+    runs = log_retention.update_index(
+        logdir,
+        answersdir,
+        PREFIX,
+        current={
+            'log': first,
+            'status': log_retention.STATUS_FAILED,
+            'failed_task': 'Wait for the host to be up',
+        },
+    )
+    log_retention.save_index(logdir, runs)
+    second = _deployment(logdir, answersdir, now, 'bbbbbb')
+    runs = log_retention.update_index(logdir, answersdir, PREFIX)
+    first_run = runs[log_retention.run_id(first)]
+    assert first_run['status'] == log_retention.STATUS_FAILED
+    assert first_run['failed_task'] == 'Wait for the host to be up'
+    assert first_run['duration'] >= DAY
+    assert runs[log_retention.run_id(second)]['status'] == (
+        log_retention.STATUS_UNKNOWN
+    )
+    assert log_retention.last_failed(runs) == log_retention.run_id(first)
+
+
+def testRetention(tmpdir):
+    logdir, answersdir = _dirs(tmpdir)
+    now = int(time.time())
+    logs = [
+        _deployment(logdir, answersdir, now - days * DAY, rand)
+        for days, rand in (
+            (60, 'aaaaaa'),
+            (50, 'bbbbbb'),
+            (5, 'cccccc'),
+            (4, 'dddddd'),
+            (3, 'eeeeee'),
+            (0, 'ffffff'),
+        )
+    ]
+    ids = [log_retention.run_id(log) for log in logs]
+    runs = log_retention.update_index(logdir, answersdir, PREFIX)
+    runs[ids[0]]['status'] = log_retention.STATUS_SUCCESS
+    removed = log_retention.apply_retention(
+        runs,
+        current=ids[-1],
+        max_age_days=30,
+        max_size_mb=1,
+        uncompressed_runs=2,
+    )
+    # The last successful run is kept, even if old
+    assert removed == [ids[1]]
+    assert not os.path.exists(logs[1])
+    assert os.path.exists(logs[0])
+    # Compressed, but for the last two, the protected and the answer files
+    for rid in ids[2:4]:
+        for path in runs[rid]['files']:
+            if os.path.basename(path).startswith('answers-'):
+                assert not path.endswith('.gz')
+                continue
+            assert path.endswith('.gz')
+            with gzip.open(path) as f:
+                assert f.read() == b'x' * 1000
+    for rid in ids[4:]:
+        assert not any(p.endswith('.gz') for p in runs[rid]['files'])
+    # Still found once compressed
+    assert log_retention.scan(logdir, answersdir, PREFIX)[ids[2]][
+        'files'
+    ] == runs[ids[2]]['files']
+    removed = log_retention.apply_retention(
+        runs,
+        current=ids[-1],
+        max_size_mb=0,
+    )
+    assert removed == ids[2:5]
+    assert sorted(runs) == [ids[0], ids[-1]]
+    # The answer files go only by age
+    assert sorted(os.listdir(answersdir)) == sorted(
+        _answers(now - days * DAY) for days in (60, 5, 4, 3, 0)
+    )
+
+
+def testFailedTask():
+    events = [
+        {'cat': 'tag', 'name': 'a', 'ts': 0, 'dur': 10, 'args': {'rc': 0}},
+        {'cat': 'task', 'name': 'ignored', 'ts': 1, 'dur': 1,
+         'args': {'status': 'FAILED'}},
+        {'cat': 'tag', 'name': 'b', 'ts': 20, 'dur': 10, 'args': {'rc': 2}},
+        {'cat': 'task', 'name': 'retried', 'ts': 21, 'dur': 1,
+         'args': {'status': 'FAILED'}},
+        {'cat': 'task', 'name': 'failing', 'ts': 25, 'dur': 1,
+         'args': {'status': 'FAILED'}},
+        {'cat': 'task', 'name': 'ok', 'ts': 27, 'dur': 1,
+         'args': {'status': 'OK'}},
+    ]
+    assert log_retention.failed_task(events) == 'failing'
+    assert log_retention.failed_task(events[:2]) is None
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,114 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Deployment timeline.
+
+Collects the spans of the otopi stages, of the ansible tags and of the
+ansible tasks, and writes them in the Chrome trace event format, which can
+be loaded by chrome://tracing, Perfetto or speedscope, or aggregated with
+any JSON tool.
+
+Timestamps are wall clock microseconds, so that the events recorded by the
+ansible callback plugins, in another process, line up with ours. All events
+share one pid and tid, so that they nest like a flame graph:
+stage > tag > play > task.
+"""
+
+
+import json
+import os
+import time
+
+
+CATEGORY_STAGE = 'stage'
+CATEGORY_TAG = 'tag'
+
+_events = []
+
+
+def now():
+    return time.time()
+
+
+def _us(t):
+    return int(round(t * 1000000))
+
+
+def _normalize(event):
+    event.setdefault('ph', 'X')
+    event.setdefault('pid', os.getpid())
+    event.setdefault('tid', os.getpid())
+    event.setdefault('args', {})
+    return event
+
+
+def add(name, category, start, end, **args):
+    """Record a span, start and end as returned by now()."""
+    _events.append(
+        _normalize({
+            'name': name,
+            'cat': category,
+            'ts': _us(start),
+            'dur': _us(end) - _us(start),
+            'args': args,
+        })
+    )
+
+
+def load(path):
+    """
+    Record the events written by the ovirt_logger callback plugin, one
+    JSON object per line. Return how many were loaded.
+    A truncated last line, from a killed ansible-playbook, is ignored.
+    """
+    loaded = 0
+    try:
+        with open(path, 'rb') as f:
+            for line in f:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                _events.append(_normalize(event))
+                loaded += 1
+    except (IOError, OSError):
+        pass
+    return loaded
+
+
+def events():
+    return sorted(_events, key=lambda e: (e['ts'], -e['dur']))
+
+
+def write(path, **metadata):
+    """Write the timeline recorded so far, metadata goes to otherData."""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(
+            {
+                'traceEvents': events(),
+                'displayTimeUnit': 'ms',
+                'otherData': metadata,
+            },
+            f,
+        )
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
@@ -23,19 +23,36 @@
 
 import gettext
 import json
+import random
 import socket
 import sys
 import time
 
 from ovirt_hosted_engine_ha.client import client
+from ovirt_hosted_engine_ha.env import constants as haconsts
 from ovirt_hosted_engine_ha.lib.exceptions import BrokerConnectionError
 from ovirt_hosted_engine_ha.lib.exceptions import DisconnectionError
 
+from ovirt_hosted_engine_setup import ha_metrics
+from ovirt_hosted_engine_setup import host_status
+
 
 def _(m):
     return gettext.dgettext(message=m, domain='ovirt-hosted-engine-setup')
 
 
+# Seconds between two reads of the stats in watch mode
+WATCH_INTERVAL = 2.0
+# Seconds between two reads of the stats in exporter mode
+EXPORTER_INTERVAL = 15.0
+EXPORTER_ADDRESS = '127.0.0.1'
+# Seconds between two attempts of get_status, doubled at every attempt
+RETRY_DELAY_MIN = 0.25
+RETRY_DELAY_MAX = 5.0
+# Seconds to wait for the broker to accept a connection, when probing
+PROBE_TIMEOUT = 1.0
+
+
 class VmStatus(object):
 
     DESCRIPTIONS = {
@@ -53,73 +70,99 @@ class VmStatus(object):
         'maintenance': _('Local maintenance')
     }
 
-    def __init__(self, with_json=False):
+    # Reported by watch() when they change
+    WATCHED_FIELDS = (
+        'score',
+        'engine-status',
+        'live-data',
+        'maintenance',
+    )
+
+    def __init__(self, with_json=False, debug=False):
         super(VmStatus, self).__init__()
         self.with_json = with_json
+        self.debug = debug
+        self._ha_cli = None
+        self._timings = []
 
-    def log_error(self, error):
-        if self.with_json:
-            print(
-                json.loads(
-                    '{{"exception": "{0}"}}'.format(
-                        error.strip()
-                    )
+    def _timing(self, name, start):
+        self._timings.append((name, time.monotonic() - start))
+
+    def log_timings(self):
+        """With debug, write how long every step took to stderr."""
+        if self.debug and self._timings:
+            sys.stderr.write(
+                'vm-status timings: {t}, total {s:.3f}s\n'.format(
+                    t=', '.join(
+                        '{n} {d:.3f}s'.format(n=name, d=duration)
+                        for name, duration in self._timings
+                    ),
+                    s=sum(duration for name, duration in self._timings),
                 )
             )
+
+    def log_error(self, error):
+        if self.with_json:
+            print(json.dumps({'exception': error.strip()}))
         else:
             sys.stderr.write(error)
 
-    def _get_all_host_stats(self):
-        ha_cli = client.HAClient()
-        try:
-            all_host_stats = ha_cli.get_all_host_stats()
-        except (socket.error, BrokerConnectionError) as e:
-            self.log_error(
-                _(
-                    '{0}\nCannot connect to the HA daemon, '
-                    'please check the logs.\n'
-                    ).format(str(e))
-            )
-            # there is no reason to continue if we can't connect to the daemon
-            raise RuntimeError(_('Unable to connect the HA Broker '))
-        return all_host_stats
+    def _client(self):
+        if self._ha_cli is None:
+            start = time.monotonic()
+            self._ha_cli = client.HAClient()
+            self._timing('client', start)
+        return self._ha_cli
 
-    def _get_cluster_stats(self):
-        ha_cli = client.HAClient()
+    def _get_stats(self, log_errors=True):
+        """
+        Return the status of all the hosts, {host id: HostStatus}, and the
+        cluster stats, read from the broker, and so from the shared
+        storage, at once.
+        """
+        start = time.monotonic()
         try:
-            cluster_stats = ha_cli.get_all_stats(client.HAClient.
-                                                 StatModes.GLOBAL)[0]
-        except KeyError:
-            # Stats were retrieved but the global section is missing.
+            all_stats = self._client().get_all_stats(
+                client.HAClient.StatModes.ALL
+            )
+            # Stats were retrieved but the global section may be missing.
             # This is not an error.
-            cluster_stats = {}
+            cluster_stats = all_stats.pop(0, {})
+            hosts = host_status.decode(all_stats)
         except (
             socket.error,
             AttributeError,
-            IndexError,
             BrokerConnectionError
-        ):
-            self.log_error(
-                _('Cannot connect to the HA daemon, please check the logs.\n')
-            )
+        ) as e:
+            if log_errors:
+                self.log_error(
+                    _(
+                        '{0}\nCannot connect to the HA daemon, '
+                        'please check the logs.\n'
+                        ).format(str(e))
+                )
+            # there is no reason to continue if we can't connect to the daemon
             raise RuntimeError(_('Unable to connect the HA Broker '))
-        return cluster_stats
+        finally:
+            # Connection, read of the metadata and parsing
+            self._timing('fetch', start)
+        return hosts, cluster_stats
 
     def print_status(self):
         try:
-            all_host_stats = self._get_all_host_stats()
-            cluster_stats = self._get_cluster_stats()
+            hosts, cluster_stats = self._get_stats()
+            start = time.monotonic()
 
             if self.with_json:
-                for host_id, host_stats in all_host_stats.items():
-                    all_host_stats[host_id]['engine-status'] = json.loads(
-                        all_host_stats[host_id]['engine-status']
-                    )
-
+                all_host_stats = dict(
+                    (host_id, host.as_dict())
+                    for host_id, host in hosts.items()
+                )
                 all_host_stats["global_maintenance"] = cluster_stats.get(
                     client.HAClient.GlobalMdFlags.MAINTENANCE, False)
 
                 print(json.dumps(all_host_stats))
+                self._timing('render', start)
                 return all_host_stats
 
             glb_msg = ''
@@ -132,7 +175,8 @@ class VmStatus(object):
                 )
                 print(glb_msg)
 
-            for host_id, host_stats in all_host_stats.items():
+            for host_id, host in hosts.items():
+                host_stats = host.stats
                 print(_('\n\n--== Host {hostname} (id: {host_id})'
                         ' status ==--\n').format(
                     host_id=host_id,
@@ -162,7 +206,8 @@ class VmStatus(object):
             # Print again so it's easier to notice
             if glb_msg:
                 print(glb_msg)
-            return all_host_stats
+            self._timing('render', start)
+            return hosts
         except DisconnectionError as e:
             sys.stderr.write(_(
                 'An error occured while retrieving vm status, '
@@ -178,42 +223,391 @@ class VmStatus(object):
             sys.stderr.write(str(e) + '\n')
             return None
 
+    def _emit(self, event, **fields):
+        """Write a watch event, as a JSON line or as a line of text."""
+        now = time.time()
+        if self.with_json:
+            fields.update(ts=round(now, 3), event=event)
+            print(json.dumps(fields, sort_keys=True), flush=True)
+            return
+        if event == 'snapshot':
+            text = _('{n} hosts, global maintenance: {g}').format(
+                n=len(fields['hosts']),
+                g=fields['global_maintenance'],
+            )
+            for host_id, host in sorted(fields['hosts'].items()):
+                text += '\n' + _('{hostname} (id: {host_id}): {v}').format(
+                    hostname=host.get('hostname'),
+                    host_id=host_id,
+                    v=', '.join(
+                        '{k} {v}'.format(k=k, v=json.dumps(host.get(k)))
+                        for k in self.WATCHED_FIELDS
+                    ),
+                )
+        elif event == 'changed':
+            text = _('{hostname} (id: {host_id}): {f}: {o} -> {n}').format(
+                hostname=fields['hostname'],
+                host_id=fields['host_id'],
+                f=self.DESCRIPTIONS.get(fields['field'], fields['field']),
+                o=json.dumps(fields['old']),
+                n=json.dumps(fields['new']),
+            )
+        elif event == 'global-maintenance':
+            text = _('Global maintenance: {o} -> {n}').format(
+                o=fields['old'],
+                n=fields['new'],
+            )
+        elif event in ('host-added', 'host-removed'):
+            text = _('{hostname} (id: {host_id}): {e}').format(
+                hostname=fields['hostname'],
+                host_id=fields['host_id'],
+                e=event,
+            )
+        else:
+            text = _('{e}: {m}').format(e=event, m=fields.get('message'))
+        print(
+            '[{t}] {text}'.format(
+                t=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now)),
+                text=text,
+            ),
+            flush=True,
+        )
+
+    def _watched(self, hosts):
+        """The watched fields of every host, engine-status decoded."""
+        watched = {}
+        for host_id, host in hosts.items():
+            host_stats = host.as_dict()
+            watched[host_id] = dict(
+                (k, host_stats.get(k))
+                for k in ('hostname',) + self.WATCHED_FIELDS
+            )
+        return watched
+
+    def _diff(self, old, new):
+        """Emit the changes from the old watched stats to the new ones."""
+        old_hosts, old_maintenance = old
+        new_hosts, new_maintenance = new
+        if old_maintenance != new_maintenance:
+            self._emit(
+                'global-maintenance',
+                old=old_maintenance,
+                new=new_maintenance,
+            )
+        for host_id in sorted(set(old_hosts) | set(new_hosts)):
+            if host_id not in new_hosts:
+                self._emit(
+                    'host-removed',
+                    host_id=host_id,
+                    hostname=old_hosts[host_id]['hostname'],
+                )
+            elif host_id not in old_hosts:
+                self._emit(
+                    'host-added',
+                    host_id=host_id,
+                    hostname=new_hosts[host_id]['hostname'],
+                    **dict(
+                        (k, new_hosts[host_id][k])
+                        for k in self.WATCHED_FIELDS
+                    )
+                )
+            else:
+                for field in self.WATCHED_FIELDS:
+                    if old_hosts[host_id][field] != new_hosts[host_id][field]:
+                        self._emit(
+                            'changed',
+                            host_id=host_id,
+                            hostname=new_hosts[host_id]['hostname'],
+                            field=field,
+                            old=old_hosts[host_id][field],
+                            new=new_hosts[host_id][field],
+                        )
+
+    def watch(self, interval=WATCH_INTERVAL, iterations=None):
+        """
+        Read the stats every interval seconds with the same client, and
+        report only what changed since the previous read: the first read,
+        then the changes of WATCHED_FIELDS, of the hosts and of the global
+        maintenance. Errors are reported, and watching goes on.
+        """
+        last = None
+        failing = False
+        done = 0
+        try:
+            while iterations is None or done < iterations:
+                start = time.monotonic()
+                try:
+                    hosts, cluster_stats = self._get_stats(
+                        log_errors=False,
+                    )
+                except (RuntimeError, DisconnectionError) as e:
+                    if not failing:
+                        self._emit('error', message=str(e).strip())
+                    failing = True
+                else:
+                    failing = False
+                    current = (
+                        self._watched(hosts),
+                        cluster_stats.get(
+                            client.HAClient.GlobalMdFlags.MAINTENANCE,
+                            False
+                        ),
+                    )
+                    if last is None:
+                        self._emit(
+                            'snapshot',
+                            hosts=current[0],
+                            global_maintenance=current[1],
+                        )
+                    else:
+                        self._diff(last, current)
+                    last = current
+                self.log_timings()
+                self._timings = []
+                done += 1
+                if iterations is None or done < iterations:
+                    time.sleep(
+                        max(interval - (time.monotonic() - start), 0)
+                    )
+        except KeyboardInterrupt:
+            pass
+        return last is not None
+
+    def _global_maintenance(self, cluster_stats):
+        return cluster_stats.get(
+            client.HAClient.GlobalMdFlags.MAINTENANCE,
+            False
+        )
+
+    def print_metrics(self):
+        """
+        Write the stats in the OpenMetrics text format, also when the broker
+        cannot be reached, as ovirt_hosted_engine_broker_up 0.
+        """
+        try:
+            hosts, cluster_stats = self._get_stats()
+        except RuntimeError:
+            hosts = None
+            text = ha_metrics.format_metrics(None)
+        else:
+            start = time.monotonic()
+            text = ha_metrics.format_metrics(
+                hosts,
+                self._global_maintenance(cluster_stats),
+            )
+            self._timing('render', start)
+        sys.stdout.write(text)
+        return hosts is not None
+
+    def export(
+        self,
+        interval=EXPORTER_INTERVAL,
+        listen=None,
+        textfile=None,
+        iterations=None,
+    ):
+        """
+        Read the stats every interval seconds with the same client, and
+        serve them as OpenMetrics over HTTP on listen, an (address, port)
+        tuple, and/or write them to textfile for the textfile collector of
+        node_exporter. Scrapes get the last stats read, and do not wait
+        for the broker.
+        """
+        metrics_server = None
+        if listen is not None:
+            metrics_server = ha_metrics.MetricsServer(*listen)
+            metrics_server.start()
+        ages = ha_metrics.MetadataAges()
+        failing = False
+        done = 0
+        try:
+            while iterations is None or done < iterations:
+                start = time.monotonic()
+                try:
+                    hosts, cluster_stats = self._get_stats(
+                        log_errors=False,
+                    )
+                except (RuntimeError, DisconnectionError) as e:
+                    if not failing:
+                        sys.stderr.write('{e}\n'.format(e=str(e).strip()))
+                    failing = True
+                    text = ha_metrics.format_metrics(None)
+                else:
+                    failing = False
+                    text = ha_metrics.format_metrics(
+                        hosts,
+                        self._global_maintenance(cluster_stats),
+                        ages.update(hosts),
+                    )
+                if metrics_server is not None:
+                    metrics_server.set_metrics(text)
+                if textfile is not None:
+                    try:
+                        ha_metrics.write_textfile(textfile, text)
+                    except (IOError, OSError) as e:
+                        sys.stderr.write(
+                            _('Cannot write {path}: {e}\n').format(
+                                path=textfile,
+                                e=e,
+                            )
+                        )
+                self.log_timings()
+                self._timings = []
+                done += 1
+                if iterations is None or done < iterations:
+                    time.sleep(
+                        max(interval - (time.monotonic() - start), 0)
+                    )
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if metrics_server is not None:
+                metrics_server.stop()
+        return True
+
+    def _broker_ready(self):
+        """
+        Whether the broker accepts connections on its socket, far cheaper
+        than reading the stats, which reads the shared storage.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(PROBE_TIMEOUT)
+        try:
+            sock.connect(haconsts.BROKER_SOCKET_FILE)
+            return True
+        except (socket.error, OSError):
+            return False
+        finally:
+            sock.close()
+
     def get_status(self, timeout=30):
-        i_timeout = timeout
-        RETRY_DELAY = 3
+        """
+        Return the status, waiting up to timeout seconds for the broker to
+        be ready. The broker socket is probed first, then the stats are
+        read, and on failure it is tried again after a delay doubled every
+        time, from RETRY_DELAY_MIN up to RETRY_DELAY_MAX, with jitter.
+        The seconds it took and the attempts are reported as
+        time_to_ready and attempts.
+        """
         status = {}
-        while timeout > 0:
+        start = time.monotonic()
+        deadline = start + timeout
+        delay = RETRY_DELAY_MIN
+        attempts = 0
+        while True:
+            attempts += 1
             try:
-                cluster_stats = self._get_cluster_stats()
-                status['global_maintenance'] = cluster_stats.get(
-                    client.HAClient.GlobalMdFlags.MAINTENANCE,
-                    False
+                if not self._broker_ready():
+                    raise RuntimeError(_('The HA Broker is not ready'))
+                hosts, cluster_stats = self._get_stats(log_errors=False)
+                status['global_maintenance'] = self._global_maintenance(
+                    cluster_stats
                 )
-                status['all_host_stats'] = self._get_all_host_stats()
-                status['engine_vm_up'] = False
-                status['engine_vm_host'] = None
-                for host in status['all_host_stats'].values():
-                    if 'engine-status' in host and 'live-data' in host:
-                        if '"vm": "up"' in host[
-                            'engine-status'
-                        ] and host['live-data']:
-                            status['engine_vm_up'] = True
-                            status['engine_vm_host'] = host['hostname']
+                status['all_host_stats'] = dict(
+                    (host_id, host.stats) for host_id, host in hosts.items()
+                )
+                status['hosts'] = hosts
+                engine_vm_host = host_status.engine_vm_host(hosts)
+                status['engine_vm_up'] = engine_vm_host is not None
+                status['engine_vm_host'] = (
+                    engine_vm_host.hostname if engine_vm_host else None
+                )
+                status['time_to_ready'] = round(time.monotonic() - start, 3)
+                status['attempts'] = attempts
+                self._timing('ready', start)
                 return status
             except RuntimeError:
-                if timeout >= RETRY_DELAY:
-                    time.sleep(RETRY_DELAY)
-                timeout -= RETRY_DELAY
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                # Equal jitter: between half and all of the delay
+                time.sleep(min(delay * random.uniform(0.5, 1), remaining))
+                delay = min(delay * 2, RETRY_DELAY_MAX)
         raise RuntimeError(
-            _('Unable to connect the HA Broker within {t} seconds').format(
-                t=i_timeout,
+            _(
+                'Unable to connect the HA Broker within {t} seconds, '
+                '{n} attempts'
+            ).format(
+                t=timeout,
+                n=attempts,
             )
         )
 
 
+def _option(argv, name):
+    """The value of name=value, '' for a bare name, None without it."""
+    for arg in argv:
+        if arg == name:
+            return ''
+        if arg.startswith(name + '='):
+            return arg[len(name) + 1:]
+    return None
+
+
+def _interval(argv, name, default):
+    """The interval of name[=interval], None without it."""
+    value = _option(argv, name)
+    if not value:
+        return default if value is not None else None
+    interval = float(value)
+    if interval <= 0:
+        raise ValueError(value)
+    return interval
+
+
+def _listen(value):
+    """(address, port) of [address:]port."""
+    address, sep, port = value.rpartition(':')
+    port = int(port)
+    if not 0 < port < 65536:
+        raise ValueError(value)
+    return (address or EXPORTER_ADDRESS, port)
+
+
 if __name__ == "__main__":
-    status_checker = VmStatus(with_json=any(['--json' in sys.argv]))
-    if not status_checker.print_status():
+    status_checker = VmStatus(
+        with_json='--json' in sys.argv,
+        debug='--debug' in sys.argv,
+    )
+    argv = sys.argv[1:]
+    try:
+        watch_interval = _interval(argv, '--watch', WATCH_INTERVAL)
+    except ValueError:
+        sys.stderr.write(_('Invalid --watch interval\n'))
+        sys.exit(1)
+    output_format = _option(argv, '--format')
+    if output_format not in (None, 'text', 'openmetrics'):
+        sys.stderr.write(_('Invalid --format, text or openmetrics\n'))
+        sys.exit(1)
+    if _option(argv, '--exporter') is not None:
+        listen = _option(argv, '--listen')
+        textfile = _option(argv, '--textfile')
+        try:
+            interval = _interval(argv, '--interval', EXPORTER_INTERVAL)
+            if listen is not None:
+                listen = _listen(listen)
+        except ValueError:
+            sys.stderr.write(_('Invalid --listen or --interval\n'))
+            sys.exit(1)
+        if listen is None and not textfile:
+            sys.stderr.write(
+                _('--exporter needs --listen and/or --textfile\n')
+            )
+            sys.exit(1)
+        status = status_checker.export(
+            interval or EXPORTER_INTERVAL,
+            listen=listen,
+            textfile=textfile or None,
+        )
+    elif watch_interval is not None:
+        status = status_checker.watch(watch_interval)
+    elif output_format == 'openmetrics':
+        status = status_checker.print_metrics()
+        status_checker.log_timings()
+    else:
+        status = status_checker.print_status()
+        status_checker.log_timings()
+    if not status:
         sys.exit(1)
 
 
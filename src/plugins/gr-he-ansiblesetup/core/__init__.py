@@ -25,6 +25,7 @@ from otopi import util
 from . import misc
 from . import storage_domain
 from . import target_vm
+from . import timeline
 
 
 @util.export
@@ -32,6 +33,7 @@ def createPlugins(context):
     misc.Plugin(context=context)
     storage_domain.Plugin(context=context)
     target_vm.Plugin(context=context)
+    timeline.Plugin(context=context)
 
 
 # vim: expandtab tabstop=4 shiftwidth=4
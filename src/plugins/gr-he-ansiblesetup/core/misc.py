@@ -26,6 +26,8 @@ import netaddr
 import re
 import uuid
 
+from he_ansible import jsonlog
+
 from otopi import context as otopicontext
 from otopi import plugin
 from otopi import util
@@ -33,6 +35,7 @@ from otopi import util
 from ovirt_setup_lib import dialog
 
 from ovirt_hosted_engine_setup import ansible_utils
+from ovirt_hosted_engine_setup import appliance_prep
 from ovirt_hosted_engine_setup import constants as ohostedcons
 
 
@@ -46,6 +49,7 @@ class Plugin(plugin.PluginBase):
 
     def __init__(self, context):
         super(Plugin, self).__init__(context=context)
+        self._appliance_preparer = None
 
     @plugin.event(
         stage=plugin.Stages.STAGE_INIT,
@@ -87,6 +91,54 @@ class Plugin(plugin.PluginBase):
             ohostedcons.CoreEnv.ENABLE_KEYCLOAK,
             None
         )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_PERSISTENT_EXECUTOR,
+            False
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_FACT_CACHE,
+            True
+        )
+        self.environment.setdefault(
+            ohostedcons.VMEnv.APPLIANCE_SPECULATIVE_PREP,
+            False
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_SSH_MULTIPLEXING,
+            True
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_SSH_CONTROL_PERSIST,
+            60
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_SSH_PERSISTENT_RUNS,
+            0
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_TIMEOUTS,
+            None
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_TIMEOUT,
+            None
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_TASK_TIMEOUT,
+            None
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_HEARTBEAT_INTERVAL,
+            60
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_LOG_FORMAT,
+            jsonlog.TEXT
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.ANSIBLE_LOG_COMPRESSION,
+            jsonlog.GZIP
+        )
 
     @plugin.event(
         stage=plugin.Stages.STAGE_SETUP,
@@ -153,6 +205,80 @@ class Plugin(plugin.PluginBase):
 
         self.environment[ohostedcons.VMEnv.CDROM] = None
 
+    @plugin.event(
+        stage=plugin.Stages.STAGE_LATE_SETUP,
+    )
+    def _late_setup(self):
+        try:
+            timeouts = ansible_utils.parse_timeouts(
+                self.environment[ohostedcons.CoreEnv.ANSIBLE_TIMEOUTS]
+            )
+        except ValueError as e:
+            raise RuntimeError(
+                _('Invalid {key}: {e}').format(
+                    key=ohostedcons.CoreEnv.ANSIBLE_TIMEOUTS,
+                    e=e,
+                )
+            )
+        for key, valid in (
+            (ohostedcons.CoreEnv.ANSIBLE_LOG_FORMAT, jsonlog.FORMATS),
+            (
+                ohostedcons.CoreEnv.ANSIBLE_LOG_COMPRESSION,
+                jsonlog.COMPRESSIONS,
+            ),
+        ):
+            if self.environment[key] not in valid:
+                raise RuntimeError(
+                    _('Invalid {key} "{v}", expected one of: {valid}').format(
+                        key=key,
+                        v=self.environment[key],
+                        valid=', '.join(valid),
+                    )
+                )
+        ansible_utils.configure_deployment(
+            local_vm_uuid=self.environment[ohostedcons.VMEnv.LOCAL_VM_UUID],
+            fact_cache=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_FACT_CACHE
+            ],
+            ssh_multiplexing=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_SSH_MULTIPLEXING
+            ],
+            ssh_control_persist=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_SSH_CONTROL_PERSIST
+            ],
+            ssh_persistent_runs=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_SSH_PERSISTENT_RUNS
+            ],
+            timeouts=timeouts,
+            timeout=self.environment[ohostedcons.CoreEnv.ANSIBLE_TIMEOUT],
+            task_timeout=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_TASK_TIMEOUT
+            ],
+            heartbeat_interval=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_HEARTBEAT_INTERVAL
+            ],
+            log_format=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_LOG_FORMAT
+            ],
+            log_compression=self.environment[
+                ohostedcons.CoreEnv.ANSIBLE_LOG_COMPRESSION
+            ],
+        )
+        if not self.environment[
+            ohostedcons.CoreEnv.ANSIBLE_PERSISTENT_EXECUTOR
+        ]:
+            return
+        try:
+            ansible_utils.start_executor()
+        except Exception as e:
+            self.logger.debug('Cannot start ansible executor', exc_info=True)
+            self.logger.warning(
+                _(
+                    'Cannot start the ansible executor, playbooks will be '
+                    'run directly: {e}'
+                ).format(e=e)
+            )
+
     @plugin.event(
         stage=plugin.Stages.STAGE_CUSTOMIZATION,
         after=(
@@ -324,6 +450,48 @@ class Plugin(plugin.PluginBase):
                 default=True,
             )
 
+    @plugin.event(
+        stage=plugin.Stages.STAGE_CUSTOMIZATION,
+        after=(
+            ohostedcons.Stages.CONFIG_OVF_IMPORT_ANSIBLE,
+        ),
+        condition=lambda self: (
+            self.environment[ohostedcons.VMEnv.APPLIANCE_SPECULATIVE_PREP] and
+            self.environment[ohostedcons.VMEnv.OVF]
+        ),
+    )
+    def _customization_appliance_prep(self):
+        # Decompress the appliance while the user answers the following
+        # questions, bootstrap_local_vm will extract it much faster
+        preparer = appliance_prep.AppliancePreparer(
+            ova_path=self.environment[ohostedcons.VMEnv.OVF],
+            staging_parent=ohostedcons.FileLocations.LOCAL_VM_DIR_PATH,
+        )
+        try:
+            if preparer.start():
+                self._appliance_preparer = preparer
+        except Exception as e:
+            self.logger.debug('Cannot prepare the appliance', exc_info=True)
+            self.logger.warning(
+                _('Cannot prepare the appliance in background: {e}').format(
+                    e=e,
+                )
+            )
+
+    def _get_prepared_appliance(self):
+        preparer = self._appliance_preparer
+        if (
+            preparer is None or
+            preparer.ova_path != self.environment[ohostedcons.VMEnv.OVF]
+        ):
+            return None
+        return preparer.wait()
+
+    def _cleanup_appliance_preparer(self):
+        if self._appliance_preparer is not None:
+            self._appliance_preparer.cleanup()
+            self._appliance_preparer = None
+
     @plugin.event(
         stage=plugin.Stages.STAGE_CLOSEUP,
         name=ohostedcons.Stages.ANSIBLE_BOOTSTRAP_LOCAL_VM,
@@ -481,18 +649,30 @@ class Plugin(plugin.PluginBase):
 
         self.initial_clean_up(bootstrap_vars, inventory_source)
 
-        ah = ansible_utils.AnsibleHelper(
-            tags=ohostedcons.Const.HE_TAG_BOOTSTRAP_LOCAL_VM,
-            extra_vars=bootstrap_vars,
-            user_extra_vars=self.environment.get(
-                ohostedcons.CoreEnv.ANSIBLE_USER_EXTRA_VARS
-            ),
-            inventory_source=inventory_source,
-            raise_on_error=False,
-        )
-        self.logger.info(_('Starting local VM'))
-        r = ah.run()
-        self.logger.debug(r)
+        try:
+            prepared_appliance = self._get_prepared_appliance()
+            if prepared_appliance is not None:
+                self.logger.debug(
+                    'Using the prepared appliance {p}'.format(
+                        p=prepared_appliance,
+                    )
+                )
+                bootstrap_vars['he_appliance_ova'] = prepared_appliance
+            ah = ansible_utils.AnsibleHelper(
+                tags=ohostedcons.Const.HE_TAG_BOOTSTRAP_LOCAL_VM,
+                extra_vars=bootstrap_vars,
+                user_extra_vars=self.environment.get(
+                    ohostedcons.CoreEnv.ANSIBLE_USER_EXTRA_VARS
+                ),
+                inventory_source=inventory_source,
+                raise_on_error=False,
+            )
+            self.logger.info(_('Starting local VM'))
+            r = ah.run()
+            self.logger.debug(r)
+        finally:
+            # Extracted by now, or useless
+            self._cleanup_appliance_preparer()
 
         if (
             'otopi_localvm_dir' in r and
@@ -567,4 +747,12 @@ class Plugin(plugin.PluginBase):
         r = ah.run()
         self.logger.debug(r)
 
+    @plugin.event(
+        stage=plugin.Stages.STAGE_TERMINATE,
+    )
+    def _terminate(self):
+        self._cleanup_appliance_preparer()
+        ansible_utils.stop_executor()
+        ansible_utils.cleanup_deployment(self.logger)
+
 # vim: expandtab tabstop=4 shiftwidth=4
@@ -0,0 +1,219 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Deployment timeline plugin."""
+
+
+import gettext
+import os
+
+from otopi import constants as otopicons
+from otopi import plugin
+from otopi import util
+
+from ovirt_hosted_engine_setup import constants as ohostedcons
+from ovirt_hosted_engine_setup import timeline
+
+
+def _(m):
+    return gettext.dgettext(message=m, domain='ovirt-hosted-engine-setup')
+
+
+@util.export
+class Plugin(plugin.PluginBase):
+    """
+    Deployment timeline plugin.
+    Every otopi stage starts at the first event of this plugin in it and
+    ends when the next one starts. The ansible tags and tasks are recorded
+    by ansible_utils.
+    """
+
+    def __init__(self, context):
+        super(Plugin, self).__init__(context=context)
+        self._stage = None
+        self._stage_start = None
+
+    def _begin(self, stage):
+        now = timeline.now()
+        if self._stage is not None:
+            timeline.add(
+                self._stage,
+                timeline.CATEGORY_STAGE,
+                self._stage_start,
+                now,
+            )
+        self._stage = stage
+        self._stage_start = now
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_BOOT,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _boot(self):
+        self._begin('boot')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_INIT,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _init(self):
+        self._begin('init')
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.TIMELINE_FILE,
+            None
+        )
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_SETUP,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _setup(self):
+        self._begin('setup')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_INTERNAL_PACKAGES,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _internal_packages(self):
+        self._begin('internal_packages')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_PROGRAMS,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _programs(self):
+        self._begin('programs')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_LATE_SETUP,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _late_setup(self):
+        self._begin('late_setup')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_CUSTOMIZATION,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _customization(self):
+        self._begin('customization')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_VALIDATION,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _validation(self):
+        self._begin('validation')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_TRANSACTION_BEGIN,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _transaction_begin(self):
+        self._begin('transaction_begin')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_EARLY_MISC,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _early_misc(self):
+        self._begin('early_misc')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_PACKAGES,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _packages(self):
+        self._begin('packages')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_MISC,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _misc(self):
+        self._begin('misc')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_TRANSACTION_END,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _transaction_end(self):
+        self._begin('transaction_end')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_CLOSEUP,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _closeup(self):
+        self._begin('closeup')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_CLEANUP,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _cleanup(self):
+        self._begin('cleanup')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_PRE_TERMINATE,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _pre_terminate(self):
+        self._begin('pre_terminate')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_TERMINATE,
+        priority=plugin.Stages.PRIORITY_FIRST,
+    )
+    def _terminate_begin(self):
+        self._begin('terminate')
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_TERMINATE,
+        priority=plugin.Stages.PRIORITY_LOW,
+    )
+    def _terminate(self):
+        # Close the last stage, what is left of terminate is negligible
+        self._begin(None)
+        log = self.environment.get(otopicons.CoreEnv.LOG_FILE_NAME)
+        path = self.environment[ohostedcons.CoreEnv.TIMELINE_FILE]
+        if path is None:
+            if log is None:
+                return
+            path = '{base}-timeline.json'.format(
+                base=os.path.splitext(log)[0],
+            )
+        try:
+            timeline.write(
+                path,
+                hostname=os.uname()[1],
+                log=log,
+                error=bool(self.environment[otopicons.BaseEnv.ERROR]),
+            )
+            self.logger.debug(
+                'Deployment timeline written to {path}'.format(path=path)
+            )
+        except (IOError, OSError) as e:
+            self.logger.warning(
+                _('Cannot write the deployment timeline: {e}').format(e=e)
+            )
+
+
+# vim: expandtab tabstop=4 shiftwidth=4
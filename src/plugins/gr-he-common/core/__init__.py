@@ -24,6 +24,7 @@ from otopi import util
 
 from . import answerfile
 from . import ha_notifications
+from . import log_retention
 from . import misc
 from . import remote_answerfile
 from . import shell
@@ -35,6 +36,7 @@ from . import vdsmconf
 def createPlugins(context):
     answerfile.Plugin(context=context)
     ha_notifications.Plugin(context=context)
+    log_retention.Plugin(context=context)
     misc.Plugin(context=context)
     remote_answerfile.Plugin(context=context)
     vdsmconf.Plugin(context=context)
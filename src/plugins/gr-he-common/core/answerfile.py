@@ -122,6 +122,7 @@ class Plugin(plugin.PluginBase):
     @plugin.event(
         stage=plugin.Stages.STAGE_CLEANUP,
         priority=plugin.Stages.PRIORITY_LAST,
+        name=ohostedcons.Stages.ANSWER_FILE_ARCHIVED,
     )
     def _save_answers_at_cleanup(self):
         self._answers.extend(
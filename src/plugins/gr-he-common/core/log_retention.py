@@ -0,0 +1,134 @@
+#
+# ovirt-hosted-engine-setup -- ovirt hosted engine setup
+# Copyright (C) 2017 Red Hat, Inc.
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# License as published by the Free Software Foundation; either
+# version 2.1 of the License, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public License for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# License along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301 USA
+#
+
+
+"""Log retention plugin."""
+
+
+import gettext
+
+from otopi import constants as otopicons
+from otopi import plugin
+from otopi import util
+
+from ovirt_hosted_engine_setup import constants as ohostedcons
+from ovirt_hosted_engine_setup import log_retention
+from ovirt_hosted_engine_setup import timeline
+
+
+def _(m):
+    return gettext.dgettext(message=m, domain='ovirt-hosted-engine-setup')
+
+
+@util.export
+class Plugin(plugin.PluginBase):
+    """
+    Log retention plugin.
+    Records the deployment in the index of the log dir, then compresses
+    and removes the logs of the old ones, see log_retention.
+    """
+
+    def __init__(self, context):
+        super(Plugin, self).__init__(context=context)
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_INIT,
+    )
+    def _init(self):
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.LOG_RETENTION_DAYS,
+            log_retention.MAX_AGE_DAYS
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.LOG_RETENTION_SIZE_MB,
+            log_retention.MAX_SIZE_MB
+        )
+        self.environment.setdefault(
+            ohostedcons.CoreEnv.LOG_RETENTION_UNCOMPRESSED,
+            log_retention.UNCOMPRESSED_RUNS
+        )
+
+    @plugin.event(
+        stage=plugin.Stages.STAGE_CLEANUP,
+        priority=plugin.Stages.PRIORITY_LAST,
+        after=(
+            ohostedcons.Stages.ANSWER_FILE_ARCHIVED,
+        ),
+        condition=lambda self: self.environment.get(
+            otopicons.CoreEnv.LOG_FILE_NAME
+        ),
+    )
+    def _cleanup(self):
+        logdir = self.environment[otopicons.CoreEnv.LOG_DIR]
+        log = self.environment[otopicons.CoreEnv.LOG_FILE_NAME]
+        error = self.environment[otopicons.BaseEnv.ERROR]
+        try:
+            runs = log_retention.update_index(
+                logdir,
+                (
+                    ohostedcons.FileLocations.
+                    OVIRT_HOSTED_ENGINE_ANSWERS_ARCHIVE_DIR
+                ),
+                self.environment[otopicons.CoreEnv.LOG_FILE_NAME_PREFIX],
+                current={
+                    'log': log,
+                    'status': (
+                        log_retention.STATUS_FAILED if error
+                        else log_retention.STATUS_SUCCESS
+                    ),
+                    'failed_task': (
+                        log_retention.failed_task(timeline.events())
+                        if error else None
+                    ),
+                },
+            )
+            removed = log_retention.apply_retention(
+                runs,
+                current=log_retention.run_id(log),
+                max_age_days=self.environment[
+                    ohostedcons.CoreEnv.LOG_RETENTION_DAYS
+                ],
+                max_size_mb=self.environment[
+                    ohostedcons.CoreEnv.LOG_RETENTION_SIZE_MB
+                ],
+                uncompressed_runs=self.environment[
+                    ohostedcons.CoreEnv.LOG_RETENTION_UNCOMPRESSED
+                ],
+            )
+            log_retention.remove_old_files(
+                ohostedcons.FileLocations.OVIRT_HOSTED_ENGINE_SPILL_DIR,
+                max_age_days=self.environment[
+                    ohostedcons.CoreEnv.LOG_RETENTION_DAYS
+                ],
+            )
+            log_retention.save_index(logdir, runs)
+            self.logger.debug(
+                'Log index updated, {n} runs, removed: {r}'.format(
+                    n=len(runs),
+                    r=removed,
+                )
+            )
+        except (IOError, OSError) as e:
+            self.logger.debug('Log retention failed', exc_info=True)
+            self.logger.warning(
+                _('Cannot apply the log retention: {e}').format(e=e)
+            )
+
+
+# vim: expandtab tabstop=4 shiftwidth=4